@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Deterministic synthetic data for the benchmarks.
+
+Every generator is seeded, so a given (scale, seed) always produces the
+same rows, and runs before and after a change see identical inputs:
+
+- `generate_bars`: daily OHLCV bars for every symbol on a shared
+  business-day calendar (geometric random walks), as BAR_DTYPE arrays.
+- `generate_trades`: rows shaped like `magi_core.trades`, priced from the
+  bars. A share of them lacks `exit_price` / `atr_at_execution`, so the
+  labeling scripts have work to do.
+- `generate_orders`: the closed Alpaca orders behind those trades (one buy
+  and one sell each); the sell's `client_order_id` is the trade's
+  `session_id`.
+- `generate_thoughts`: rows shaped like `magi_core.isabel_analysis` with
+  templated reasoning text.
+- `text_embeddings` / `generate_embeddings`: unit vectors derived from a
+  hash of each text (or from the seed), as served by the fake Cohere server.
+
+Usage:
+
+    dataset = generate_dataset(SCALES["100k"])
+    dataset.trades.to_parquet("trades.parquet")
+
+Prerequisites:
+- Required Python packages installed:
+  - pip install numpy pandas pyarrow
+"""
+
+import hashlib
+import os
+import sys
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from bar_store import BAR_DTYPE
+
+# --- Configuration ---
+SCALES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+DEFAULT_SEED = 20240101
+BARS_START = np.datetime64("2023-10-02")
+BARS_END = np.datetime64("2026-01-30")
+TRADES_START = np.datetime64("2024-01-02")
+TRADES_END = np.datetime64("2025-12-31")
+KNOWN_SYMBOLS = ["AAPL", "MSFT", "GOOGL", "NVDA", "META", "TSLA", "AMD", "IONQ", "SPY", "QQQ", "KTOS", "ONDS", "SES"]
+PROVIDERS = {
+    "mistral": "SOPHIA-5", "google": "MELCHIOR-1", "groq": "ANIMA", "deepseek": "CASPER", "together": "ORACLE",
+}
+PROMPT_VERSION = "5.0-constitution"
+# Share of trades that already have an exit price / an ATR.
+EXIT_PRICE_SHARE = 0.6
+ATR_SHARE = 0.6
+MAX_HOLDING_DAYS = 10
+EMBEDDING_DIM = 1024
+
+REASONING_PHRASES = [
+    "RSI is approaching oversold territory", "MACD crossed above the signal line",
+    "volume is well above the 20-day average", "price is testing the 20-day SMA",
+    "momentum is fading after a strong run", "the sector is showing relative strength",
+    "earnings are due next week", "the gap up was sold into", "support held at the prior low",
+    "risk/reward favors a small position", "breadth is weak across the index",
+    "出来高が急増している", "移動平均線を上抜けた", "ボラティリティが高いので慎重に",
+    "利益確定の売りが出ている", "トレンドは継続している",
+]
+
+
+@dataclass
+class Dataset:
+    """One generated scale: bars per symbol plus the tables and orders built on them."""
+    symbols: list[str]
+    bars: dict[str, np.ndarray]
+    trades: pd.DataFrame
+    orders: pd.DataFrame
+    thoughts: pd.DataFrame
+
+
+def symbols_for(n_trades: int) -> list[str]:
+    """The known MAGI symbols, padded with synthetic tickers for larger scales."""
+    count = int(np.clip(n_trades // 200, len(KNOWN_SYMBOLS), 500))
+    return KNOWN_SYMBOLS + [f"S{i:04d}" for i in range(count - len(KNOWN_SYMBOLS))]
+
+
+def business_days(start: np.datetime64 = BARS_START, end: np.datetime64 = BARS_END) -> np.ndarray:
+    """Weekdays from start through end; holidays are not modelled."""
+    days = np.arange(start, end + 1, dtype="datetime64[D]")
+    return days[np.is_busday(days)]
+
+
+def generate_bars(symbols: list[str], seed: int = DEFAULT_SEED) -> dict[str, np.ndarray]:
+    """Daily bars for every symbol on the shared business-day calendar."""
+    days = business_days()
+    out = {}
+    for i, symbol in enumerate(symbols):
+        rng = np.random.default_rng([seed, i])
+        vol = rng.uniform(0.01, 0.04)
+        close = rng.uniform(5, 500) * np.exp(np.cumsum(rng.normal(0.0003, vol, len(days))))
+        open_ = np.concatenate([[close[0]], close[:-1]]) * (1 + rng.normal(0, vol / 4, len(days)))
+        high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, vol / 2, len(days))))
+        low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, vol / 2, len(days))))
+        bars = np.empty(len(days), dtype=BAR_DTYPE)
+        bars["date"], bars["open"], bars["high"], bars["low"], bars["close"] = days, open_, high, low, close
+        bars["volume"] = np.round(rng.lognormal(14, 0.6, len(days)))
+        out[symbol] = bars
+    return out
+
+
+def _timestamps(days: np.ndarray, rng: np.random.Generator) -> pd.DatetimeIndex:
+    """Random times during US market hours (14:30-21:00 UTC) on the given days."""
+    seconds = rng.integers(14 * 3600 + 1800, 21 * 3600, len(days))
+    return pd.to_datetime(days.astype("datetime64[s]") + seconds.astype("timedelta64[s]"), utc=True)
+
+
+def generate_trades(n: int, symbols: list[str], bars: dict[str, np.ndarray],
+                    seed: int = DEFAULT_SEED) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Returns `n` trades and their closed orders.
+
+    Symbols follow a Zipf-like popularity so a few symbols carry most trades,
+    as in production.
+    """
+    rng = np.random.default_rng(seed)
+    days = bars[symbols[0]]["date"]
+    closes = np.stack([bars[s]["close"] for s in symbols])
+    ranges = np.stack([bars[s]["high"] - bars[s]["low"] for s in symbols])
+
+    weights = 1.0 / np.arange(1, len(symbols) + 1)
+    sym = rng.choice(len(symbols), n, p=weights / weights.sum())
+    first, last = np.searchsorted(days, [TRADES_START, TRADES_END])
+    day = rng.integers(first, last, n)
+    exit_day = np.minimum(day + rng.integers(1, MAX_HOLDING_DAYS + 1, n), len(days) - 1)
+
+    price = np.round(closes[sym, day] * (1 + rng.normal(0, 0.002, n)), 2)
+    exit_price = np.round(closes[sym, exit_day], 2)
+    atr = np.round(ranges[sym, day], 4)
+    has_exit = rng.random(n) < EXIT_PRICE_SHARE
+    has_atr = rng.random(n) < ATR_SHARE
+    provider = rng.choice(list(PROVIDERS), n)
+    session_id = np.char.add("bench-", np.char.zfill(np.arange(n).astype(str), 8))
+    timestamp = _timestamps(days[day], rng)
+    null_string = pd.Series([None] * n, dtype="string")
+
+    trades = pd.DataFrame({
+        "session_id": session_id,
+        "timestamp": timestamp,
+        "order_id": np.char.add("ord-", np.char.zfill(np.arange(n).astype(str), 8)),
+        "symbol": np.asarray(symbols)[sym],
+        "side": np.where(rng.random(n) < 0.8, "buy", "sell"),
+        "qty": rng.integers(1, 100, n),
+        "price": price,
+        "filled_avg_price": price,
+        "exit_price": np.where(has_exit, exit_price, np.nan),
+        "atr_at_execution": np.where(has_atr, atr, np.nan),
+        "reason": rng.choice(REASONING_PHRASES, n),
+        "llm_provider": provider,
+        "unit_name": pd.Series(provider).map(PROVIDERS).to_numpy(),
+        "trade_mode": rng.choice(["NORMAL", "SCALPING"], n, p=[0.8, 0.2]),
+        "prompt_version": PROMPT_VERSION,
+        "result": null_string,
+        "return_pct": np.nan,
+        "eval_rule_version": null_string,
+        "eval_fingerprint": pd.Series([None] * n, dtype="Int64"),
+        "evaluated_at": pd.Series(pd.NaT, index=range(n), dtype="datetime64[us, UTC]"),
+    })
+
+    exit_timestamp = _timestamps(days[exit_day], rng)
+    orders = pd.DataFrame({
+        "id": np.concatenate([np.char.add("buy-", session_id), np.char.add("sell-", session_id)]),
+        "client_order_id": np.concatenate([np.char.add(session_id, "-entry"), session_id]),
+        "symbol": np.tile(trades["symbol"].to_numpy(), 2),
+        "side": np.repeat(["buy", "sell"], n),
+        "qty": np.tile(trades["qty"].to_numpy(), 2),
+        "filled_avg_price": np.concatenate([price, exit_price]),
+        "submitted_at": np.concatenate([timestamp.to_numpy(), exit_timestamp.to_numpy()]),
+    }).sort_values(["submitted_at", "id"], ignore_index=True)
+    return trades, orders
+
+
+def generate_thoughts(n: int, symbols: list[str], seed: int = DEFAULT_SEED) -> pd.DataFrame:
+    """Rows shaped like `magi_core.isabel_analysis` with templated reasoning."""
+    rng = np.random.default_rng([seed, 1])
+    sym = np.asarray(symbols)[rng.integers(0, len(symbols), n)]
+    phrases = rng.integers(0, len(REASONING_PHRASES), (n, 4))
+    rsi = rng.uniform(15, 85, n)
+    reasoning = [
+        f"{s}: RSI {r:.1f}. " + ". ".join(REASONING_PHRASES[j] for j in p) + "."
+        for s, r, p in zip(sym, rsi, phrases)
+    ]
+    result = rng.choice(np.array(["WIN", "LOSE", "HOLD", None], dtype=object), n, p=[0.3, 0.25, 0.2, 0.25])
+    return pd.DataFrame({
+        "symbol": sym,
+        "result": pd.Series(result, dtype="string"),
+        "return_pct": np.round(rng.normal(0.3, 3.0, n), 2),
+        "confidence": np.round(rng.uniform(0.4, 0.95, n), 2),
+        "reasoning": reasoning,
+        "current_price": np.where(rng.random(n) < 0.9, np.round(rng.uniform(5, 500, n), 2), np.nan),
+        "timestamp": _timestamps(rng.choice(business_days(TRADES_START, TRADES_END), n), rng),
+    })
+
+
+def text_embeddings(texts: list[str], dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """One unit vector per text, derived from its hash (the same text always maps to the same vector)."""
+    out = np.empty((len(texts), dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        out[i] = np.random.default_rng(list(digest[:16])).standard_normal(dim)
+    return out / np.linalg.norm(out, axis=1, keepdims=True)
+
+
+def generate_embeddings(n: int, dim: int = EMBEDDING_DIM, seed: int = DEFAULT_SEED,
+                        clusters: int = 16) -> np.ndarray:
+    """`n` unit vectors scattered around `clusters` random centers, for index benchmarks."""
+    rng = np.random.default_rng([seed, 2])
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    out = centers[rng.integers(0, clusters, n)] + rng.standard_normal((n, dim), dtype=np.float32)
+    return out / np.linalg.norm(out, axis=1, keepdims=True)
+
+
+def generate_dataset(n: int, seed: int = DEFAULT_SEED) -> Dataset:
+    """Bars, `n` trades with their orders, and `n` thoughts."""
+    symbols = symbols_for(n)
+    bars = generate_bars(symbols, seed)
+    trades, orders = generate_trades(n, symbols, bars, seed)
+    return Dataset(symbols, bars, trades, orders, generate_thoughts(n, symbols, seed))
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Local fake Alpaca and Cohere HTTP servers for the benchmarks.
+
+Both servers run in a background thread on 127.0.0.1 and serve a
+`datagen.Dataset`, so the scripts, `alpaca_trade_api.REST`,
+`alpaca_client.AlpacaClient` and the Cohere SDK talk to them unchanged once
+their base URLs point here (APCA_API_BASE_URL / APCA_API_DATA_URL /
+CO_API_URL).
+
+Each request sleeps `latency` seconds, to stand in for the network round
+trip, and draws from a token bucket of `rate_per_minute` requests.
+Requests beyond the limit get a 429 with `Retry-After`, like the real
+APIs. `counts` tracks requests per endpoint plus `throttled`.
+
+Endpoints:
+
+- Alpaca: `GET /v2/stocks/{symbol}/bars` and `GET /v2/stocks/bars` (paged
+  with `page_token`), `GET /v2/stocks/snapshots`, `GET /v2/orders` (`status`, `after`, `until`,
+  `direction`, `limit`) and `GET /v2/orders/{id}`.
+- Cohere: `POST /v2/embed` with any of the float / int8 / uint8 / binary /
+  ubinary embedding types (at most 96 texts per request).
+
+Usage:
+
+    with FakeAlpacaServer(dataset, latency=0.05, rate_per_minute=200) as alpaca:
+        os.environ["APCA_API_BASE_URL"] = alpaca.url
+        ...
+        print(alpaca.counts)
+
+Prerequisites:
+- Required Python packages installed:
+  - pip install numpy pandas
+"""
+
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+from datagen import EMBEDDING_DIM, Dataset, text_embeddings
+
+# --- Configuration ---
+MAX_BARS_PAGE = 10000
+MAX_ORDERS_PAGE = 500
+MAX_EMBED_TEXTS = 96
+
+
+class RateLimiter:
+    """A token bucket refilled at `rate_per_minute`; None disables limiting."""
+
+    def __init__(self, rate_per_minute: float | None, burst: float = 10):
+        self.rate = rate_per_minute / 60.0 if rate_per_minute else None
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Takes a token; returns 0, or the seconds until one is available."""
+        if self.rate is None:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body, headers: dict | None = None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _dispatch(self, method: str):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        body = None
+        if method == "POST":
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(fake.latency)
+        wait = fake.limiter.acquire()
+        if wait:
+            fake.count("throttled")
+            self._send(429, {"message": "too many requests"}, {"Retry-After": f"{wait:.2f}"})
+            return
+        try:
+            status, response = fake.handle(method, url.path, {k: v[-1] for k, v in parse_qs(url.query).items()}, body)
+        except Exception as e:
+            status, response = 500, {"message": str(e)}
+        self._send(status, response)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+
+class FakeServer:
+    """Base class: a threaded HTTP server with latency, rate limiting and request counts."""
+
+    def __init__(self, latency: float = 0.0, rate_per_minute: float | None = None):
+        self.latency = latency
+        self.limiter = RateLimiter(rate_per_minute)
+        self.counts: Counter = Counter()
+        self._counts_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, endpoint: str):
+        with self._counts_lock:
+            self.counts[endpoint] += 1
+
+    def reset_counts(self):
+        with self._counts_lock:
+            self.counts.clear()
+
+    def handle(self, method: str, path: str, params: dict, body) -> tuple[int, object]:
+        raise NotImplementedError
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _parse_time(value: str | None) -> np.datetime64 | None:
+    """An RFC 3339 timestamp or date as a naive UTC datetime64."""
+    if not value:
+        return None
+    ts = pd.Timestamp(value)
+    ts = ts.tz_convert("UTC") if ts.tzinfo else ts.tz_localize("UTC")
+    return ts.tz_localize(None).to_datetime64()
+
+
+def _bar_json(bar) -> dict:
+    return {
+        "t": f"{bar['date']}T05:00:00Z",
+        "o": round(float(bar["open"]), 4), "h": round(float(bar["high"]), 4),
+        "l": round(float(bar["low"]), 4), "c": round(float(bar["close"]), 4),
+        "v": int(bar["volume"]), "n": 1000, "vw": round(float(bar["close"]), 4),
+    }
+
+
+class FakeAlpacaServer(FakeServer):
+    """Serves a dataset's bars, snapshots and orders in the Alpaca wire format."""
+
+    def __init__(self, dataset: Dataset, latency: float = 0.0, rate_per_minute: float | None = None,
+                 open_orders: list[dict] | None = None):
+        super().__init__(latency, rate_per_minute)
+        self.bars = dataset.bars
+        orders = dataset.orders
+        self.order_times = orders["submitted_at"].dt.tz_localize(None).to_numpy().astype("datetime64[us]")
+        self.orders = {c: orders[c].to_numpy() for c in orders.columns}
+        self.open_orders = open_orders or []
+
+    def _order_json(self, i: int) -> dict:
+        submitted = f"{np.datetime_as_string(self.order_times[i], unit='us')}Z"
+        qty = str(int(self.orders["qty"][i]))
+        return {
+            "id": str(self.orders["id"][i]),
+            "client_order_id": str(self.orders["client_order_id"][i]),
+            "symbol": str(self.orders["symbol"][i]),
+            "side": str(self.orders["side"][i]),
+            "qty": qty, "filled_qty": qty,
+            "filled_avg_price": f"{self.orders['filled_avg_price'][i]:.2f}",
+            "type": "market", "time_in_force": "day", "status": "filled",
+            "created_at": submitted, "submitted_at": submitted, "filled_at": submitted,
+        }
+
+    def _bars(self, symbol: str, params: dict) -> tuple[int, object]:
+        self.count("bars")
+        bars = self.bars.get(symbol)
+        if bars is None:
+            return 200, {"bars": [], "symbol": symbol, "next_page_token": None}
+        start = _parse_time(params.get("start"))
+        end = _parse_time(params.get("end"))
+        lo = np.searchsorted(bars["date"], np.datetime64(start, "D")) if start is not None else 0
+        hi = np.searchsorted(bars["date"], np.datetime64(end, "D"), side="right") if end is not None else len(bars)
+        lo = max(lo, int(params.get("page_token") or 0))
+        limit = min(int(params.get("limit") or 1000), MAX_BARS_PAGE)
+        page = bars[lo:min(hi, lo + limit)]
+        token = str(lo + limit) if lo + limit < hi else None
+        return 200, {"bars": [_bar_json(b) for b in page], "symbol": symbol, "next_page_token": token}
+
+    def _multi_bars(self, params: dict) -> tuple[int, object]:
+        """Multi-symbol bars, paged across symbols in request order like Alpaca's."""
+        self.count("multi_bars")
+        start = _parse_time(params.get("start"))
+        end = _parse_time(params.get("end"))
+        limit = min(int(params.get("limit") or 1000), MAX_BARS_PAGE)
+        # The page token is "<symbol index>:<bar offset>".
+        sym_idx, offset = (int(x) for x in (params.get("page_token") or "0:0").split(":"))
+        symbols = (params.get("symbols") or "").split(",")
+        out = {}
+        while sym_idx < len(symbols) and limit > 0:
+            bars = self.bars.get(symbols[sym_idx])
+            if bars is not None:
+                lo = np.searchsorted(bars["date"], np.datetime64(start, "D")) if start is not None else 0
+                hi = np.searchsorted(bars["date"], np.datetime64(end, "D"), side="right") if end is not None else len(bars)
+                page = bars[lo + offset:min(hi, lo + offset + limit)]
+                if len(page):
+                    out[symbols[sym_idx]] = [_bar_json(b) for b in page]
+                limit -= len(page)
+                if lo + offset + len(page) < hi:
+                    offset += len(page)
+                    break
+            sym_idx, offset = sym_idx + 1, 0
+        token = f"{sym_idx}:{offset}" if sym_idx < len(symbols) else None
+        return 200, {"bars": out, "next_page_token": token}
+
+    def _snapshots(self, params: dict) -> tuple[int, object]:
+        self.count("snapshots")
+        out = {}
+        for symbol in (params.get("symbols") or "").split(","):
+            bars = self.bars.get(symbol)
+            if bars is None or len(bars) < 2:
+                continue
+            daily, prev = _bar_json(bars[-1]), _bar_json(bars[-2])
+            out[symbol] = {
+                "latestTrade": {"t": daily["t"], "p": daily["c"], "s": 100},
+                "dailyBar": daily, "prevDailyBar": prev, "minuteBar": daily,
+            }
+        return 200, out
+
+    def _orders(self, params: dict) -> tuple[int, object]:
+        self.count("orders")
+        if params.get("status") == "open":
+            return 200, self.open_orders
+        after, until = _parse_time(params.get("after")), _parse_time(params.get("until"))
+        lo = np.searchsorted(self.order_times, np.datetime64(after, "us"), side="right") if after is not None else 0
+        hi = np.searchsorted(self.order_times, np.datetime64(until, "us")) if until is not None else len(self.order_times)
+        limit = min(int(params.get("limit") or 50), MAX_ORDERS_PAGE)
+        if params.get("direction", "desc") == "asc":
+            indices = range(lo, min(hi, lo + limit))
+        else:
+            indices = range(hi - 1, max(lo, hi - limit) - 1, -1)
+        return 200, [self._order_json(i) for i in indices]
+
+    def _order(self, order_id: str) -> tuple[int, object]:
+        self.count("order")
+        for order in self.open_orders:
+            if order["id"] == order_id:
+                return 200, order
+        matches = np.flatnonzero(self.orders["id"].astype(str) == order_id)
+        if not len(matches):
+            return 404, {"message": f"order not found for {order_id}"}
+        return 200, self._order_json(int(matches[0]))
+
+    def handle(self, method, path, params, body):
+        parts = path.strip("/").split("/")
+        if parts[:2] == ["v2", "stocks"] and len(parts) == 4 and parts[3] == "bars":
+            return self._bars(parts[2], params)
+        if parts == ["v2", "stocks", "bars"]:
+            return self._multi_bars(params)
+        if parts == ["v2", "stocks", "snapshots"]:
+            return self._snapshots(params)
+        if parts == ["v2", "orders"]:
+            return self._orders(params)
+        if parts[:2] == ["v2", "orders"] and len(parts) == 3:
+            return self._order(parts[2])
+        return 404, {"message": f"not found: {path}"}
+
+
+class FakeCohereServer(FakeServer):
+    """Serves `POST /v2/embed` with hash-derived unit vectors (see `datagen.text_embeddings`)."""
+
+    def __init__(self, latency: float = 0.0, rate_per_minute: float | None = None, dim: int = EMBEDDING_DIM):
+        super().__init__(latency, rate_per_minute)
+        self.dim = dim
+
+    def _embed(self, body: dict) -> tuple[int, object]:
+        self.count("embed")
+        texts = body.get("texts") or []
+        if len(texts) > MAX_EMBED_TEXTS:
+            return 400, {"message": f"too many texts: {len(texts)} > {MAX_EMBED_TEXTS}"}
+        vectors = text_embeddings(texts, self.dim)
+        codes = np.clip(np.round(vectors * 127 / np.abs(vectors).max(axis=1, keepdims=True)), -128, 127)
+        bits = np.packbits(vectors > 0, axis=1)
+        by_type = {
+            # Six decimals, about what Cohere returns, and half the JSON of a full float repr.
+            "float": np.round(vectors.astype(np.float64), 6).tolist(),
+            "int8": codes.astype(int).tolist(),
+            "uint8": (codes + 128).astype(int).tolist(),
+            "binary": (bits.astype(np.int16) - 128).tolist(),
+            "ubinary": bits.astype(int).tolist(),
+        }
+        types = body.get("embedding_types") or ["float"]
+        return 200, {
+            "id": str(uuid.uuid4()),
+            "texts": texts,
+            "embeddings": {t: by_type[t] for t in types},
+            "meta": {"api_version": {"version": "2"}, "billed_units": {"input_tokens": sum(len(t) // 4 for t in texts)}},
+            "response_type": "embeddings_by_type",
+        }
+
+    def handle(self, method, path, params, body):
+        if method == "POST" and path.rstrip("/") == "/v2/embed":
+            return self._embed(body)
+        return 404, {"message": f"not found: {path}"}
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks the batch scripts on synthetic data, without touching Alpaca,
+Cohere or BigQuery.
+
+For each scale (1k / 100k / 1m trades and thoughts) the suite generates a
+deterministic dataset (`datagen.py`), starts fake Alpaca and Cohere servers
+(`fake_servers.py`) with the configured latency and rate limits, and runs
+each script in its own process (`script_runner.py`) against a fresh DuckDB
+copy of the trades and isabel_analysis tables. The bar store and embedding
+cache start empty, so every run is a cold run.
+
+Reported per script:
+
+- wall_s: time spent in the script's `main()`.
+- process_s: wall time of the whole process, including imports.
+- alpaca / cohere: requests served by the fake servers (429s included).
+- throttled: requests answered with 429.
+- queries / dml_jobs: SQL statements run by the local backend, and how many
+  of them were INSERT / UPDATE / DELETE / MERGE.
+- peak_rss_mb: peak resident set size of the script's process.
+
+`--output` saves the results as JSON; `--baseline` compares against a saved
+run and prints the relative change of every metric.
+
+Usage:
+
+    python benchmarks/run.py --scale 1k 100k --output after.json --baseline before.json
+    python benchmarks/run.py --scripts backfill_atr --latency 0.1 --alpaca-rate 200
+
+Prerequisites:
+- Required Python packages installed:
+  - pip install alpaca-trade-api cohere duckdb google-cloud-bigquery numpy pandas pyarrow
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datagen import DEFAULT_SEED, SCALES, generate_dataset
+from fake_servers import FakeAlpacaServer, FakeCohereServer
+from duckdb_backend import DuckDBClient
+
+# --- Configuration ---
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+TRADES_TABLE = "screen-share-459802.magi_core.trades"
+THOUGHTS_TABLE = "screen-share-459802.magi_core.isabel_analysis"
+# Script -> arguments; {work} is the scenario's scratch directory.
+SCENARIOS = {
+    "update_exit_prices": ["--sync", "--since", "2020-01-01", "--watermark", "{work}/watermark.json"],
+    "backfill_atr": ["--stream", "--reset-checkpoint", "--checkpoint", "{work}/checkpoint.json",
+                     "--bar-store", "{work}/bars"],
+    "evaluate_trades": [],
+    "isabel_embed_only": [],
+}
+METRICS = ("wall_s", "process_s", "alpaca", "cohere", "throttled", "queries", "dml_jobs", "peak_rss_mb")
+
+
+def write_dataset(scale: str, seed: int, data_dir: str):
+    """Generates one scale and saves its tables as Parquet; returns the dataset."""
+    start = time.perf_counter()
+    dataset = generate_dataset(SCALES[scale], seed)
+    os.makedirs(data_dir, exist_ok=True)
+    dataset.trades.to_parquet(os.path.join(data_dir, "trades.parquet"))
+    dataset.thoughts.to_parquet(os.path.join(data_dir, "thoughts.parquet"))
+    print(f"[{scale}] generated {len(dataset.trades)} trades, {len(dataset.orders)} orders, "
+          f"{len(dataset.thoughts)} thoughts over {len(dataset.symbols)} symbols "
+          f"in {time.perf_counter() - start:.1f}s")
+    return dataset
+
+
+def seed_database(db_path: str, data_dir: str):
+    """Creates a fresh DuckDB file holding the generated tables."""
+    client = DuckDBClient(db_path)
+    client.load_parquet(TRADES_TABLE, os.path.join(data_dir, "trades.parquet"))
+    client.load_parquet(THOUGHTS_TABLE, os.path.join(data_dir, "thoughts.parquet"))
+    client.close()
+
+
+def run_scenario(script: str, data_dir: str, work_dir: str, alpaca: FakeAlpacaServer,
+                 cohere: FakeCohereServer) -> dict:
+    """Runs one script in a child process and collects its metrics."""
+    os.makedirs(work_dir, exist_ok=True)
+    db_path = os.path.join(work_dir, "bench.duckdb")
+    stats_path = os.path.join(work_dir, "stats.json")
+    log_path = os.path.join(work_dir, f"{script}.log")
+    seed_database(db_path, data_dir)
+
+    env = dict(
+        os.environ,
+        APCA_API_BASE_URL=alpaca.url, APCA_API_DATA_URL=alpaca.url,
+        APCA_API_KEY_ID="bench", APCA_API_SECRET_KEY="bench",
+        CO_API_URL=cohere.url, COHERE_API_KEY="bench",
+        MAGI_BAR_STORE_DIR=os.path.join(work_dir, "bars"),
+        MAGI_EMBEDDING_CACHE=os.path.join(work_dir, "embeddings.sqlite"),
+    )
+    argv = [a.format(work=work_dir) for a in SCENARIOS[script]]
+    command = [sys.executable, os.path.join(BENCHMARKS_DIR, "script_runner.py"), script,
+               "--db", db_path, "--stats", stats_path, "--", *argv]
+
+    alpaca.reset_counts()
+    cohere.reset_counts()
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        returncode = subprocess.run(command, env=env, stdout=log, stderr=subprocess.STDOUT).returncode
+    process_s = time.perf_counter() - start
+
+    stats = {"status": f"crashed (exit {returncode})"}
+    if os.path.exists(stats_path):
+        with open(stats_path) as f:
+            stats = json.load(f)
+    stats.update(
+        process_s=round(process_s, 3),
+        alpaca=sum(n for k, n in alpaca.counts.items() if k != "throttled"),
+        cohere=sum(n for k, n in cohere.counts.items() if k != "throttled"),
+        throttled=alpaca.counts["throttled"] + cohere.counts["throttled"],
+        log=log_path,
+    )
+    return stats
+
+
+def print_results(results: list[dict]):
+    """Prints one row per (scale, script)."""
+    header = f"{'scale':<6} {'script':<20} " + " ".join(f"{m:>11}" for m in METRICS) + "  status"
+    print("\n" + header)
+    print("-" * len(header))
+    for r in results:
+        values = " ".join(f"{r.get(m, ''):>11}" for m in METRICS)
+        print(f"{r['scale']:<6} {r['script']:<20} {values}  {r['status']}")
+
+
+def print_comparison(results: list[dict], baseline: list[dict]):
+    """Prints the relative change of every metric against a saved run."""
+    previous = {(r["scale"], r["script"]): r for r in baseline}
+    print("\nChange vs baseline (negative is better):")
+    for r in results:
+        before = previous.get((r["scale"], r["script"]))
+        if before is None:
+            continue
+        changes = []
+        for m in METRICS:
+            old, new = before.get(m), r.get(m)
+            if isinstance(old, (int, float)) and isinstance(new, (int, float)) and old:
+                changes.append(f"{m} {100 * (new - old) / old:+.1f}%")
+            elif old != new:
+                changes.append(f"{m} {old} -> {new}")
+        print(f"  {r['scale']:<6} {r['script']:<20} " + (", ".join(changes) or "unchanged"))
+
+
+def parse_args() -> argparse.Namespace:
+    """Parses command-line options."""
+    parser = argparse.ArgumentParser(description="Benchmark the batch scripts on synthetic data.")
+    parser.add_argument("--scale", nargs="+", choices=list(SCALES), default=["1k"], help="Dataset sizes to run.")
+    parser.add_argument("--scripts", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS),
+                        help="Scripts to benchmark (default: all).")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Seed of the synthetic data.")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every fake API request.")
+    parser.add_argument("--alpaca-rate", type=float, help="Fake Alpaca requests per minute (Alpaca allows 200).")
+    parser.add_argument("--cohere-rate", type=float, help="Fake Cohere requests per minute.")
+    parser.add_argument("--work-dir", help="Scratch directory to keep (default: a temporary one, removed afterwards).")
+    parser.add_argument("--output", help="Save the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare against results saved with --output.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    work_root = args.work_dir or tempfile.mkdtemp(prefix="magi-bench-")
+    results = []
+    try:
+        for scale in args.scale:
+            data_dir = os.path.join(work_root, scale, "data")
+            dataset = write_dataset(scale, args.seed, data_dir)
+            with FakeAlpacaServer(dataset, args.latency, args.alpaca_rate) as alpaca, \
+                    FakeCohereServer(args.latency, args.cohere_rate) as cohere:
+                for script in args.scripts:
+                    print(f"[{scale}] running {script}...")
+                    stats = run_scenario(script, data_dir, os.path.join(work_root, scale, script), alpaca, cohere)
+                    results.append({"scale": scale, "script": script, **stats})
+                    if stats["status"] != "ok":
+                        print(f"[{scale}] {script} {stats['status']}; see {stats['log']}")
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_root, ignore_errors=True)
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.output}.")
+    if args.baseline:
+        with open(args.baseline) as f:
+            print_comparison(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
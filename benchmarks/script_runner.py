@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Runs one script's `main()` in a fresh process against the local backend
+and writes its stats as JSON. `run.py` starts one of these per benchmark,
+so every script gets its own interpreter and its own peak RSS.
+
+Before `main()` runs:
+
+- `bigquery.Client` is replaced by a factory returning a single
+  `duckdb_backend.DuckDBClient` on `--db`, so the script's SQL runs
+  locally and its queries and DML statements are counted.
+- A module-level `ALPACA_API_BASE_URL` is pointed at APCA_API_BASE_URL,
+  since the scripts pass it to `tradeapi.REST` explicitly.
+
+Usage (normally invoked by run.py):
+
+    python benchmarks/script_runner.py evaluate_trades --db bench.duckdb --stats stats.json -- [script args]
+
+Prerequisites:
+- Required Python packages installed:
+  - pip install duckdb google-cloud-bigquery
+"""
+
+import argparse
+import importlib
+import json
+import os
+import resource
+import sys
+import time
+import traceback
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+sys.path.insert(0, SCRIPTS_DIR)
+
+
+def install_local_backend(db_path: str):
+    """Makes every `bigquery.Client(...)` in this process return one DuckDB client on `db_path`."""
+    from google.cloud import bigquery
+    from duckdb_backend import DuckDBClient
+
+    client = DuckDBClient(db_path)
+    bigquery.Client = lambda *args, **kwargs: client
+    return client
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def parse_args() -> tuple[argparse.Namespace, list[str]]:
+    """Parses the runner's options; everything after `--` is passed to the script."""
+    parser = argparse.ArgumentParser(description="Run one script against the local benchmark backend.")
+    parser.add_argument("script", help="Module name in scripts/, e.g. evaluate_trades.")
+    parser.add_argument("--db", required=True, help="DuckDB file standing in for BigQuery.")
+    parser.add_argument("--stats", required=True, help="Where to write the run's stats as JSON.")
+    argv = sys.argv[1:]
+    split = argv.index("--") if "--" in argv else len(argv)
+    return parser.parse_args(argv[:split]), argv[split + 1:]
+
+
+def main():
+    args, script_argv = parse_args()
+    client = install_local_backend(args.db)
+    module = importlib.import_module(args.script)
+    if hasattr(module, "ALPACA_API_BASE_URL") and os.environ.get("APCA_API_BASE_URL"):
+        module.ALPACA_API_BASE_URL = os.environ["APCA_API_BASE_URL"]
+
+    sys.argv = [f"{args.script}.py", *script_argv]
+    status = "ok"
+    start = time.perf_counter()
+    try:
+        module.main()
+    except (Exception, SystemExit) as e:
+        traceback.print_exc()
+        status = f"error: {type(e).__name__}: {e}"
+    wall = time.perf_counter() - start
+
+    with open(args.stats, "w") as f:
+        json.dump({
+            "status": status,
+            "wall_s": round(wall, 3),
+            "queries": client.query_count,
+            "dml_jobs": client.dml_count,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }, f)
+
+if __name__ == "__main__":
+    main()
@@ -133,29 +133,51 @@ async function getVixRegime() {
 }
 
 // === ISABEL: Dynamic Stats from BigQuery ===
+// Stats read magi_analytics.trade_outcomes_daily, per-day aggregates that
+// scripts/evaluate_trades.py keeps up to date (scripts/trade_outcomes.py).
+// Until that table exists and has rows, e.g. on the first start after a
+// deploy, they fall back to grouping over magi_core.trades.
 let isabelStats = null;
+let outcomeAggregatesReady = null;
+
+async function hasOutcomeAggregates() {
+  if (outcomeAggregatesReady === null) {
+    try {
+      const [rows] = await bigquery.query({ query: `SELECT COUNT(*) as n FROM magi_analytics.trade_outcomes_daily` });
+      outcomeAggregatesReady = Number(rows?.[0]?.n) > 0;
+    } catch (e) {
+      outcomeAggregatesReady = false;
+    }
+    if (!outcomeAggregatesReady) console.log('[ISABEL] Outcome aggregates missing or empty, using live trades queries');
+  }
+  return outcomeAggregatesReady;
+}
 
 async function getIsabelStats() {
   try {
     console.log('[ISABEL] Fetching latest stats from BigQuery...');
+    const aggregated = await hasOutcomeAggregates();
+    const wins = aggregated ? `SUM(wins)` : `COUNTIF(result = 'WIN')`;
+    const loses = aggregated ? `SUM(loses)` : `COUNTIF(result = 'LOSE')`;
+    const source = aggregated
+      ? `magi_analytics.trade_outcomes_daily WHERE side IS NOT NULL`
+      : `magi_core.trades WHERE result IS NOT NULL AND side IS NOT NULL`;
     const [dirRows] = await bigquery.query({ query: `
       SELECT llm_provider, side,
-        COUNTIF(result = 'WIN') as wins,
-        COUNTIF(result = 'LOSE') as loses,
-        ROUND(SAFE_DIVIDE(COUNTIF(result = 'WIN'), COUNTIF(result = 'WIN') + COUNTIF(result = 'LOSE')) * 100, 1) as win_rate
-      FROM magi_core.trades
-      WHERE result IS NOT NULL AND side IS NOT NULL
+        ${wins} as wins,
+        ${loses} as loses,
+        ROUND(SAFE_DIVIDE(${wins}, ${wins} + ${loses}) * 100, 1) as win_rate
+      FROM ${source}
       GROUP BY llm_provider, side
     ` });
     const [symRows] = await bigquery.query({ query: `
       SELECT symbol,
-        COUNTIF(result = 'WIN') as wins,
-        COUNTIF(result = 'LOSE') as loses,
-        ROUND(SAFE_DIVIDE(COUNTIF(result = 'WIN'), COUNTIF(result = 'WIN') + COUNTIF(result = 'LOSE')) * 100, 1) as win_rate
-      FROM magi_core.trades
-      WHERE result IS NOT NULL AND side IS NOT NULL
+        ${wins} as wins,
+        ${loses} as loses,
+        ROUND(SAFE_DIVIDE(${wins}, ${wins} + ${loses}) * 100, 1) as win_rate
+      FROM ${source}
       GROUP BY symbol
-      HAVING (COUNTIF(result = 'WIN') + COUNTIF(result = 'LOSE')) >= 2
+      HAVING (${wins} + ${loses}) >= 2
       ORDER BY win_rate DESC
     ` });
     const dirMap = {};
@@ -527,17 +549,26 @@ async function getRealtimeFeedback(provider) {
       ORDER BY timestamp DESC LIMIT 5
     ` });
     
-    // プロバイダーの直近勝率
-    const [stats] = await bigquery.query({ query: `
+    // プロバイダーの直近勝率（今日を含む直近7暦日の集計）
+    const [stats] = await bigquery.query({ query: (await hasOutcomeAggregates()) ? `
+      SELECT 
+        COALESCE(SUM(wins), 0) as recent_wins,
+        COALESCE(SUM(loses), 0) as recent_loses,
+        ROUND(SUM(win_pnl_sum), 2) as total_profit,
+        ROUND(SUM(lose_pnl_sum), 2) as total_loss
+      FROM magi_analytics.trade_outcomes_daily
+      WHERE llm_provider = @provider
+        AND trade_date > DATE_SUB(CURRENT_DATE(), INTERVAL 7 DAY)
+    ` : `
       SELECT 
         COUNTIF(result = 'WIN') as recent_wins,
         COUNTIF(result = 'LOSE') as recent_loses,
         ROUND(SUM(CASE WHEN result = 'WIN' THEN (exit_price - filled_avg_price) * qty ELSE 0 END), 2) as total_profit,
         ROUND(SUM(CASE WHEN result = 'LOSE' THEN (exit_price - filled_avg_price) * qty ELSE 0 END), 2) as total_loss
       FROM magi_core.trades 
-      WHERE llm_provider = '${provider}' AND result IS NOT NULL
-        AND timestamp > TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 7 DAY)
-    ` });
+      WHERE llm_provider = @provider AND result IS NOT NULL
+        AND DATE(timestamp) > DATE_SUB(CURRENT_DATE(), INTERVAL 7 DAY)
+    `, params: { provider } });
     
     isabelRealtimeFeedback = {
       provider,
@@ -1709,6 +1740,43 @@ async function endSession(error = null) {
   }
 }
 
+// === ISABEL: Precomputed Artifact ===
+// scripts/isabel_artifact.py computes stats, patterns, quality, per-provider
+// feedback and embedding centroids once per schedule tick. Loading that row
+// replaces the sequential ISABEL queries below with a single read.
+const ISABEL_ARTIFACT_VERSION = 1;
+const ISABEL_ARTIFACT_MAX_AGE_MINUTES = Number(process.env.ISABEL_ARTIFACT_MAX_AGE_MINUTES || 180);
+
+async function loadIsabelArtifact(provider) {
+  try {
+    console.log('[ISABEL] Loading precomputed artifact...');
+    const [rows] = await bigquery.query({
+      query: `
+        SELECT payload
+        FROM magi_analytics.isabel_artifacts
+        WHERE artifact_version = @version
+          AND generated_at > TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @maxAge MINUTE)
+        ORDER BY generated_at DESC LIMIT 1
+      `,
+      params: { version: ISABEL_ARTIFACT_VERSION, maxAge: ISABEL_ARTIFACT_MAX_AGE_MINUTES }
+    });
+    if (!rows || rows.length === 0) { console.log('[ISABEL] No fresh artifact, using live queries'); return false; }
+
+    const artifact = JSON.parse(rows[0].payload);
+    isabelStats = artifact.stats || null;
+    isabelPatterns = artifact.patterns || null;
+    isabelQuality = artifact.quality || null;
+    isabelRealtimeFeedback = (artifact.feedback && artifact.feedback[provider]) ||
+      { provider, recentTrades: [], stats: { recent_wins: 0, recent_loses: 0, total_profit: null, total_loss: null } };
+    isabelEmbeddings = process.env.COHERE_API_KEY ? (artifact.embeddings || null) : null;
+    console.log('[ISABEL] Artifact loaded:', JSON.stringify({ generatedAt: artifact.generated_at, patterns: !!isabelPatterns, quality: !!isabelQuality, embeddings: !!isabelEmbeddings }));
+    return true;
+  } catch (e) {
+    console.error('[ISABEL] Artifact error:', e.message);
+    return false;
+  }
+}
+
 async function main() {
   console.log("=== MAGI Core v3.4 (" + getLLMProvider().toUpperCase() + ") ===\n");
   console.log("[PROMPT] Version: " + PROMPT_VERSION);
@@ -1716,11 +1784,13 @@ async function main() {
 
   try {
     await startSession();
-    await getIsabelStats();
-    await getIsabelPatterns();
-    await getIsabelQuality();
-    await getRealtimeFeedback(getLLMProvider());
-    await getIsabelEmbeddings();
+    if (!(await loadIsabelArtifact(getLLMProvider()))) {
+      await getIsabelStats();
+      await getIsabelPatterns();
+      await getIsabelQuality();
+      await getRealtimeFeedback(getLLMProvider());
+      await getIsabelEmbeddings();
+    }
 
     // ユニット別の自律的プロンプト
     // === MAGI CONSTITUTION v2.0 - Swing Trading North Star ===
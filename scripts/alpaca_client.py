@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+An asyncio Alpaca data/trading client for the batch scripts.
+
+`alpaca_trade_api.REST` issues one blocking request at a time, so a backfill
+over thousands of trades is bound by round-trip latency. `AlpacaClient`
+instead keeps a pool of keep-alive connections, runs up to
+`max_concurrency` requests at once and paces them with a token bucket so the
+account stays under Alpaca's 200 requests/minute limit. Responses with
+status 429 or 5xx, and requests whose connection drops, are retried with
+exponential backoff, honouring `Retry-After` when Alpaca sends it.
+
+The HTTP layer is a pluggable `Transport`. `AiohttpTransport` is used by
+default; tests and benchmarks can pass any object with the same `request`
+coroutine, or point the base URLs at a local fake server.
+
+Usage:
+
+    async with AlpacaClient() as client:
+        bars = await client.get_bars_many(["AAPL", "MSFT"], start, end)
+
+Prerequisites:
+- Alpaca API credentials set as environment variables
+  (APCA_API_KEY_ID / APCA_API_SECRET_KEY, or ALPACA_API_KEY / ALPACA_SECRET_KEY).
+- Required Python packages installed:
+  - pip install aiohttp
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from instrumentation import api_call, count
+
+# --- Configuration ---
+ALPACA_TRADING_BASE_URL = "https://paper-api.alpaca.markets"
+ALPACA_DATA_BASE_URL = "https://data.alpaca.markets"
+RATE_LIMIT_PER_MINUTE = 200
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_MAX_RETRIES = 5
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class Response:
+    """A minimal HTTP response as returned by a `Transport`."""
+    status: int
+    body: bytes
+    headers: dict[str, str] = field(default_factory=dict)
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class TransportError(Exception):
+    """A request failed before a response arrived (dropped connection, truncated body)."""
+
+
+class Transport:
+    """
+    Interface for the HTTP layer; implementations must be safe to call
+    concurrently and raise `TransportError` (or `OSError`) when a request
+    fails without a response, so that `AlpacaClient` retries it.
+    """
+
+    async def request(self, method: str, url: str, *, params: dict | None = None,
+                      headers: dict | None = None, json_body=None) -> Response:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class AiohttpTransport(Transport):
+    """Pooled keep-alive HTTP transport backed by `aiohttp`."""
+
+    def __init__(self, pool_size: int = DEFAULT_MAX_CONCURRENCY, timeout: float = 30.0):
+        self._pool_size = pool_size
+        self._timeout = timeout
+        self._session = None
+
+    async def _get_session(self):
+        if self._session is None:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._pool_size, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self._timeout),
+            )
+        return self._session
+
+    async def request(self, method, url, *, params=None, headers=None, json_body=None) -> Response:
+        import aiohttp
+        session = await self._get_session()
+        try:
+            async with session.request(method, url, params=params, headers=headers, json=json_body) as resp:
+                body = await resp.read()
+                return Response(resp.status, body, dict(resp.headers))
+        except aiohttp.ClientError as e:
+            # e.g. ServerDisconnectedError on a stale keep-alive connection,
+            # which is not an OSError.
+            raise TransportError(f"{type(e).__name__}: {e}") from e
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` tokens per second, at most `capacity` banked.
+
+    A small capacity keeps any 60-second window close to `rate * 60`
+    requests, which is what Alpaca's per-minute limit counts.
+    """
+
+    def __init__(self, rate: float, capacity: float = 5):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AlpacaAPIError(Exception):
+    """Raised when Alpaca returns a non-retryable error or retries are exhausted."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Alpaca API error {status}: {message}")
+        self.status = status
+
+
+def _iso(value) -> str | None:
+    if value is None:
+        return None
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+class AlpacaClient:
+    """
+    Concurrent, rate-limited Alpaca client.
+
+    Args:
+        key_id: API key; defaults to the APCA_API_KEY_ID / ALPACA_API_KEY env var.
+        secret_key: API secret; defaults to APCA_API_SECRET_KEY / ALPACA_SECRET_KEY.
+        transport: HTTP transport; defaults to a pooled `AiohttpTransport`.
+        max_concurrency: Maximum number of requests in flight.
+        rate_per_minute: Sustained request rate enforced by the token bucket.
+        max_retries: Retries per request on 429/5xx or connection errors.
+        trading_base_url: Base URL of the trading API; defaults to the
+            APCA_API_BASE_URL env var, like `alpaca_trade_api.REST`.
+        data_base_url: Base URL of the market data API; defaults to the
+            APCA_API_DATA_URL env var.
+    """
+
+    def __init__(self, key_id: str | None = None, secret_key: str | None = None,
+                 transport: Transport | None = None,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 rate_per_minute: float = RATE_LIMIT_PER_MINUTE,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 trading_base_url: str | None = None,
+                 data_base_url: str | None = None):
+        key_id = key_id or os.environ.get("APCA_API_KEY_ID") or os.environ.get("ALPACA_API_KEY")
+        secret_key = secret_key or os.environ.get("APCA_API_SECRET_KEY") or os.environ.get("ALPACA_SECRET_KEY")
+        self._headers = {
+            "APCA-API-KEY-ID": key_id or "",
+            "APCA-API-SECRET-KEY": secret_key or "",
+        }
+        self.transport = transport or AiohttpTransport(pool_size=max_concurrency)
+        trading_base_url = trading_base_url or os.environ.get("APCA_API_BASE_URL") or ALPACA_TRADING_BASE_URL
+        data_base_url = data_base_url or os.environ.get("APCA_API_DATA_URL") or ALPACA_DATA_BASE_URL
+        self.trading_base_url = trading_base_url.rstrip("/")
+        self.data_base_url = data_base_url.rstrip("/")
+        self.max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._bucket = TokenBucket(rate_per_minute / 60.0)
+        self.request_count = 0
+        self.retry_count = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await self.transport.close()
+
+    async def _request(self, method: str, url: str, params: dict | None = None, json_body=None):
+        """Sends one request with rate limiting, bounded concurrency and retries."""
+        params = {k: v for k, v in (params or {}).items() if v is not None}
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                await self._bucket.acquire()
+                self.request_count += 1
+                try:
+                    with api_call("alpaca", url.rstrip("/").rsplit("/", 1)[-1]):
+                        resp = await self.transport.request(
+                            method, url, params=params, headers=self._headers, json_body=json_body
+                        )
+                except (TransportError, OSError, asyncio.TimeoutError) as e:
+                    resp, error = None, str(e)
+                else:
+                    error = resp.body[:200].decode("utf-8", "replace")
+
+            if resp is not None and resp.status < 400:
+                return resp.json()
+            status = resp.status if resp is not None else 0
+            if (resp is not None and status not in RETRY_STATUSES) or attempt >= self.max_retries:
+                raise AlpacaAPIError(status, error)
+
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * (0.5 + random.random())
+            retry_after = resp.headers.get("Retry-After") if resp is not None else None
+            if retry_after:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+            attempt += 1
+            self.retry_count += 1
+            count("alpaca_retries_total", status=status or "connection")
+            print(f"  - Alpaca {status or 'connection error'} on {url}, retry {attempt}/{self.max_retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    # --- Market data ---
+
+    async def get_bars(self, symbol: str, start, end, timeframe: str = "1Day",
+                       adjustment: str = "raw", feed: str | None = None) -> list[dict]:
+        """Fetches all bars for one symbol, following `next_page_token`."""
+        url = f"{self.data_base_url}/v2/stocks/{symbol}/bars"
+        params = {
+            "timeframe": timeframe,
+            "start": _iso(start),
+            "end": _iso(end),
+            "adjustment": adjustment,
+            "feed": feed,
+            "limit": 10000,
+        }
+        bars = []
+        while True:
+            data = await self._request("GET", url, params)
+            bars.extend(data.get("bars") or [])
+            token = data.get("next_page_token")
+            if not token:
+                return bars
+            params["page_token"] = token
+
+    async def get_bars_many(self, symbols: list[str], start, end, **kwargs) -> dict[str, list[dict]]:
+        """Fetches bars for many symbols concurrently."""
+        results = await asyncio.gather(*(self.get_bars(s, start, end, **kwargs) for s in symbols))
+        return dict(zip(symbols, results))
+
+    async def get_bars_multi(self, symbols: list[str], start, end, timeframe: str = "1Day",
+                             adjustment: str = "raw", feed: str | None = None) -> dict[str, list[dict]]:
+        """Fetches bars for several symbols in one paged request sequence."""
+        url = f"{self.data_base_url}/v2/stocks/bars"
+        params = {
+            "symbols": ",".join(symbols),
+            "timeframe": timeframe,
+            "start": _iso(start),
+            "end": _iso(end),
+            "adjustment": adjustment,
+            "feed": feed,
+            "limit": 10000,
+        }
+        bars: dict[str, list[dict]] = {s: [] for s in symbols}
+        while True:
+            data = await self._request("GET", url, params)
+            for symbol, page in (data.get("bars") or {}).items():
+                bars.setdefault(symbol, []).extend(page)
+            token = data.get("next_page_token")
+            if not token:
+                return bars
+            params["page_token"] = token
+
+    async def get_snapshots(self, symbols: list[str], feed: str = "iex") -> dict[str, dict]:
+        """Fetches snapshots for several symbols in one request."""
+        url = f"{self.data_base_url}/v2/stocks/snapshots"
+        return await self._request("GET", url, {"symbols": ",".join(symbols), "feed": feed})
+
+    # --- Trading ---
+
+    async def list_orders(self, status: str = "closed", limit: int = 500, after=None, until=None,
+                          direction: str = "desc", nested: bool | None = None) -> list[dict]:
+        """Fetches one page of orders."""
+        url = f"{self.trading_base_url}/v2/orders"
+        params = {
+            "status": status,
+            "limit": limit,
+            "after": _iso(after),
+            "until": _iso(until),
+            "direction": direction,
+            "nested": None if nested is None else str(nested).lower(),
+        }
+        return await self._request("GET", url, params)
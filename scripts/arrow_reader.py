@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Columnar reads for the analytics scripts.
+
+A source yields Arrow record batches, and `iter_numpy_batches` turns each
+batch into NumPy arrays column by column, so no per-row `Row` objects or
+dicts are created:
+
+- `BigQuerySource` runs a query (or reads a table) and streams its result
+  through the BigQuery Storage Read API when `google-cloud-bigquery-storage`
+  is installed, falling back to the REST API otherwise.
+- `ParquetSource` reads one Parquet file or a directory of them, so the same
+  analysis can run offline against a snapshot written by `export_parquet`.
+
+Columns are converted by kind:
+
+- `"float"` / `"int"`: 1-D float64 / int64 arrays; NULL becomes NaN (float)
+  or `null_int` (int).
+- `"str"`: 1-D object arrays with NULL as "".
+- `"vector"`: ARRAY<FLOAT64> as a 2-D float32 matrix; NULL or empty arrays
+  become zero rows.
+- `"int8"` / `"uint8"`: BYTES holding packed codes as a 2-D matrix, viewed
+  directly over the Arrow data buffer.
+
+Usage from other scripts:
+
+    source = BigQuerySource(client, "SELECT symbol, return_pct, embedding FROM ...")
+    for batch in iter_numpy_batches(source, {"symbol": "str", "return_pct": "float", "embedding": "vector"}):
+        batch["embedding"]  # (rows x dim) float32
+
+Prerequisites:
+- Required Python packages installed:
+  - pip install google-cloud-bigquery google-cloud-bigquery-storage pyarrow numpy
+"""
+
+import glob
+import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+COLUMN_KINDS = ("float", "int", "str", "vector", "int8", "uint8")
+DEFAULT_BATCH_ROWS = 65536
+
+
+class BigQuerySource:
+    """
+    Record batches of a BigQuery query result or table.
+
+    Args:
+        client: A `bigquery.Client`.
+        query: SQL to run, or a fully qualified table id with `table=True`.
+        query_parameters: Parameters of the query.
+        table: Read the table `query` directly instead of running SQL.
+        use_storage_api: Use the Storage Read API when it is installed.
+    """
+
+    def __init__(self, client, query: str, query_parameters: list | None = None,
+                 table: bool = False, use_storage_api: bool = True):
+        self.client = client
+        self.query = query
+        self.query_parameters = query_parameters or []
+        self.table = table
+        self.use_storage_api = use_storage_api
+
+    def _storage_client(self):
+        # Local stand-ins such as duckdb_backend.DuckDBClient have no credentials.
+        if not self.use_storage_api or getattr(self.client, "_credentials", None) is None:
+            return None
+        try:
+            from google.cloud import bigquery_storage
+        except ImportError:
+            print("google-cloud-bigquery-storage is not installed; reading through the REST API.")
+            return None
+        return bigquery_storage.BigQueryReadClient(credentials=self.client._credentials)
+
+    def iter_batches(self, columns: list[str] | None = None):
+        """Yields record batches; `columns` is ignored since the query selects them."""
+        from google.cloud import bigquery
+
+        if self.table:
+            rows = self.client.list_rows(self.query)
+        else:
+            job_config = bigquery.QueryJobConfig(query_parameters=self.query_parameters)
+            rows = self.client.query(self.query, job_config=job_config).result()
+        yield from rows.to_arrow_iterable(bqstorage_client=self._storage_client())
+
+
+class ParquetSource:
+    """
+    Record batches of a Parquet file, or of every `*.parquet` file in a
+    directory in name order.
+    """
+
+    def __init__(self, path: str, batch_rows: int = DEFAULT_BATCH_ROWS):
+        self.path = path
+        self.batch_rows = batch_rows
+
+    def iter_batches(self, columns: list[str] | None = None):
+        """Yields record batches of the requested columns that the files have."""
+        paths = sorted(glob.glob(os.path.join(self.path, "*.parquet"))) if os.path.isdir(self.path) else [self.path]
+        for path in paths:
+            parquet_file = pq.ParquetFile(path)
+            present = None if columns is None else [c for c in columns if c in parquet_file.schema_arrow.names]
+            yield from parquet_file.iter_batches(batch_size=self.batch_rows, columns=present)
+
+
+def export_parquet(source, path: str) -> int:
+    """Copies every batch of a source into one Parquet file; returns the row count."""
+    writer, rows = None, 0
+    try:
+        for batch in source.iter_batches():
+            if writer is None:
+                writer = pq.ParquetWriter(path, batch.schema)
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def numeric_column(array: pa.Array, kind: str = "float", null_int: int = 0) -> np.ndarray:
+    """A numeric column as float64 (NULL -> NaN) or int64 (NULL -> `null_int`)."""
+    if kind == "int":
+        return pc.fill_null(array.cast(pa.int64()), null_int).to_numpy()
+    return pc.fill_null(array.cast(pa.float64()), np.nan).to_numpy()
+
+
+def string_column(array: pa.Array) -> np.ndarray:
+    """A string column as an object array with NULL as ""."""
+    return pc.fill_null(array.cast(pa.string()), "").to_numpy(zero_copy_only=False)
+
+
+def vector_column(array: pa.Array, dtype=np.float32) -> np.ndarray:
+    """
+    An ARRAY<FLOAT64> column as a (rows x dim) matrix, where dim is the
+    longest array. Shorter, empty or NULL arrays are zero-padded.
+    """
+    lengths = pc.fill_null(pc.list_value_length(array), 0).to_numpy().astype(np.int64)
+    values = pc.list_flatten(array).to_numpy(zero_copy_only=False).astype(dtype, copy=False)
+    n, dim = len(array), int(lengths.max()) if len(array) else 0
+    if n and np.all(lengths == dim):
+        return values.reshape(n, dim)
+    out = np.zeros((n, dim), dtype=dtype)
+    rows = np.repeat(np.arange(n), lengths)
+    cols = np.arange(len(values)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    out[rows, cols] = values
+    return out
+
+
+def bytes_column(array: pa.Array, dtype=np.int8) -> np.ndarray:
+    """
+    A BYTES column of fixed-width codes as a (rows x width) matrix, read
+    straight from the Arrow buffers. NULL or shorter values are zero-padded.
+    """
+    array = array.cast(pa.binary())
+    n = len(array)
+    _, offsets_buf, data_buf = array.buffers()
+    offsets = np.frombuffer(offsets_buf, dtype=np.int32)[array.offset:array.offset + n + 1]
+    data = np.frombuffer(data_buf, dtype=np.uint8) if data_buf is not None else np.empty(0, np.uint8)
+    lengths = np.diff(offsets)
+    if array.null_count:
+        lengths = np.where(array.is_null().to_numpy(zero_copy_only=False), 0, lengths)
+    width = int(lengths.max()) if n else 0
+    if n and np.all(lengths == width):
+        return data[offsets[0]:offsets[-1]].view(dtype).reshape(n, width)
+    out = np.zeros((n, width), dtype=np.uint8)
+    rows = np.repeat(np.arange(n), lengths)
+    cols = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    out[rows, cols] = data[np.repeat(offsets[:-1], lengths) + cols]
+    return out.view(dtype)
+
+
+def convert_column(array: pa.Array, kind: str) -> np.ndarray:
+    """Converts one Arrow column according to its kind (see COLUMN_KINDS)."""
+    if kind in ("float", "int"):
+        return numeric_column(array, kind)
+    if kind == "str":
+        return string_column(array)
+    if kind == "vector":
+        return vector_column(array)
+    if kind in ("int8", "uint8"):
+        return bytes_column(array, np.dtype(kind))
+    raise ValueError(f"Unknown column kind {kind!r}; expected one of {COLUMN_KINDS}")
+
+
+def iter_numpy_batches(source, columns: dict[str, str]):
+    """
+    Streams a source as dicts of NumPy arrays, one dict per record batch.
+
+    Args:
+        source: A `BigQuerySource` or `ParquetSource`.
+        columns: Column name -> kind. Other columns are ignored; a column
+            missing from the source yields None.
+    """
+    for batch in source.iter_batches(list(columns)):
+        if batch.num_rows == 0:
+            continue
+        names = set(batch.schema.names)
+        yield {
+            name: convert_column(batch.column(name), kind) if name in names else None
+            for name, kind in columns.items()
+        }
+
+
+def read_numpy(source, columns: dict[str, str]) -> dict[str, np.ndarray]:
+    """Reads a whole source into one dict of concatenated arrays."""
+    parts: dict[str, list] = {name: [] for name in columns}
+    for batch in iter_numpy_batches(source, columns):
+        for name, values in batch.items():
+            if values is not None:
+                parts[name].append(values)
+    out = {}
+    for name, kind in columns.items():
+        if not parts[name]:
+            out[name] = None
+        elif kind in ("vector", "int8", "uint8"):
+            width = max(p.shape[1] for p in parts[name])
+            out[name] = np.concatenate([
+                np.pad(p, ((0, 0), (0, width - p.shape[1]))) for p in parts[name]
+            ])
+        else:
+            out[name] = np.concatenate(parts[name])
+    return out
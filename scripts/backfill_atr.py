@@ -20,7 +20,21 @@ trades in the BigQuery `trades` table.
 
 It fetches trades where `atr_at_execution` is NULL, retrieves historical price 
 bars from Alpaca for the period leading up to the trade, calculates the 
-14-day ATR (Average True Range), and updates the BigQuery record.
+14-day ATR (Average True Range) the same way `magi-core.js` records it at
+execution (see `indicators.js_atr`), and writes all values back to BigQuery
+with a single MERGE at the end of the run (see `bq_writeback.py`).
+
+By default trades are grouped by symbol and a single bar range covering every
+trade of that symbol is read through the local bar store (`bar_store.py`),
+which only asks Alpaca for dates it has not cached yet. The number of Alpaca
+calls therefore scales with the number of symbols on the first run and drops
+to zero on reruns. Pass `--per-trade` to fall back to one 40-day request per
+trade.
+
+`--stream` walks the whole table instead of the 500 most recent trades: rows
+are paged from BigQuery, processed and written back in bounded batches, and
+a local checkpoint (last processed timestamp/session_id) is saved after each
+batch so an interrupted run resumes where it stopped.
 
 This is a necessary step to enable volatility-adjusted evaluation on trades
 that were logged before the `magi-core.js` application started recording the ATR.
@@ -29,14 +43,24 @@ Prerequisites:
 - Google Cloud SDK authenticated (`gcloud auth application-default login`)
 - Alpaca API credentials set as environment variables.
 - Required Python packages installed:
-  - pip install alpaca-trade-api google-cloud-bigquery pandas
+  - pip install alpaca-trade-api google-cloud-bigquery numpy pandas
 """
 
+import argparse
+import asyncio
+import json
 import os
+from collections import defaultdict
 from datetime import datetime, timedelta, timezone
 import alpaca_trade_api as tradeapi
 from google.cloud import bigquery
+import numpy as np
 import pandas as pd
+from alpaca_client import DEFAULT_MAX_CONCURRENCY, AlpacaClient
+from bar_store import DEFAULT_STORE_DIR, BarStore
+from bq_writeback import OUTCOME_UPDATED, ColumnWriteBack, WriteBackError, log_outcomes
+from indicators import EXECUTION_ATR_WINDOW, js_atr
+from instrumentation import api_call, count, instrument_client, instrumented, span
 
 # --- Configuration ---
 GCP_PROJECT_ID = "screen-share-459802"
@@ -44,6 +68,10 @@ BIGQUERY_DATASET = "magi_core"
 BIGQUERY_TABLE = "trades"
 TABLE_ID = f"{GCP_PROJECT_ID}.{BIGQUERY_DATASET}.{BIGQUERY_TABLE}"
 ALPACA_API_BASE_URL = "https://paper-api.alpaca.markets"
+ATR_PERIOD = 14
+# Calendar days of history fetched before a trade; enough for a 14-period ATR.
+ATR_LOOKBACK_DAYS = 40
+DEFAULT_CHECKPOINT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "magi", "backfill_atr.checkpoint.json")
 
 def get_trades_needing_atr(client: bigquery.Client, limit: int = 500) -> list:
     """Fetches trades from BigQuery that need an ATR value backfilled."""
@@ -62,21 +90,87 @@ def get_trades_needing_atr(client: bigquery.Client, limit: int = 500) -> list:
     print(f"Found {len(results)} trades to backfill.")
     return results
 
+def iter_trades_needing_atr(client: bigquery.Client, page_size: int = 10000,
+                            checkpoint: dict | None = None):
+    """
+    Streams every trade that needs an ATR value, oldest first.
+
+    Results are read page by page (`page_size` rows per page), so memory use
+    does not depend on how many trades match. Rows at or before `checkpoint`
+    (a `{"timestamp", "session_id"}` dict) are skipped, which makes the
+    (timestamp, session_id) ordering a stable resume key.
+    """
+    resume_filter = ""
+    query_parameters = []
+    if checkpoint:
+        resume_filter = """
+          AND (timestamp > @after_timestamp
+               OR (timestamp = @after_timestamp AND session_id > @after_session_id))"""
+        query_parameters = [
+            bigquery.ScalarQueryParameter("after_timestamp", "TIMESTAMP", datetime.fromisoformat(checkpoint["timestamp"])),
+            bigquery.ScalarQueryParameter("after_session_id", "STRING", checkpoint["session_id"]),
+        ]
+    query = f"""
+        SELECT session_id, symbol, timestamp
+        FROM `{TABLE_ID}`
+        WHERE atr_at_execution IS NULL 
+          AND price IS NOT NULL
+          AND side IS NOT NULL{resume_filter}
+        ORDER BY timestamp, session_id
+    """
+    print(f"Executing streaming query to find trades needing ATR backfill:\n{query}")
+    job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+    rows = client.query(query, job_config=job_config).result(page_size=page_size)
+    print(f"Found {rows.total_rows} trades to backfill.")
+    for page in rows.pages:
+        yield from page
+
+def load_checkpoint(path: str) -> dict | None:
+    """Reads the last processed (timestamp, session_id), if any."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_checkpoint(path: str, trade):
+    """Atomically records `trade` as the last processed row."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"timestamp": trade.timestamp.isoformat(), "session_id": trade.session_id}, f)
+    os.replace(tmp_path, path)
+
+def calculate_atr_series(bars_df: pd.DataFrame, period: int = 14) -> pd.Series:
+    """
+    Calculates the ATR as of every bar exactly as `magi-core.js` would have
+    recorded it: Wilder's smoothing over the trailing `EXECUTION_ATR_WINDOW`
+    bars, seeded with the mean of the first `period` true ranges.
+
+    Values without enough history are NaN.
+    """
+    atr = js_atr(
+        bars_df['high'].to_numpy(dtype=float)[np.newaxis],
+        bars_df['low'].to_numpy(dtype=float)[np.newaxis],
+        bars_df['close'].to_numpy(dtype=float)[np.newaxis],
+        period,
+        EXECUTION_ATR_WINDOW,
+    )[0]
+    return pd.Series(atr, index=bars_df.index)
+
 def calculate_atr(bars_df: pd.DataFrame, period: int = 14) -> float | None:
     """Calculates ATR using Wilder's Smoothing, matching the JS implementation."""
     if len(bars_df) < period + 1:
         return None
 
-    high_low = bars_df['high'] - bars_df['low']
-    high_prev_close = (bars_df['high'] - bars_df['close'].shift()).abs()
-    low_prev_close = (bars_df['low'] - bars_df['close'].shift()).abs()
+    return float(calculate_atr_series(bars_df, period).iloc[-1])
 
-    tr = pd.concat([high_low, high_prev_close, low_prev_close], axis=1).max(axis=1)
-    
-    # Using Exponential Moving Average for Wilder's Smoothing
-    atr = tr.ewm(alpha=1/period, adjust=False).mean()
-    
-    return atr.iloc[-1]
+def bars_to_dataframe(bars) -> pd.DataFrame:
+    """Converts Alpaca bar entities into an OHLCV DataFrame sorted by bar date."""
+    bars_df = pd.DataFrame([b._raw for b in bars])
+    bars_df.rename(columns={'o': 'open', 'h': 'high', 'l': 'low', 'c': 'close', 'v': 'volume'}, inplace=True)
+    bars_df['date'] = pd.to_datetime(bars_df['t'], utc=True).dt.normalize()
+    return bars_df.sort_values('date').reset_index(drop=True)
 
 
 def get_historical_atr(api: tradeapi.REST, symbol: str, trade_timestamp: datetime) -> float | None:
@@ -84,54 +178,228 @@ def get_historical_atr(api: tradeapi.REST, symbol: str, trade_timestamp: datetim
     # We need `period` + 1 bars to calculate TR, and more for a stable ATR.
     # Fetching 40 days should be sufficient for a 14-period ATR.
     end_dt = trade_timestamp.astimezone(timezone.utc)
-    start_dt = end_dt - timedelta(days=40)
+    start_dt = end_dt - timedelta(days=ATR_LOOKBACK_DAYS)
 
     try:
         # Alpaca's get_bars is inclusive of start/end
-        bars = api.get_bars(
-            symbol,
-            tradeapi.TimeFrame.Day,
-            start=start_dt.strftime('%Y-%m-%d'),
-            end=end_dt.strftime('%Y-%m-%d'),
-            adjustment='raw'
-        )
+        with api_call("alpaca", "bars"):
+            bars = api.get_bars(
+                symbol,
+                tradeapi.TimeFrame.Day,
+                start=start_dt.strftime('%Y-%m-%d'),
+                end=end_dt.strftime('%Y-%m-%d'),
+                adjustment='raw'
+            )
         if not bars:
             print(f"  - No bars returned for {symbol} up to {end_dt.date()}")
             return None
 
-        bars_df = pd.DataFrame([b._raw for b in bars])
-        bars_df.rename(columns={'o': 'open', 'h': 'high', 'l': 'low', 'c': 'close', 'v': 'volume'}, inplace=True)
+        bars_df = bars_to_dataframe(bars)
         
-        return calculate_atr(bars_df, 14)
+        return calculate_atr(bars_df, ATR_PERIOD)
 
     except Exception as e:
         print(f"  - Could not fetch/calculate ATR for {symbol}: {e}")
         return None
 
-def update_trade_atr(client: bigquery.Client, session_id: str, atr: float):
-    """Updates the atr_at_execution for a specific trade in BigQuery."""
-    query = f"""
-        UPDATE `{TABLE_ID}`
-        SET atr_at_execution = @atr
-        WHERE session_id = @session_id
+def group_trades_by_symbol(trades: list) -> dict[str, list]:
+    """Groups BigQuery trade rows by symbol, preserving their original order."""
+    grouped = defaultdict(list)
+    for trade in trades:
+        grouped[trade.symbol].append(trade)
+    return dict(grouped)
+
+def lookup_atr_at(bars_df: pd.DataFrame, atr_series: pd.Series, timestamps: list[datetime]) -> list[float | None]:
     """
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("atr", "FLOAT64", atr),
-            bigquery.ScalarQueryParameter("session_id", "STRING", session_id),
-        ]
+    Looks up the ATR as of each timestamp.
+
+    The ATR for a trade is the value of the last daily bar dated on or before
+    the trade's UTC date, found with a binary search over the sorted bar dates.
+
+    Args:
+        bars_df: Bars sorted by a `date` column.
+        atr_series: The ATR series aligned with `bars_df`.
+        timestamps: Trade timestamps to look up.
+
+    Returns:
+        One ATR per timestamp, or None where there was not enough history.
+    """
+    bar_dates = bars_df['date'].to_numpy(dtype='datetime64[ns]')
+    trade_dates = pd.to_datetime(
+        [ts.astimezone(timezone.utc) for ts in timestamps], utc=True
+    ).normalize().to_numpy(dtype='datetime64[ns]')
+
+    positions = np.searchsorted(bar_dates, trade_dates, side='right') - 1
+    atr_values = atr_series.to_numpy()
+
+    results = []
+    for pos in positions:
+        value = atr_values[pos] if pos >= 0 else np.nan
+        results.append(None if np.isnan(value) else float(value))
+    return results
+
+def symbol_bar_range(trades: list) -> tuple[datetime, datetime]:
+    """Returns the bar range needed to compute the ATR for all given trades of one symbol."""
+    timestamps = [trade.timestamp.astimezone(timezone.utc) for trade in trades]
+    return min(timestamps) - timedelta(days=ATR_LOOKBACK_DAYS), max(timestamps)
+
+def get_symbol_atrs(store: BarStore, symbol: str, trades: list) -> list[float | None]:
+    """
+    Reads a single bar range for all trades of one symbol and returns the
+    ATR at each trade's timestamp.
+
+    The range runs from `ATR_LOOKBACK_DAYS` before the earliest trade up to
+    the latest trade and is served from the local bar store, so at most the
+    uncached parts of it are requested from Alpaca.
+    """
+    timestamps = [trade.timestamp for trade in trades]
+    start_dt, end_dt = symbol_bar_range(trades)
+
+    try:
+        bars = store.get_bars(symbol, start_dt, end_dt)
+        if len(bars) == 0:
+            print(f"  - No bars returned for {symbol} between {start_dt.date()} and {end_dt.date()}")
+            return [None] * len(trades)
+
+        bars_df = pd.DataFrame(np.asarray(bars))
+        atr_series = calculate_atr_series(bars_df, ATR_PERIOD)
+        return lookup_atr_at(bars_df, atr_series, timestamps)
+
+    except Exception as e:
+        print(f"  - Could not fetch/calculate ATR series for {symbol}: {e}")
+        return [None] * len(trades)
+
+def backfill_per_trade(alpaca_api: tradeapi.REST, writeback: ColumnWriteBack, trades: list):
+    """Backfills ATR with one Alpaca request per trade."""
+    for i, trade in enumerate(trades):
+        print(f"\nProcessing trade {i+1}/{len(trades)}: {trade.symbol} ({trade.session_id})")
+        
+        atr_value = get_historical_atr(alpaca_api, trade.symbol, trade.timestamp)
+        
+        if atr_value is not None and atr_value > 0:
+            print(f"  - Calculated ATR at {trade.timestamp.date()}: {atr_value:.4f}")
+            writeback.add(trade.session_id, atr_value)
+        else:
+            print(f"  - Skipping update for trade {trade.session_id} due to invalid ATR.")
+
+async def prefetch_bars(store: BarStore, trades_by_symbol: dict[str, list], concurrency: int) -> int:
+    """Fills the bar store for every symbol concurrently before the ATR pass."""
+    ranges = {symbol: symbol_bar_range(trades) for symbol, trades in trades_by_symbol.items()}
+    async with AlpacaClient(max_concurrency=concurrency) as client:
+        return await store.prefetch(client, ranges)
+
+def backfill_batched(store: BarStore, writeback: ColumnWriteBack, trades: list, concurrency: int = 0,
+                     verbose: bool = True):
+    """Backfills ATR with at most one bar range per symbol, read through the bar store."""
+    trades_by_symbol = group_trades_by_symbol(trades)
+    print(f"Grouped {len(trades)} trades into {len(trades_by_symbol)} symbols.")
+
+    if concurrency > 0:
+        try:
+            with span("prefetch_bars", symbols=len(trades_by_symbol)):
+                fetched = asyncio.run(prefetch_bars(store, trades_by_symbol, concurrency))
+            print(f"Prefetched {fetched} bar ranges with up to {concurrency} concurrent requests.")
+        except Exception as e:
+            print(f"Concurrent prefetch failed, falling back to sequential fetches: {e}")
+
+    for symbol, symbol_trades in trades_by_symbol.items():
+        if verbose:
+            print(f"\nProcessing {symbol}: {len(symbol_trades)} trades")
+        atr_values = get_symbol_atrs(store, symbol, symbol_trades)
+
+        for trade, atr_value in zip(symbol_trades, atr_values):
+            if atr_value is not None and atr_value > 0:
+                if verbose:
+                    print(f"  - Calculated ATR at {trade.timestamp.date()}: {atr_value:.4f}")
+                writeback.add(trade.session_id, atr_value)
+            elif verbose:
+                print(f"  - Skipping update for trade {trade.session_id} due to invalid ATR.")
+
+    if verbose:
+        print(f"\nBar store made {store.api_calls} Alpaca requests for {len(trades_by_symbol)} symbols.")
+
+def backfill_streaming(bq_client: bigquery.Client, store: BarStore, writeback: ColumnWriteBack,
+                       args: argparse.Namespace):
+    """
+    Backfills every trade needing ATR in bounded batches, resuming from and
+    advancing the checkpoint file after each batch has been written. A failed
+    write stops the run without advancing the checkpoint.
+    """
+    if args.reset_checkpoint and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    checkpoint = load_checkpoint(args.checkpoint)
+    if checkpoint:
+        print(f"Resuming after {checkpoint['timestamp']} / {checkpoint['session_id']}")
+
+    def process(batch: list):
+        count("rows_total", len(batch), stage="atr", kind="trades_read")
+        with span("backfill_batch", rows=len(batch)):
+            backfill_batched(store, writeback, batch, args.concurrency, verbose=False)
+            try:
+                outcomes = writeback.flush()
+            except WriteBackError:
+                # The checkpoint must not pass trades whose ATR was not written.
+                print(f"Batch write failed; checkpoint stays before {batch[0].timestamp}.")
+                raise
+        updated = sum(1 for outcome in outcomes.values() if outcome == OUTCOME_UPDATED)
+        save_checkpoint(args.checkpoint, batch[-1])
+        print(f"Batch done: {updated}/{len(batch)} trades updated, checkpoint at {batch[-1].timestamp}.")
+        return len(batch)
+
+    processed = 0
+    batch = []
+    for trade in iter_trades_needing_atr(bq_client, args.page_size, checkpoint):
+        batch.append(trade)
+        if len(batch) >= args.batch_size:
+            processed += process(batch)
+            batch = []
+    if batch:
+        processed += process(batch)
+
+    print(f"\nStreamed {processed} trades; bar store made {store.api_calls} Alpaca requests.")
+
+def parse_args() -> argparse.Namespace:
+    """Parses command-line options."""
+    parser = argparse.ArgumentParser(description="Backfill atr_at_execution for historical trades.")
+    parser.add_argument(
+        "--per-trade",
+        action="store_true",
+        help="Fetch bars once per trade instead of once per symbol.",
     )
-    
-    query_job = client.query(query, job_config=job_config)
-    query_job.result() 
-    
-    if query_job.errors:
-        print(f"  - Error updating ATR for trade {session_id}: {query_job.errors}")
-    else:
-        print(f"  - Successfully updated ATR for trade {session_id}.")
+    parser.add_argument(
+        "--bar-store",
+        default=DEFAULT_STORE_DIR,
+        help="Directory of the local daily-bar store (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_MAX_CONCURRENCY,
+        help="Concurrent Alpaca requests when prefetching bars; 0 disables prefetching.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Process every trade needing ATR in bounded batches with a resumable checkpoint.",
+    )
+    parser.add_argument("--batch-size", type=int, default=5000, help="Trades per streamed batch.")
+    parser.add_argument("--page-size", type=int, default=10000, help="BigQuery rows per result page.")
+    parser.add_argument(
+        "--checkpoint",
+        default=DEFAULT_CHECKPOINT_PATH,
+        help="Checkpoint file for --stream (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--reset-checkpoint",
+        action="store_true",
+        help="Ignore any saved checkpoint and start from the oldest trade.",
+    )
+    return parser.parse_args()
 
+@instrumented
 def main():
     """Main function to orchestrate the backfill process."""
+    args = parse_args()
     print("--- Starting ATR Backfill Process ---")
     
     # --- Initialize Clients ---
@@ -142,9 +410,15 @@ def main():
         print(f"Failed to connect to Alpaca API. Error: {e}")
         return
 
-    bq_client = bigquery.Client(project=GCP_PROJECT_ID)
+    bq_client = instrument_client(bigquery.Client(project=GCP_PROJECT_ID))
     print("Successfully connected to BigQuery.")
 
+    writeback = ColumnWriteBack(bq_client, TABLE_ID, "atr_at_execution")
+    if args.stream:
+        backfill_streaming(bq_client, BarStore(alpaca_api, args.bar_store), writeback, args)
+        print("\n--- ATR Backfill Process Complete ---")
+        return
+
     # --- Fetch and Process Trades ---
     trades_to_process = get_trades_needing_atr(bq_client)
 
@@ -152,16 +426,13 @@ def main():
         print("No trades require ATR backfilling. Exiting.")
         return
 
-    for i, trade in enumerate(trades_to_process):
-        print(f"\nProcessing trade {i+1}/{len(trades_to_process)}: {trade.symbol} ({trade.session_id})")
-        
-        atr_value = get_historical_atr(alpaca_api, trade.symbol, trade.timestamp)
-        
-        if atr_value is not None and atr_value > 0:
-            print(f"  - Calculated ATR at {trade.timestamp.date()}: {atr_value:.4f}")
-            update_trade_atr(bq_client, trade.session_id, atr_value)
-        else:
-            print(f"  - Skipping update for trade {trade.session_id} due to invalid ATR.")
+    if args.per_trade:
+        backfill_per_trade(alpaca_api, writeback, trades_to_process)
+    else:
+        backfill_batched(BarStore(alpaca_api, args.bar_store), writeback, trades_to_process, args.concurrency)
+
+    print(f"\nWriting {len(writeback)} ATR values back to BigQuery in one MERGE...")
+    log_outcomes(writeback.flush(), "atr_at_execution")
 
     print("\n--- ATR Backfill Process Complete ---")
 
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A local, incrementally filled store of Alpaca daily bars.
+
+Each symbol is kept as a single `.npy` file holding a structured array
+(`date`, `open`, `high`, `low`, `close`, `volume`) sorted by date, which is
+memory-mapped on read. Next to it, a small JSON file records which calendar
+date ranges have already been fetched, so weekends and holidays are not
+mistaken for gaps. `BarStore.get_bars` only asks Alpaca for the parts of the
+requested range that are not covered yet; repeated runs over the same
+history make no API calls. `BarStore.prefetch` fills many symbols at once
+through the concurrent `alpaca_client.AlpacaClient`, sharing multi-symbol
+requests between symbols that miss the same days.
+
+The current UTC day is never marked as covered, because its bar may still be
+incomplete; it is refetched on the next request that includes it.
+
+Usage from other scripts:
+
+    store = BarStore(tradeapi.REST(base_url=ALPACA_API_BASE_URL))
+    bars = store.get_bars("AAPL", date(2024, 1, 1), date(2024, 6, 30))
+    bars["close"]  # NumPy array, no copy
+
+Prerequisites:
+- Alpaca API credentials set as environment variables.
+- Required Python packages installed:
+  - pip install alpaca-trade-api numpy
+"""
+
+import asyncio
+import json
+import os
+from datetime import date, datetime, timedelta, timezone
+import alpaca_trade_api as tradeapi
+import numpy as np
+from instrumentation import api_call
+
+# --- Configuration ---
+DEFAULT_STORE_DIR = os.environ.get(
+    "MAGI_BAR_STORE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "magi", "bars")
+)
+# Symbols per multi-symbol bars request; keeps the query string short.
+MULTI_SYMBOL_CHUNK_SIZE = 200
+
+BAR_DTYPE = np.dtype([
+    ("date", "datetime64[D]"),
+    ("open", "f8"),
+    ("high", "f8"),
+    ("low", "f8"),
+    ("close", "f8"),
+    ("volume", "f8"),
+])
+
+
+def _to_date(value) -> date:
+    """Normalizes a date, datetime or ISO string to a UTC calendar date."""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _merge_ranges(ranges: list[tuple[date, date]]) -> list[tuple[date, date]]:
+    """Merges overlapping or adjacent inclusive date ranges."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def missing_ranges(covered: list[tuple[date, date]], start: date, end: date) -> list[tuple[date, date]]:
+    """Returns the parts of [start, end] not contained in `covered`."""
+    gaps = []
+    cursor = start
+    for cov_start, cov_end in _merge_ranges(covered):
+        if cov_end < cursor:
+            continue
+        if cov_start > end:
+            break
+        if cov_start > cursor:
+            gaps.append((cursor, cov_start - timedelta(days=1)))
+        cursor = max(cursor, cov_end + timedelta(days=1))
+        if cursor > end:
+            break
+    if cursor <= end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def bars_to_array(raw_bars: list[dict]) -> np.ndarray:
+    """Converts raw Alpaca bar dicts (`t`, `o`, `h`, `l`, `c`, `v`) into a BAR_DTYPE array."""
+    out = np.empty(len(raw_bars), dtype=BAR_DTYPE)
+    for i, bar in enumerate(raw_bars):
+        out[i] = (np.datetime64(str(bar["t"])[:10], "D"), bar["o"], bar["h"], bar["l"], bar["c"], bar["v"])
+    return out
+
+
+class BarStore:
+    """
+    Per-symbol daily OHLCV cache backed by memory-mapped NumPy files.
+
+    Args:
+        api: An Alpaca REST client used to fill gaps. May be None for a
+            read-only store that never fetches.
+        root: Directory holding the per-symbol files.
+    """
+
+    def __init__(self, api: tradeapi.REST | None, root: str = DEFAULT_STORE_DIR):
+        self.api = api
+        self.root = root
+        self.api_calls = 0
+        self.prefetch_failures: dict[str, str] = {}
+        os.makedirs(root, exist_ok=True)
+
+    def _bars_path(self, symbol: str) -> str:
+        return os.path.join(self.root, f"{symbol}.npy")
+
+    def _coverage_path(self, symbol: str) -> str:
+        return os.path.join(self.root, f"{symbol}.coverage.json")
+
+    def _load_coverage(self, symbol: str) -> list[tuple[date, date]]:
+        try:
+            with open(self._coverage_path(symbol)) as f:
+                return [(date.fromisoformat(s), date.fromisoformat(e)) for s, e in json.load(f)]
+        except FileNotFoundError:
+            return []
+
+    def _load_bars(self, symbol: str) -> np.ndarray:
+        try:
+            return np.load(self._bars_path(symbol), mmap_mode="r")
+        except FileNotFoundError:
+            return np.empty(0, dtype=BAR_DTYPE)
+
+    def _save(self, symbol: str, bars: np.ndarray, coverage: list[tuple[date, date]]):
+        """Writes bars and coverage atomically, bars first."""
+        tmp_path = self._bars_path(symbol) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, bars)
+        os.replace(tmp_path, self._bars_path(symbol))
+
+        tmp_path = self._coverage_path(symbol) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump([[s.isoformat(), e.isoformat()] for s, e in coverage], f)
+        os.replace(tmp_path, self._coverage_path(symbol))
+
+    def _fetch(self, symbol: str, start: date, end: date) -> np.ndarray:
+        """Fetches raw daily bars for an inclusive date range from Alpaca."""
+        self.api_calls += 1
+        with api_call("alpaca", "bars"):
+            bars = self.api.get_bars(
+                symbol,
+                tradeapi.TimeFrame.Day,
+                start=start.isoformat(),
+                end=end.isoformat(),
+                adjustment='raw'
+            )
+        return bars_to_array([b._raw for b in bars])
+
+    def _store_fetched(self, symbol: str, gaps: list[tuple[date, date]], fetched: list[np.ndarray]):
+        """Merges freshly fetched bars into the symbol file and marks the gaps covered."""
+        today = datetime.now(timezone.utc).date()
+
+        # New bars come last so a refetched (completed) bar replaces a stale one.
+        combined = np.concatenate([np.asarray(self._load_bars(symbol))] + fetched)
+        _, last_idx = np.unique(combined["date"][::-1], return_index=True)
+        combined = combined[len(combined) - 1 - last_idx]
+
+        coverage = self._load_coverage(symbol)
+        coverage += [(s, min(e, today - timedelta(days=1))) for s, e in gaps if s < today]
+        self._save(symbol, combined, _merge_ranges(coverage))
+
+    def fill(self, symbol: str, start, end) -> int:
+        """
+        Fetches every uncovered part of [start, end] for a symbol.
+
+        Returns:
+            The number of Alpaca requests made.
+        """
+        start, end = _to_date(start), _to_date(end)
+        gaps = missing_ranges(self._load_coverage(symbol), start, end)
+        if not gaps or self.api is None:
+            return 0
+
+        fetched = [self._fetch(symbol, gap_start, gap_end) for gap_start, gap_end in gaps]
+        self._store_fetched(symbol, gaps, fetched)
+        return len(gaps)
+
+    async def prefetch(self, client, ranges: dict[str, tuple], chunk_size: int = MULTI_SYMBOL_CHUNK_SIZE) -> int:
+        """
+        Fills the uncovered parts of many symbols' ranges concurrently.
+
+        Symbols that miss exactly the same range are fetched together through
+        the multi-symbol bars endpoint, `chunk_size` symbols per request.
+
+        A symbol whose request fails after its retries (e.g. an unknown or
+        delisted symbol) does not stop the others: its failed ranges stay
+        uncovered and it is listed in `prefetch_failures` (symbol -> error).
+
+        Args:
+            client: An `alpaca_client.AlpacaClient`.
+            ranges: Mapping of symbol to an inclusive (start, end) range.
+            chunk_size: Maximum symbols per multi-symbol request.
+
+        Returns:
+            The number of bar ranges requested.
+        """
+        gaps_by_symbol = {}
+        for symbol, (start, end) in ranges.items():
+            gaps = missing_ranges(self._load_coverage(symbol), _to_date(start), _to_date(end))
+            if gaps:
+                gaps_by_symbol[symbol] = gaps
+
+        # Symbols missing the same single range (typically the days since the
+        # last run) share multi-symbol requests.
+        shared: dict[tuple[date, date], list[str]] = {}
+        for symbol, gaps in gaps_by_symbol.items():
+            if len(gaps) == 1:
+                shared.setdefault(gaps[0], []).append(symbol)
+        shared = {gap: symbols for gap, symbols in shared.items() if len(symbols) > 1}
+        single = {s: g for s, g in gaps_by_symbol.items() if len(g) > 1 or g[0] not in shared}
+
+        failures: dict[str, str] = {}
+
+        async def fetch_symbol(symbol, gaps):
+            raw = await asyncio.gather(*(client.get_bars(symbol, s, e) for s, e in gaps), return_exceptions=True)
+            fetched = [(gap, r) for gap, r in zip(gaps, raw) if not isinstance(r, BaseException)]
+            errors = [r for r in raw if isinstance(r, BaseException)]
+            if errors:
+                failures[symbol] = str(errors[0])
+            if fetched:
+                # Only the gaps that were actually fetched are marked covered.
+                self._store_fetched(symbol, [gap for gap, _ in fetched], [bars_to_array(r) for _, r in fetched])
+
+        async def fetch_chunk(symbols, gap):
+            try:
+                raw = await client.get_bars_multi(symbols, *gap)
+            except Exception as e:
+                failures.update((symbol, str(e)) for symbol in symbols)
+                return
+            for symbol in symbols:
+                self._store_fetched(symbol, [gap], [bars_to_array(raw.get(symbol) or [])])
+
+        chunks = [
+            (symbols[i:i + chunk_size], gap)
+            for gap, symbols in shared.items()
+            for i in range(0, len(symbols), chunk_size)
+        ]
+        results = await asyncio.gather(
+            *(fetch_symbol(s, g) for s, g in single.items()),
+            *(fetch_chunk(symbols, gap) for symbols, gap in chunks),
+            return_exceptions=True,
+        )
+        # Anything left is a local error (e.g. writing the store), not a fetch failure.
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        self.prefetch_failures = failures
+        if failures:
+            print(f"  - Could not prefetch bars for {len(failures)} symbols "
+                  f"(e.g. {next(iter(failures))}: {next(iter(failures.values()))}); they stay uncovered.")
+        requested = sum(len(g) for g in single.values()) + len(chunks)
+        self.api_calls += requested
+        return requested
+
+    def get_bars(self, symbol: str, start, end) -> np.ndarray:
+        """
+        Returns the daily bars for a symbol with start <= date <= end.
+
+        Missing ranges are fetched from Alpaca first. The result is a slice
+        of the memory-mapped file, so reading it costs no copy.
+        """
+        start, end = _to_date(start), _to_date(end)
+        self.fill(symbol, start, end)
+        bars = self._load_bars(symbol)
+        lo = np.searchsorted(bars["date"], np.datetime64(start, "D"), side="left")
+        hi = np.searchsorted(bars["date"], np.datetime64(end, "D"), side="right")
+        return bars[lo:hi]
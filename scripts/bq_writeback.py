@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Set-based write-back of per-trade values into a BigQuery table.
+
+Scripts that used to issue one `UPDATE ... WHERE session_id = @session_id`
+per trade collect `(session_id, value)` pairs in a `ColumnWriteBack` and apply
+them with a single `MERGE` when the run is done. Small batches are passed
+inline as an `UNNEST(@rows)` array-of-struct parameter; large batches are
+loaded into a temporary staging table first, since query parameters are
+limited in size.
+
+The MERGE runs in a single multi-statement query job. In one transaction
+it first snapshots the current state of the target rows, from the same
+inline parameter or staging table, and then applies the MERGE. Every pair
+can then be reported the same way the old per-row log lines were: updated,
+already had a value, or not found. The report matches what the MERGE saw.
+An inline flush is one job, and a staged flush adds one load job. A failed
+MERGE raises `WriteBackError` and leaves the values staged.
+
+Prerequisites:
+- Required Python packages installed:
+  - pip install google-cloud-bigquery
+"""
+
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from google.cloud import bigquery
+from instrumentation import count, span
+
+# Batches above this size are staged through a load job instead of being
+# passed inline as a query parameter.
+UNNEST_MAX_ROWS = 5000
+# Staging tables expire on their own if a run dies before dropping them.
+STAGING_TABLE_TTL = timedelta(hours=1)
+
+OUTCOME_UPDATED = "updated"
+OUTCOME_ALREADY_SET = "already_set"
+OUTCOME_NOT_FOUND = "not_found"
+
+
+class WriteBackError(Exception):
+    """A write-back MERGE or staging load reported errors."""
+
+
+class ColumnWriteBack:
+    """
+    Collects `(session_id, value)` pairs for one column and applies them with
+    a single MERGE.
+
+    Args:
+        client: A BigQuery client instance.
+        table_id: Fully qualified target table (`project.dataset.table`).
+        column: The column to set.
+        value_type: BigQuery type of the column, e.g. "FLOAT64".
+        only_if_null: If True, rows whose column is already set are left
+            untouched and reported as `already_set`.
+    """
+
+    def __init__(self, client: bigquery.Client, table_id: str, column: str,
+                 value_type: str = "FLOAT64", only_if_null: bool = False):
+        self.client = client
+        self.table_id = table_id
+        self.column = column
+        self.value_type = value_type
+        self.only_if_null = only_if_null
+        self._values: dict[str, object] = {}
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._values
+
+    def add(self, session_id: str, value):
+        """Stages a value; a later value for the same session_id wins."""
+        self._values[session_id] = value
+
+    def _script_sql(self, source: str) -> str:
+        """
+        Reads the current state of the targeted rows and MERGEs `source`
+        in one transaction, then returns that state: one query job, and the
+        classification cannot go stale between the read and the MERGE.
+        """
+        return f"""
+            BEGIN TRANSACTION;
+            CREATE OR REPLACE TEMP TABLE _writeback_current AS
+              SELECT session_id, LOGICAL_OR({self.column} IS NOT NULL) AS has_value
+              FROM `{self.table_id}`
+              WHERE session_id IN (SELECT S.session_id FROM ({source}) S)
+              GROUP BY session_id;
+            {self._merge_sql(source)};
+            COMMIT TRANSACTION;
+            SELECT session_id, has_value FROM _writeback_current;
+        """
+
+    def _merge_sql(self, source: str) -> str:
+        condition = f" AND T.{self.column} IS NULL" if self.only_if_null else ""
+        return f"""
+            MERGE `{self.table_id}` T
+            USING ({source}) S
+            ON T.session_id = S.session_id
+            WHEN MATCHED{condition} THEN
+              UPDATE SET {self.column} = S.value
+        """
+
+    def _inline_params(self, items: list[tuple[str, object]]) -> list:
+        rows = [
+            bigquery.StructQueryParameter(
+                None,
+                bigquery.ScalarQueryParameter("session_id", "STRING", session_id),
+                bigquery.ScalarQueryParameter("value", self.value_type, value),
+            )
+            for session_id, value in items
+        ]
+        return [bigquery.ArrayQueryParameter("rows", "STRUCT", rows)]
+
+    @contextmanager
+    def _staged(self, items: list[tuple[str, object]]):
+        """Loads `items` into a temporary staging table and yields its id; drops it afterwards."""
+        project, dataset, _ = self.table_id.split(".")
+        staging_id = f"{project}.{dataset}._writeback_{self.column}_{uuid.uuid4().hex[:12]}"
+        schema = [
+            bigquery.SchemaField("session_id", "STRING"),
+            bigquery.SchemaField("value", self.value_type),
+        ]
+        staging_table = bigquery.Table(staging_id, schema=schema)
+        staging_table.expires = datetime.now(timezone.utc) + STAGING_TABLE_TTL
+        self.client.create_table(staging_table)
+        try:
+            load_job = self.client.load_table_from_json(
+                [{"session_id": session_id, "value": value} for session_id, value in items],
+                staging_id,
+                job_config=bigquery.LoadJobConfig(schema=schema),
+            )
+            load_job.result()
+            if load_job.errors:
+                raise WriteBackError(f"Error staging {self.column} values: {load_job.errors}")
+            yield staging_id
+        finally:
+            self.client.delete_table(staging_id, not_found_ok=True)
+
+    def flush(self) -> dict[str, str]:
+        """
+        Applies all staged values with one MERGE and clears the batch.
+
+        Returns:
+            A mapping of session_id to one of `OUTCOME_UPDATED`,
+            `OUTCOME_ALREADY_SET` or `OUTCOME_NOT_FOUND`. Empty if nothing
+            was staged.
+
+        Raises:
+            WriteBackError: The MERGE (or staging load) reported errors. The
+                values stay staged, so a later `flush` can retry them.
+        """
+        if not self._values:
+            return {}
+
+        items = list(self._values.items())
+        with span("writeback.flush", {"column": self.column}, rows=len(items)):
+            outcomes = self._apply(items)
+        self._values = {}
+        for outcome in (OUTCOME_UPDATED, OUTCOME_ALREADY_SET, OUTCOME_NOT_FOUND):
+            matched = sum(1 for o in outcomes.values() if o == outcome)
+            if matched:
+                count("writeback_rows_total", matched, column=self.column, outcome=outcome)
+        return outcomes
+
+    def _apply(self, items: list[tuple[str, object]]) -> dict[str, str]:
+        """Passes `items` inline, or through a staging table for large batches, and MERGEs them."""
+        if len(items) > UNNEST_MAX_ROWS:
+            print(f"Staging {len(items)} {self.column} values through a load job...")
+            with self._staged(items) as staging_id:
+                return self._classify_and_merge(items, f"SELECT session_id, value FROM `{staging_id}`", [])
+        source = "SELECT r.session_id, r.value FROM UNNEST(@rows) AS r"
+        return self._classify_and_merge(items, source, self._inline_params(items))
+
+    def _classify_and_merge(self, items: list[tuple[str, object]], source: str, params: list) -> dict[str, str]:
+        """MERGEs the updates from `source` and classifies `items` by the state the MERGE saw."""
+        query_job = self.client.query(
+            self._script_sql(source), job_config=bigquery.QueryJobConfig(query_parameters=params)
+        )
+        rows = query_job.result()
+        if query_job.errors:
+            raise WriteBackError(f"Error merging {self.column} into {self.table_id}: {query_job.errors}")
+        current = {row.session_id: row.has_value for row in rows}
+
+        outcomes = {}
+        for session_id, _ in items:
+            if session_id not in current:
+                outcomes[session_id] = OUTCOME_NOT_FOUND
+            elif self.only_if_null and current[session_id]:
+                outcomes[session_id] = OUTCOME_ALREADY_SET
+            else:
+                outcomes[session_id] = OUTCOME_UPDATED
+        updated = sum(1 for outcome in outcomes.values() if outcome == OUTCOME_UPDATED)
+        print(f"MERGE set {self.column} on {updated} trades of {self.table_id}.")
+        return outcomes
+
+
+def log_outcomes(outcomes: dict[str, str], column: str):
+    """Prints one line per session_id in the style of the old per-row UPDATEs."""
+    for session_id, outcome in outcomes.items():
+        if outcome == OUTCOME_UPDATED:
+            print(f"  - Successfully updated {column} for trade {session_id}.")
+        elif outcome == OUTCOME_ALREADY_SET:
+            print(f"  - No update needed for trade {session_id} (already had {column}).")
+        else:
+            print(f"  - No update needed for trade {session_id} (does not exist).")
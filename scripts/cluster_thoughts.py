@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ISABEL: cluster the full thought-embedding history into reasoning patterns
+and report which of them win.
+
+`isabel_embed_only.py` compares a single WIN centroid with a single LOSE
+centroid. This script instead runs spherical mini-batch k-means over the
+memory-mapped matrix of the local similarity index (`similarity_index.py
+build`), so hundreds of thousands of thoughts are clustered in bounded
+memory: each step reads one `--batch-size` sample of rows, and the final
+assignment pass reads the matrix block by block.
+
+For every cluster it reports:
+
+- size, win rate and its 95% Wilson lower bound (clusters are ranked by it,
+  so small lucky clusters do not float to the top),
+- mean return_pct,
+- dominant symbols and LLM providers,
+- representative reasoning samples: the thoughts closest to the centroid,
+  fetched from BigQuery by id.
+
+The report is written as JSON, and the per-thought cluster assignment is
+saved as `clusters.npy` in the index directory.
+
+Prerequisites:
+- A local index built with `python similarity_index.py build`.
+- Google Cloud SDK authenticated (`gcloud auth application-default login`)
+  for the representative samples (skip with `--no-samples`).
+- Required Python packages installed:
+  - pip install google-cloud-bigquery numpy
+"""
+
+import argparse
+import json
+import os
+import numpy as np
+from similarity_index import (
+    DEFAULT_BLOCK_SIZE, DEFAULT_INDEX_DIR, EMBEDDINGS_TABLE_ID, GCP_PROJECT_ID,
+    SimilarityIndex, normalize,
+)
+
+# --- Configuration ---
+DEFAULT_CLUSTERS = 32
+DEFAULT_BATCH_SIZE = 4096
+DEFAULT_ITERATIONS = 300
+TOP_VALUES = 3
+SAMPLES_PER_CLUSTER = 3
+
+
+def wilson_lower_bound(wins: np.ndarray, n: np.ndarray, z: float = 1.96) -> np.ndarray:
+    """Lower bound of the Wilson score interval for a win rate."""
+    n = np.asarray(n, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = wins / n
+        centre = p + z * z / (2 * n)
+        margin = z * np.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+        return np.where(n > 0, (centre - margin) / (1 + z * z / n), 0.0)
+
+
+def minibatch_kmeans(index: SimilarityIndex, k: int, batch_size: int = DEFAULT_BATCH_SIZE,
+                     iterations: int = DEFAULT_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """
+    Spherical mini-batch k-means (Sculley, 2010) over the index's rows.
+
+    Each centroid moves towards the mean of its batch members with a
+    per-centroid learning rate of 1 / (points seen so far), then is
+    re-normalised. Only one batch of rows is in memory at a time.
+
+    Returns:
+        (k, dim) unit centroids.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(index)
+    k = min(k, n)
+    centroids = normalize(index.float_rows(np.sort(rng.choice(n, size=k, replace=False))))
+    counts = np.zeros(k, dtype=np.int64)
+    for _ in range(iterations):
+        batch = normalize(index.float_rows(np.sort(rng.choice(n, size=min(batch_size, n), replace=False))))
+        assign = np.argmax(batch @ centroids.T, axis=1)
+        batch_counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, batch)
+        hit = batch_counts > 0
+        counts[hit] += batch_counts[hit]
+        eta = (batch_counts[hit] / counts[hit])[:, np.newaxis]
+        centroids[hit] = (1 - eta) * centroids[hit] + eta * (sums[hit] / batch_counts[hit][:, np.newaxis])
+        # Re-seed centroids that have never attracted a point.
+        dead = counts == 0
+        if dead.any():
+            centroids[dead] = batch[rng.choice(len(batch), size=int(dead.sum()))]
+        centroids = normalize(centroids)
+    return centroids
+
+
+def assign_all(index: SimilarityIndex, centroids: np.ndarray,
+               block_size: int = DEFAULT_BLOCK_SIZE) -> tuple[np.ndarray, np.ndarray]:
+    """Nearest centroid and its cosine similarity for every row, block by block."""
+    n = len(index)
+    labels = np.empty(n, dtype=np.int32)
+    similarity = np.empty(n, dtype=np.float32)
+    for start in range(0, n, block_size):
+        scores = normalize(index.float_rows(slice(start, start + block_size))) @ centroids.T
+        labels[start:start + len(scores)] = np.argmax(scores, axis=1)
+        similarity[start:start + len(scores)] = scores[np.arange(len(scores)), labels[start:start + len(scores)]]
+    return labels, similarity
+
+
+def _top_values(values: np.ndarray, limit: int = TOP_VALUES) -> list[dict]:
+    keys, counts = np.unique(values, return_counts=True)
+    order = np.argsort(-counts)[:limit]
+    return [{"value": str(keys[i]), "count": int(counts[i])} for i in order]
+
+
+def summarize_clusters(index: SimilarityIndex, labels: np.ndarray, similarity: np.ndarray,
+                       k: int, samples: int = SAMPLES_PER_CLUSTER) -> list[dict]:
+    """Per-cluster statistics, ranked by the Wilson lower bound of the win rate."""
+    sizes = np.bincount(labels, minlength=k)
+    wins = np.bincount(labels, weights=index.wins, minlength=k)
+    valid_return = ~np.isnan(index.return_pct)
+    return_sum = np.bincount(labels[valid_return], weights=index.return_pct[valid_return], minlength=k)
+    return_n = np.bincount(labels[valid_return], minlength=k)
+    lower = wilson_lower_bound(wins, sizes)
+
+    clusters = []
+    order = np.argsort(labels, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    for c in range(k):
+        if sizes[c] == 0:
+            continue
+        members = order[offsets[c]:offsets[c + 1]]
+        closest = members[np.argsort(-similarity[members])[:samples]]
+        clusters.append({
+            "cluster": c,
+            "size": int(sizes[c]),
+            "wins": int(wins[c]),
+            "win_rate": round(float(wins[c] / sizes[c]), 4),
+            "win_rate_lower_95": round(float(lower[c]), 4),
+            "mean_return_pct": round(float(return_sum[c] / return_n[c]), 4) if return_n[c] else None,
+            "top_symbols": _top_values(index.symbols[members]),
+            "top_providers": _top_values(index.providers[members]),
+            "representative_ids": [str(index.ids[i]) for i in closest],
+        })
+    clusters.sort(key=lambda c: c["win_rate_lower_95"], reverse=True)
+    return clusters
+
+
+def fetch_reasoning(client, ids: list[str], table_id: str = EMBEDDINGS_TABLE_ID) -> dict[str, str]:
+    """Looks up the reasoning text of the given thought ids."""
+    from google.cloud import bigquery
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("ids", "STRING", ids)]
+    )
+    rows = client.query(f"SELECT id, reasoning FROM `{table_id}` WHERE id IN UNNEST(@ids)",
+                        job_config=job_config).result()
+    return {row.id: row.reasoning for row in rows}
+
+
+def parse_args() -> argparse.Namespace:
+    """Parses command-line options."""
+    parser = argparse.ArgumentParser(description="Cluster thought embeddings into WIN/LOSE patterns.")
+    parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR, help="Index directory.")
+    parser.add_argument("-k", "--clusters", type=int, default=DEFAULT_CLUSTERS, help="Number of clusters.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per mini-batch.")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="Mini-batch steps.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    parser.add_argument("--output", default="thought_clusters.json", help="JSON report path.")
+    parser.add_argument("--no-samples", action="store_true", help="Skip fetching representative reasoning.")
+    return parser.parse_args()
+
+
+def main():
+    """Main function to orchestrate the clustering."""
+    args = parse_args()
+    print("=== ISABEL Pattern Clustering ===")
+    index = SimilarityIndex(args.index_dir)
+    if len(index) == 0:
+        print("Index is empty. Exiting.")
+        return
+
+    print(f"Clustering {len(index)} thoughts into {args.clusters} clusters...")
+    centroids = minibatch_kmeans(index, args.clusters, args.batch_size, args.iterations, args.seed)
+    labels, similarity = assign_all(index, centroids)
+    np.save(os.path.join(args.index_dir, "clusters.npy"), labels)
+    clusters = summarize_clusters(index, labels, similarity, len(centroids))
+
+    if not args.no_samples:
+        from google.cloud import bigquery
+        ids = [i for c in clusters for i in c["representative_ids"]]
+        reasoning = fetch_reasoning(bigquery.Client(project=GCP_PROJECT_ID), ids)
+        for c in clusters:
+            c["samples"] = [reasoning.get(i, "")[:300] for i in c["representative_ids"]]
+
+    overall = float(index.wins.mean())
+    with open(args.output, "w") as f:
+        json.dump({"thoughts": len(index), "overall_win_rate": round(overall, 4), "clusters": clusters},
+                  f, ensure_ascii=False, indent=2)
+    print(f"Wrote {len(clusters)} clusters to {args.output}. Overall win rate: {overall:.1%}")
+
+    print("\nClusters by win-rate lower bound:")
+    for c in clusters:
+        symbols = ", ".join(v["value"] for v in c["top_symbols"])
+        providers = ", ".join(v["value"] for v in c["top_providers"])
+        mean_return = f"{c['mean_return_pct']:+.2f}%" if c["mean_return_pct"] is not None else "n/a"
+        print(f"  #{c['cluster']:<3} n={c['size']:<6} win={c['win_rate']:.1%} (>= {c['win_rate_lower_95']:.1%}) "
+              f"ret={mean_return} [{symbols}] [{providers}]")
+        for sample in c.get("samples", [])[:1]:
+            print(f"       {sample[:100]}...")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A local DuckDB file behind the subset of the `bigquery.Client` interface the
+labeling scripts use, so the same SQL and the same code paths
+(`ColumnWriteBack`, `evaluate_trades`, `ensure_evaluation_columns`, ...) run
+offline and in tests.
+
+`DuckDBClient.query` rewrites the BigQuery SQL before executing it:
+
+- `` `project.dataset.table` `` becomes the DuckDB table `dataset.table`.
+- `@name` parameters become `$name`; scalar, array and array-of-struct
+  `QueryParameter`s are passed as plain Python values.
+- `IN UNNEST(@x)` and `UNNEST(@x) AS r` become `unnest` subqueries.
+- `STRUCT(expr AS name, col)` becomes `struct_pack(name := expr, col := col)`.
+- `MERGE t` becomes `MERGE INTO t`, `CURRENT_TIMESTAMP()` drops its
+  parentheses, `LOGICAL_OR` becomes `bool_or`, `DATE_SUB` becomes the
+  `bq_date_sub` macro, `FLOAT64` becomes `DOUBLE`, and an `ALTER TABLE` with
+  several `ADD COLUMN`s is split into one statement per column. TIMESTAMP
+  columns in DDL become TIMESTAMPTZ, and the dataset of a created table is
+  created as a schema if missing.
+- A multi-statement script (e.g. `BEGIN TRANSACTION; ...; COMMIT
+  TRANSACTION;`) runs statement by statement; the job returns the rows of
+  the last query and the DML row count summed over the script.
+- `FARM_FINGERPRINT`, `TO_JSON_STRING`, `TIMESTAMP_SUB`, `TIMESTAMP_ADD` and
+  `SAFE_DIVIDE` are provided as macros. Fingerprints are stable within
+  DuckDB but differ from BigQuery's.
+
+Timestamps are stored as TIMESTAMPTZ in UTC, so rows come back with aware
+datetimes like BigQuery's.
+
+Usage:
+
+    client = DuckDBClient("labels.duckdb")
+    client.load_parquet("screen-share-459802.magi_core.trades", "trades.parquet")
+    evaluate_trades(client)
+
+Prerequisites:
+- Required Python packages installed:
+  - pip install duckdb google-cloud-bigquery
+"""
+
+import re
+import threading
+import duckdb
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery
+
+MACROS = (
+    "CREATE MACRO IF NOT EXISTS FARM_FINGERPRINT(x) AS (hash(x) >> 1)::BIGINT",
+    "CREATE MACRO IF NOT EXISTS TO_JSON_STRING(x) AS to_json(x)::VARCHAR",
+    "CREATE MACRO IF NOT EXISTS TIMESTAMP_SUB(ts, delta) AS ts - delta",
+    "CREATE MACRO IF NOT EXISTS TIMESTAMP_ADD(ts, delta) AS ts + delta",
+    "CREATE MACRO IF NOT EXISTS SAFE_DIVIDE(x, y) AS CASE WHEN y = 0 THEN NULL ELSE x / y END",
+    # DuckDB's own date_sub takes a date part and two timestamps.
+    "CREATE MACRO IF NOT EXISTS bq_date_sub(d, delta) AS CAST(d - delta AS DATE)",
+)
+DML_PREFIXES = ("INSERT", "UPDATE", "DELETE", "MERGE")
+SCHEMA_TYPES = {
+    "STRING": "VARCHAR", "FLOAT64": "DOUBLE", "FLOAT": "DOUBLE", "INT64": "BIGINT", "INTEGER": "BIGINT",
+    "BOOL": "BOOLEAN", "BOOLEAN": "BOOLEAN", "TIMESTAMP": "TIMESTAMPTZ", "DATE": "DATE", "BYTES": "BLOB",
+}
+
+_TABLE_REF = re.compile(r"`(?:[\w-]+\.)?(\w+)\.(\w+)`")
+_IN_UNNEST = re.compile(r"IN\s+UNNEST\(\s*@(\w+)\s*\)", re.IGNORECASE)
+_FROM_UNNEST = re.compile(r"UNNEST\(\s*@(\w+)\s*\)\s+AS\s+(\w+)", re.IGNORECASE)
+_PARAM = re.compile(r"@(\w+)")
+_CREATE_TABLE = re.compile(r"\s*CREATE\s+(?:OR\s+REPLACE\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\.\w+", re.IGNORECASE)
+_MERGE = re.compile(r"^\s*MERGE\s+(?!INTO\b)", re.IGNORECASE)
+
+
+def _local_table(table_id: str) -> str:
+    """`project.dataset.table` (or `dataset.table`) as the DuckDB `dataset.table`."""
+    return ".".join(table_id.split(".")[-2:])
+
+
+def _split_top_level(text: str) -> list[str]:
+    """Splits on commas that are not nested inside parentheses."""
+    parts, depth, start = [], 0, 0
+    for i, ch in enumerate(text):
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _rewrite_structs(sql: str) -> str:
+    """`STRUCT(a AS x, b)` -> `struct_pack(x := a, b := b)`."""
+    out, pos = [], 0
+    for match in re.finditer(r"\bSTRUCT\(", sql, re.IGNORECASE):
+        if match.start() < pos:
+            continue
+        depth, end = 1, match.end()
+        while depth:
+            depth += {"(": 1, ")": -1}.get(sql[end], 0)
+            end += 1
+        fields = []
+        for item in _split_top_level(_rewrite_structs(sql[match.end():end - 1])):
+            alias = re.match(r"(.*\S)\s+AS\s+(\w+)$", item, re.IGNORECASE | re.DOTALL)
+            if alias:
+                fields.append(f"{alias.group(2)} := {alias.group(1)}")
+            else:
+                fields.append(f"{item.split('.')[-1]} := {item}")
+        out.append(sql[pos:match.start()] + f"struct_pack({', '.join(fields)})")
+        pos = end
+    return "".join(out) + sql[pos:]
+
+
+def _split_statements(sql: str) -> list[str]:
+    """Splits a multi-statement script on semicolons outside string literals."""
+    parts, quote, start = [], None, 0
+    for i, ch in enumerate(sql):
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "'\"":
+            quote = ch
+        elif ch == ";":
+            parts.append(sql[start:i])
+            start = i + 1
+    parts.append(sql[start:])
+    return [p for p in parts if p.strip()]
+
+
+def translate(sql: str) -> list[str]:
+    """Rewrites a BigQuery statement or script into DuckDB statements."""
+    return [out for statement in _split_statements(sql) for out in _translate_statement(statement)]
+
+
+def _translate_statement(sql: str) -> list[str]:
+    sql = _TABLE_REF.sub(r"\1.\2", sql)
+    sql = _IN_UNNEST.sub(r"IN (SELECT unnest($\1))", sql)
+    sql = _FROM_UNNEST.sub(r"(SELECT unnest($\1) AS \2)", sql)
+    sql = _PARAM.sub(r"$\1", sql)
+    sql = _rewrite_structs(sql)
+    sql = _MERGE.sub("MERGE INTO ", sql)
+    sql = re.sub(r"CURRENT_TIMESTAMP\(\)", "CURRENT_TIMESTAMP", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bLOGICAL_OR\(", "bool_or(", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bDATE_SUB\(", "bq_date_sub(", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bFLOAT64\b", "DOUBLE", sql)
+    if re.match(r"\s*(ALTER|CREATE)\s+TABLE\b", sql, re.IGNORECASE):
+        sql = re.sub(r"\bTIMESTAMP\b(?!\s*\()", "TIMESTAMPTZ", sql)
+
+    alter = re.match(r"\s*ALTER\s+TABLE\s+(\S+)\s+(ADD\s+COLUMN.*)$", sql, re.IGNORECASE | re.DOTALL)
+    if alter:
+        return [f"ALTER TABLE {alter.group(1)} {clause}"
+                for clause in _split_top_level(alter.group(2))]
+    return [sql]
+
+
+def _parameter_value(param):
+    if isinstance(param, bigquery.ScalarQueryParameter):
+        return param.value
+    if isinstance(param, bigquery.StructQueryParameter):
+        return dict(param.struct_values)
+    if isinstance(param, bigquery.ArrayQueryParameter):
+        return [_parameter_value(v) if isinstance(v, bigquery.StructQueryParameter) else v for v in param.values]
+    raise TypeError(f"Unsupported query parameter {param!r}")
+
+
+class Row:
+    """A result row with attribute, key and index access, like `bigquery.Row`."""
+
+    __slots__ = ("_values", "_index")
+
+    def __init__(self, values: tuple, index: dict[str, int]):
+        self._values = values
+        self._index = index
+
+    def __getattr__(self, name):
+        try:
+            return self._values[self._index[name]]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __getitem__(self, key):
+        return self._values[key if isinstance(key, int) else self._index[key]]
+
+    def keys(self):
+        return self._index.keys()
+
+    def values(self):
+        return self._values
+
+    def get(self, key, default=None):
+        return self[key] if key in self._index else default
+
+    def __repr__(self):
+        return f"Row({dict(zip(self._index, self._values))})"
+
+
+class RowIterator:
+    """The rows of a finished query, with `total_rows`, paged and Arrow access."""
+
+    def __init__(self, rows: list[Row], page_size: int | None = None, columns: list[str] | None = None):
+        self._rows = rows
+        self.columns = columns or []
+        self.total_rows = len(rows)
+        self.page_size = page_size or max(1, len(rows))
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def pages(self):
+        for i in range(0, len(self._rows), self.page_size):
+            yield self._rows[i:i + self.page_size]
+
+    def to_arrow_iterable(self, bqstorage_client=None, **kwargs):
+        """Yields the rows as Arrow record batches of `page_size` rows."""
+        import pyarrow as pa
+
+        for page in self.pages:
+            yield pa.RecordBatch.from_pydict({c: [row[i] for row in page] for i, c in enumerate(self.columns)})
+
+
+class QueryJob:
+    """A completed DuckDB statement exposed like a `bigquery.QueryJob`."""
+
+    def __init__(self, rows: list[Row], num_dml_affected_rows: int | None, columns: list[str] | None = None):
+        self._rows = rows
+        self.columns = columns or []
+        self.num_dml_affected_rows = num_dml_affected_rows
+        self.errors = None
+        self.output_rows = num_dml_affected_rows
+
+    def result(self, page_size: int | None = None, **kwargs) -> RowIterator:
+        return RowIterator(self._rows, page_size, self.columns)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+class DuckDBClient:
+    """
+    A DuckDB database file that accepts the `bigquery.Client` calls used by
+    the labeling scripts.
+
+    Args:
+        path: Database file; ":memory:" for a throwaway database.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self.project = "local"
+        self.connection = duckdb.connect(path)
+        self.connection.execute("SET TimeZone = 'UTC'")
+        for macro in MACROS:
+            self.connection.execute(macro)
+        self._lock = threading.Lock()
+        self.query_count = 0
+        self.dml_count = 0
+
+    def close(self):
+        self.connection.close()
+
+    def _ensure_schema(self, table_id: str):
+        self.connection.execute(f"CREATE SCHEMA IF NOT EXISTS {_local_table(table_id).split('.')[0]}")
+
+    def query(self, sql: str, job_config: bigquery.QueryJobConfig | None = None, **kwargs) -> QueryJob:
+        """Runs a BigQuery statement (see `translate`) and returns a finished job."""
+        if job_config is not None and job_config.dry_run:
+            # Nothing to estimate locally; like BigQuery, a dry run changes nothing.
+            return QueryJob([], None)
+        params = {}
+        if job_config is not None:
+            params = {p.name: _parameter_value(p) for p in job_config.query_parameters or []}
+
+        rows, affected, columns = [], None, []
+        with self._lock:
+            self.query_count += 1
+            for statement in translate(sql):
+                create = _CREATE_TABLE.match(statement)
+                if create:
+                    # BigQuery datasets already exist; DuckDB schemas may not.
+                    self.connection.execute(f"CREATE SCHEMA IF NOT EXISTS {create.group(1)}")
+                # DuckDB rejects parameters the statement does not reference.
+                used = {k: v for k, v in params.items() if re.search(rf"\${k}\b", statement)}
+                cursor = self.connection.execute(statement, used or None)
+                if statement.lstrip().upper().startswith(DML_PREFIXES):
+                    affected = (affected or 0) + cursor.fetchone()[0]
+                    self.dml_count += 1
+                elif cursor.description:
+                    columns = [col[0] for col in cursor.description]
+                    index = {name: i for i, name in enumerate(columns)}
+                    rows = [Row(values, index) for values in cursor.fetchall()]
+        return QueryJob(rows, affected, columns)
+
+    def create_table(self, table: bigquery.Table, exists_ok: bool = False):
+        """Creates a table from a `bigquery.Table` schema."""
+        table_id = f"{table.dataset_id}.{table.table_id}"
+        self._ensure_schema(table_id)
+        columns = ", ".join(f"{f.name} {SCHEMA_TYPES.get(f.field_type, f.field_type)}" for f in table.schema)
+        if_not_exists = "IF NOT EXISTS " if exists_ok else ""
+        with self._lock:
+            self.connection.execute(f"CREATE TABLE {if_not_exists}{table_id} ({columns})")
+        return table
+
+    def delete_table(self, table_id: str, not_found_ok: bool = False):
+        """Drops a table."""
+        if_exists = "IF EXISTS " if not_found_ok else ""
+        with self._lock:
+            self.connection.execute(f"DROP TABLE {if_exists}{_local_table(table_id)}")
+
+    def get_table(self, table_id: str) -> bigquery.Table:
+        """A `bigquery.Table` whose schema lists the local table's columns; NotFound if missing."""
+        local = _local_table(table_id)
+        with self._lock:
+            try:
+                described = self.connection.execute(f"DESCRIBE {local}").fetchall()
+            except duckdb.CatalogException:
+                raise NotFound(f"Not found: Table {table_id}") from None
+        reverse = {v: k for k, v in SCHEMA_TYPES.items()}
+        schema = [bigquery.SchemaField(name, reverse.get(col_type, col_type)) for name, col_type, *_ in described]
+        return bigquery.Table(f"local.{local}", schema=schema)
+
+    def load_table_from_json(self, rows: list[dict], table_id: str,
+                             job_config: bigquery.LoadJobConfig | None = None) -> QueryJob:
+        """
+        Inserts JSON rows, creating the table from `job_config.schema` if
+        needed. WRITE_TRUNCATE replaces the existing rows.
+        """
+        local = _local_table(table_id)
+        schema = job_config.schema if job_config is not None else None
+        if schema:
+            self.create_table(bigquery.Table(f"local.{local}", schema=schema), exists_ok=True)
+        with self._lock:
+            if job_config is not None and job_config.write_disposition == bigquery.WriteDisposition.WRITE_TRUNCATE:
+                self.connection.execute(f"DELETE FROM {local}")
+            if rows:
+                columns = list(rows[0])
+                self.connection.executemany(
+                    f"INSERT INTO {local} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                    [[row.get(c) for c in columns] for row in rows],
+                )
+        return QueryJob([], len(rows))
+
+    def load_parquet(self, table_id: str, path: str, replace: bool = True):
+        """Creates (or replaces) a table from a Parquet snapshot, e.g. from `arrow_reader.export_parquet`."""
+        local = _local_table(table_id)
+        self._ensure_schema(table_id)
+        create = "CREATE OR REPLACE TABLE" if replace else "CREATE TABLE IF NOT EXISTS"
+        with self._lock:
+            self.connection.execute(f"{create} {local} AS SELECT * FROM read_parquet(?)", [path])
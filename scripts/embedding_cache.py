@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cohere embeddings with a persistent, content-addressed local cache.
+
+Vectors are stored in a SQLite file keyed by (model, input_type,
+embedding_type, sha256(text)) as raw float32 blobs, so a text is embedded at
+most once per model and input type no matter how often ISABEL reruns.
+`embed_texts` looks every text up in the cache, sends only the misses to
+Cohere in requests of at most `MAX_TEXTS_PER_REQUEST` texts with bounded
+concurrency, stores each response as it arrives and returns one matrix in
+input order. If a request fails, the vectors of the requests that succeeded
+stay cached and the error is re-raised.
+
+Besides `float`, Cohere can return compressed embedding types, which are
+cached in their native dtype:
+
+- `int8` / `uint8`: one byte per dimension (4x smaller than float32).
+- `binary` / `ubinary`: one bit per dimension, packed 8 per byte (32x
+  smaller).
+
+`embed_texts_by_type` requests several types in the same API call, so
+keeping a float copy for rescoring next to a binary one costs no extra
+requests.
+
+Usage:
+
+    cache = EmbeddingCache()
+    vectors = embed_texts(texts, cache=cache)  # (len(texts), 1024) float32
+    by_type = embed_texts_by_type(texts, cache, embedding_types=("float", "ubinary"))
+    by_type["ubinary"]  # (len(texts), 128) uint8
+
+Prerequisites:
+- COHERE_API_KEY set as an environment variable (only needed on cache misses).
+- Required Python packages installed:
+  - pip install cohere numpy
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import numpy as np
+from instrumentation import api_call, count
+
+# --- Configuration ---
+DEFAULT_CACHE_PATH = os.environ.get(
+    "MAGI_EMBEDDING_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "magi", "embeddings.sqlite")
+)
+DEFAULT_MODEL = "embed-multilingual-v3.0"
+DEFAULT_INPUT_TYPE = "classification"
+# Cohere's embed endpoint accepts at most 96 texts per call.
+MAX_TEXTS_PER_REQUEST = 96
+DEFAULT_CONCURRENCY = 4
+# NumPy dtype of each Cohere embedding type.
+EMBEDDING_DTYPES = {
+    "float": np.float32,
+    "int8": np.int8,
+    "uint8": np.uint8,
+    "binary": np.int8,
+    "ubinary": np.uint8,
+}
+# SQLite limits the number of bound parameters per statement.
+_LOOKUP_CHUNK = 500
+
+
+def text_hash(text: str) -> str:
+    """Content address of a text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    SQLite-backed store of embedding vectors.
+
+    Args:
+        path: Location of the SQLite file; created if missing.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                input_type TEXT NOT NULL,
+                embedding_type TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, input_type, embedding_type, text_hash)
+            ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def get_many(self, model: str, input_type: str, hashes: list[str],
+                 embedding_type: str = "float") -> dict[str, np.ndarray]:
+        """Returns the cached vectors for the given text hashes that are present."""
+        found = {}
+        for i in range(0, len(hashes), _LOOKUP_CHUNK):
+            chunk = hashes[i:i + _LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"""SELECT text_hash, vector FROM embeddings
+                    WHERE model = ? AND input_type = ? AND embedding_type = ?
+                      AND text_hash IN ({placeholders})""",
+                [model, input_type, embedding_type, *chunk],
+            )
+            for h, blob in rows:
+                found[h] = np.frombuffer(blob, dtype=EMBEDDING_DTYPES[embedding_type])
+        return found
+
+    def put_many(self, model: str, input_type: str, items: list[tuple[str, np.ndarray]],
+                 embedding_type: str = "float"):
+        """Stores (text_hash, vector) pairs, replacing existing entries."""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (model, input_type, embedding_type, h, len(v),
+                 np.asarray(v, dtype=EMBEDDING_DTYPES[embedding_type]).tobytes())
+                for h, v in items
+            ],
+        )
+        self.conn.commit()
+
+
+def _response_embeddings(response, embedding_type: str):
+    """Reads one embedding type from an embed response (`float` is `float_` in the SDK)."""
+    return getattr(response.embeddings, "float_" if embedding_type == "float" else embedding_type)
+
+
+async def _embed_misses(client, missing: dict[str, str], cache: EmbeddingCache, model: str, input_type: str,
+                        concurrency: int, embedding_types: tuple[str, ...] = ("float",)) -> dict[str, dict]:
+    """
+    Embeds `missing` (text_hash -> text) in chunks of MAX_TEXTS_PER_REQUEST
+    with bounded concurrency, caching each chunk as soon as it arrives.
+
+    A failed request does not discard the others: every chunk that succeeded
+    is already stored before the first error is re-raised, so a rerun only
+    embeds what is still missing.
+
+    Returns:
+        {embedding_type: {text_hash: vector}} of the new embeddings.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def embed_chunk(chunk):
+        async with semaphore:
+            count("cohere_texts_total", len(chunk))
+            with api_call("cohere", "embed"):
+                response = await client.embed(
+                    texts=[text for _, text in chunk],
+                    model=model,
+                    input_type=input_type,
+                    embedding_types=list(embedding_types),
+                )
+        hashes = [h for h, _ in chunk]
+        new = {}
+        for t in embedding_types:
+            items = list(zip(hashes, np.asarray(_response_embeddings(response, t), dtype=EMBEDDING_DTYPES[t])))
+            cache.put_many(model, input_type, items, embedding_type=t)
+            new[t] = dict(items)
+        return new
+
+    items = list(missing.items())
+    chunks = [items[i:i + MAX_TEXTS_PER_REQUEST] for i in range(0, len(items), MAX_TEXTS_PER_REQUEST)]
+    results = await asyncio.gather(*(embed_chunk(c) for c in chunks), return_exceptions=True)
+    errors = [r for r in results if isinstance(r, BaseException)]
+    new_vectors = {t: {} for t in embedding_types}
+    for result in results:
+        if not isinstance(result, BaseException):
+            for t in embedding_types:
+                new_vectors[t].update(result[t])
+    if errors:
+        print(f"{len(errors)} of {len(chunks)} embed requests failed; "
+              f"{len(new_vectors[embedding_types[0]])} new embeddings were cached.")
+        raise errors[0]
+    return new_vectors
+
+
+async def embed_texts_by_type_async(texts: list[str], cache: EmbeddingCache, model: str = DEFAULT_MODEL,
+                                    input_type: str = DEFAULT_INPUT_TYPE,
+                                    embedding_types: tuple[str, ...] = ("float",), client=None,
+                                    concurrency: int = DEFAULT_CONCURRENCY) -> dict[str, np.ndarray]:
+    """
+    Returns {embedding_type: (len(texts), width) matrix}, embedding only cache misses.
+
+    Args:
+        texts: Texts to embed; duplicates are embedded once.
+        cache: The local embedding cache.
+        model: Cohere embedding model.
+        input_type: Cohere input type.
+        embedding_types: Types to return (see `EMBEDDING_DTYPES`). A text
+            missing any of them is re-requested with all of them.
+        client: A `cohere.AsyncClientV2`; created from COHERE_API_KEY on
+            the first miss if omitted.
+        concurrency: Maximum number of embed requests in flight.
+    """
+    embedding_types = tuple(dict.fromkeys(embedding_types))
+    hashes = [text_hash(t) for t in texts]
+    unique = list(set(hashes))
+    vectors = {t: cache.get_many(model, input_type, unique, embedding_type=t) for t in embedding_types}
+
+    missing = {}
+    for h, t in zip(hashes, texts):
+        if any(h not in vectors[et] for et in embedding_types):
+            missing.setdefault(h, t)
+
+    count("embedding_cache_lookups_total", len(unique) - len(missing), result="hit")
+    count("embedding_cache_lookups_total", len(missing), result="miss")
+    if missing:
+        if client is None:
+            import cohere
+            client = cohere.AsyncClientV2(os.environ.get("COHERE_API_KEY"))
+        print(f"Embedding {len(missing)} new texts ({len(unique) - len(missing)} cached) "
+              f"in {-(-len(missing) // MAX_TEXTS_PER_REQUEST)} requests...")
+        new_vectors = await _embed_misses(client, missing, cache, model, input_type, concurrency, embedding_types)
+        for et in embedding_types:
+            vectors[et].update(new_vectors[et])
+    else:
+        print(f"All {len(hashes)} embeddings served from cache.")
+
+    if not hashes:
+        return {et: np.empty((0, 0), dtype=EMBEDDING_DTYPES[et]) for et in embedding_types}
+    return {et: np.stack([vectors[et][h] for h in hashes]) for et in embedding_types}
+
+
+async def embed_texts_async(texts: list[str], cache: EmbeddingCache, model: str = DEFAULT_MODEL,
+                            input_type: str = DEFAULT_INPUT_TYPE, client=None,
+                            concurrency: int = DEFAULT_CONCURRENCY,
+                            embedding_type: str = "float") -> np.ndarray:
+    """
+    Returns a (len(texts), width) matrix of one embedding type (float32 by
+    default), embedding only cache misses. See `embed_texts_by_type_async`.
+    """
+    by_type = await embed_texts_by_type_async(texts, cache, model=model, input_type=input_type,
+                                              embedding_types=(embedding_type,), client=client,
+                                              concurrency=concurrency)
+    return by_type[embedding_type]
+
+
+def embed_texts(texts: list[str], cache: EmbeddingCache, **kwargs) -> np.ndarray:
+    """Synchronous wrapper around `embed_texts_async`."""
+    return asyncio.run(embed_texts_async(texts, cache, **kwargs))
+
+
+def embed_texts_by_type(texts: list[str], cache: EmbeddingCache, **kwargs) -> dict[str, np.ndarray]:
+    """Synchronous wrapper around `embed_texts_by_type_async`."""
+    return asyncio.run(embed_texts_by_type_async(texts, cache, **kwargs))
@@ -16,7 +16,13 @@
 
 """
 This script evaluates completed trades in a BigQuery table, classifying them
-as 'WIN', 'LOSE', or 'HOLD' based on their return percentage.
+as 'WIN', 'LOSE', or 'HOLD' based on their return percentage. The rule itself
+lives in `trade_evaluation.py`, which also records the rule version and an
+input fingerprint for each evaluated trade.
+
+Newly evaluated trades are then folded into the per-day aggregate table
+`magi_analytics.trade_outcomes_daily` (see `trade_outcomes.py`) that the
+agent's ISABEL stats read.
 
 This script should be run after `update_exit_prices.py` to ensure all trades
 have an exit price before evaluation.
@@ -27,6 +33,9 @@ Prerequisites:
   - pip install google-cloud-bigquery
 """
 from google.cloud import bigquery
+from instrumentation import instrument_client, instrumented, span
+from trade_evaluation import EVALUABLE_SQL, SET_EVALUATION_SQL, ensure_evaluation_columns, evaluation_parameters
+from trade_outcomes import apply_new_outcomes, ensure_outcomes_table
 
 # --- Configuration ---
 GCP_PROJECT_ID = "screen-share-459802"
@@ -49,25 +58,10 @@ def evaluate_trades(client: bigquery.Client):
     query = f"""
     UPDATE `{TABLE_ID}`
     SET 
-      result = CASE 
-        /* Volatility-adjusted WIN condition */
-        WHEN side = 'buy' AND (exit_price - filled_avg_price) >= (atr_at_execution * @win_multiplier) THEN 'WIN'
-        WHEN side = 'sell' AND (filled_avg_price - exit_price) >= (atr_at_execution * @win_multiplier) THEN 'WIN'
-        
-        /* Volatility-adjusted LOSE condition */
-        WHEN side = 'buy' AND (exit_price - filled_avg_price) <= -(atr_at_execution * @lose_multiplier) THEN 'LOSE'
-        WHEN side = 'sell' AND (filled_avg_price - exit_price) <= -(atr_at_execution * @lose_multiplier) THEN 'LOSE'
-        
-        ELSE 'HOLD'
-      END,
-      return_pct = ROUND((exit_price - filled_avg_price) / filled_avg_price * 100, 2)
+      {SET_EVALUATION_SQL}
     WHERE 
       result IS NULL
-      AND exit_price IS NOT NULL
-      AND filled_avg_price IS NOT NULL
-      AND filled_avg_price > 0
-      AND atr_at_execution IS NOT NULL
-      AND atr_at_execution > 0
+      AND {EVALUABLE_SQL}
       /* Optional: only evaluate older trades */
       AND timestamp < TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 1 DAY)
     """
@@ -75,10 +69,7 @@ def evaluate_trades(client: bigquery.Client):
     print(f"Executing volatility-adjusted trade evaluation query:\n{query}")
     
     job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("win_multiplier", "FLOAT64", WIN_ATR_MULTIPLIER),
-            bigquery.ScalarQueryParameter("lose_multiplier", "FLOAT64", LOSE_ATR_MULTIPLIER),
-        ]
+        query_parameters=evaluation_parameters(WIN_ATR_MULTIPLIER, LOSE_ATR_MULTIPLIER)
     )
 
     # Execute the query
@@ -93,20 +84,30 @@ def evaluate_trades(client: bigquery.Client):
         # DML queries return the number of rows affected
         print(f"Successfully evaluated {query_job.num_dml_affected_rows} trades.")
 
+    # Also picks up trades a previous run evaluated but failed to aggregate.
+    try:
+        apply_new_outcomes(client)
+    except Exception as e:
+        print(f"Failed to update the outcome aggregates; the next run will catch up. Error: {e}")
+
+@instrumented
 def main():
     """Main function to orchestrate the evaluation."""
     print("Starting trade evaluation process...")
     
     # --- Initialize Client ---
     try:
-        bq_client = bigquery.Client(project=GCP_PROJECT_ID)
+        bq_client = instrument_client(bigquery.Client(project=GCP_PROJECT_ID))
         print("Successfully connected to BigQuery.")
     except Exception as e:
         print(f"Failed to connect to BigQuery. Ensure you are authenticated. Error: {e}")
         return
 
     # --- Run Evaluation ---
-    evaluate_trades(bq_client)
+    ensure_evaluation_columns(bq_client, TABLE_ID)
+    ensure_outcomes_table(bq_client)
+    with span("evaluate_trades"):
+        evaluate_trades(bq_client)
     
     print("\nEvaluation process complete.")
 
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Vectorized technical indicators with the same semantics as `magi-core.js`.
+
+Every function takes 2-D arrays shaped (symbols x days), aligned on a shared
+trading calendar with the oldest day first, and returns full series of the
+same shape. The value in column `t` is what the agent would have computed if
+its bar request had ended on day `t`:
+
+- `get_price_history` requests the last 20 bars and derives SMA5, SMA20,
+  RSI14, ATR14, 1/5/20-day change and the volume ratio from them.
+- `getTradeExecutionData` requests the last 21 bars and stores their ATR14
+  as `atr_at_execution`.
+
+The JS ATR is Wilder's smoothing seeded with the simple mean of the first 14
+true ranges *of the requested window*, so it depends on the window length;
+`js_atr` reproduces that exactly. The JS RSI is the simple-average (Cutler)
+variant over the last 14 changes, rounded to an integer.
+
+Days without enough history yield NaN. Missing bars (NaN) propagate through
+every window that contains them.
+
+Prerequisites:
+- Required Python packages installed:
+  - pip install numpy
+"""
+
+from decimal import ROUND_HALF_UP, Decimal
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# --- Configuration ---
+ATR_PERIOD = 14
+RSI_PERIOD = 14
+# Number of daily bars requested by `get_price_history`.
+PRICE_HISTORY_WINDOW = 20
+# Number of daily bars requested by `getTradeExecutionData`.
+EXECUTION_ATR_WINDOW = 21
+
+
+def js_round(values: np.ndarray) -> np.ndarray:
+    """
+    JavaScript `Math.round`: halves are rounded towards +infinity.
+
+    `floor(x + 0.5)` would be off where the addition itself rounds, e.g.
+    0.49999999999999994 or odd integers above 2**52; `x - floor(x)` is exact.
+    """
+    values = np.asarray(values, dtype=float)
+    floor = np.floor(values)
+    with np.errstate(invalid="ignore"):
+        return floor + (values - floor >= 0.5)
+
+
+def _to_fixed_scalar(value, digits):
+    if value is None or np.isnan(value):
+        return np.nan
+    if np.isinf(value):
+        # `toFixed` leaves infinities as "Infinity" / "-Infinity".
+        return float(value)
+    quantum = Decimal(1).scaleb(-digits)
+    return float(Decimal(float(value)).quantize(quantum, rounding=ROUND_HALF_UP))
+
+
+_to_fixed_ufunc = np.frompyfunc(_to_fixed_scalar, 2, 1)
+
+
+def js_to_fixed(values: np.ndarray, digits: int) -> np.ndarray:
+    """
+    `parseFloat(x.toFixed(digits))` for every element.
+
+    `toFixed` rounds the exact binary value with ties away from zero, which
+    differs from `np.round` on exact ties, so thresholds applied to the
+    rounded strings in the agent are reproduced exactly.
+    """
+    return np.asarray(_to_fixed_ufunc(np.asarray(values, dtype=float), digits), dtype=float)
+
+
+def _trailing(values: np.ndarray, window: int) -> np.ndarray:
+    """Sliding windows of length `window` ending at each column, NaN-padded at the start."""
+    values = np.asarray(values, dtype=float)
+    padded = np.concatenate(
+        [np.full(values.shape[:-1] + (window - 1,), np.nan), values], axis=-1
+    )
+    return sliding_window_view(padded, window, axis=-1)
+
+
+def sma(close: np.ndarray, n: int) -> np.ndarray:
+    """
+    Simple moving average of the last `n` closes, summed left to right like
+    the JS `reduce` so that the rounded values match to the last digit.
+    """
+    windows = _trailing(close, n)
+    total = windows[..., 0].copy()
+    for i in range(1, n):
+        total += windows[..., i]
+    return total / n
+
+
+def pct_change(close: np.ndarray, lag: int) -> np.ndarray:
+    """Percent change versus the close `lag` bars earlier."""
+    close = np.asarray(close, dtype=float)
+    out = np.full(close.shape, np.nan)
+    out[..., lag:] = (close[..., lag:] - close[..., :-lag]) / close[..., :-lag] * 100
+    return out
+
+
+def true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+    """True range per bar; the first column is NaN because it has no previous close."""
+    high, low, close = (np.asarray(a, dtype=float) for a in (high, low, close))
+    prev_close = np.concatenate([np.full(close.shape[:-1] + (1,), np.nan), close[..., :-1]], axis=-1)
+    return np.maximum.reduce([high - low, np.abs(high - prev_close), np.abs(low - prev_close)])
+
+
+def _js_atr_weights(n_tr: int, period: int) -> np.ndarray:
+    """
+    Weights such that `weights @ tr[-n_tr:]` equals the JS `calculateATR`
+    result for a window with `n_tr` true ranges.
+    """
+    decay = (period - 1) / period
+    steps = n_tr - period
+    weights = np.empty(n_tr)
+    weights[:period] = decay ** steps / period
+    weights[period:] = decay ** np.arange(steps - 1, -1, -1) / period
+    return weights
+
+
+def js_atr(high: np.ndarray, low: np.ndarray, close: np.ndarray,
+           period: int = ATR_PERIOD, window: int = EXECUTION_ATR_WINDOW) -> np.ndarray:
+    """
+    ATR as computed by `calculateATR` in `magi-core.js` over the last
+    `window` bars ending at each day.
+
+    With a fixed window the JS recurrence is a fixed linear filter over the
+    window's true ranges, so it is evaluated as one dot product per window.
+    While fewer than `window` bars exist the window is shortened the same way
+    the agent's request would be.
+    """
+    tr = true_range(high, low, close)
+    out = np.full(tr.shape, np.nan)
+    n_days = tr.shape[-1]
+
+    # Full windows: `window` bars give `window - 1` true ranges.
+    n_tr = window - 1
+    if n_days >= window:
+        windows = sliding_window_view(tr[..., 1:], n_tr, axis=-1)
+        out[..., window - 1:] = windows @ _js_atr_weights(n_tr, period)
+
+    # Short history: the agent gets fewer bars and still needs period + 1.
+    for t in range(period, min(window - 1, n_days)):
+        out[..., t] = tr[..., 1:t + 1] @ _js_atr_weights(t, period)
+    return out
+
+
+def wilder_atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, period: int = ATR_PERIOD) -> np.ndarray:
+    """
+    Classic full-history Wilder ATR seeded with the mean of the first
+    `period` true ranges. Independent of any request window.
+    """
+    tr = true_range(high, low, close)
+    out = np.full(tr.shape, np.nan)
+    if tr.shape[-1] <= period:
+        return out
+    atr = tr[..., 1:period + 1].mean(axis=-1)
+    out[..., period] = atr
+    for t in range(period + 1, tr.shape[-1]):
+        atr = (atr * (period - 1) + tr[..., t]) / period
+        out[..., t] = atr
+    return out
+
+
+def js_rsi(close: np.ndarray, period: int = RSI_PERIOD) -> np.ndarray:
+    """
+    RSI as computed in `get_price_history`: simple averages of the gains and
+    losses of the last `period` changes, rounded with `Math.round`; 100 when
+    there were no losses.
+    """
+    close = np.asarray(close, dtype=float)
+    diff = np.concatenate([np.full(close.shape[:-1] + (1,), np.nan), np.diff(close, axis=-1)], axis=-1)
+    windows = _trailing(diff, period)
+    gains = np.where(windows > 0, windows, 0.0).sum(axis=-1)
+    losses = np.where(windows < 0, -windows, 0.0).sum(axis=-1)
+    valid = ~np.isnan(windows).any(axis=-1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = js_round(100 - (100 / (1 + (gains / period) / (losses / period))))
+    rsi = np.where(losses == 0, 100.0, rsi)
+    return np.where(valid, rsi, np.nan)
+
+
+def volume_stats(volume: np.ndarray, window: int = PRICE_HISTORY_WINDOW) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Average volume (rounded like `Math.round`) over the last `window` bars,
+    or over all bars while fewer exist, and the latest volume's ratio to it.
+    """
+    volume = np.asarray(volume, dtype=float)
+    csum = np.cumsum(volume, axis=-1)
+    lagged = np.concatenate(
+        [np.zeros(volume.shape[:-1] + (window,)), csum[..., :-window]], axis=-1
+    )[..., :volume.shape[-1]]
+    counts = np.minimum(np.arange(1, volume.shape[-1] + 1), window)
+    avg_volume = js_round((csum - lagged) / counts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = volume / avg_volume
+    return avg_volume, ratio
+
+
+def compute_indicators(high: np.ndarray, low: np.ndarray, close: np.ndarray, volume: np.ndarray,
+                       window: int = PRICE_HISTORY_WINDOW) -> dict[str, np.ndarray]:
+    """
+    Computes every `get_price_history` indicator for each (symbol, day).
+
+    Returned values are unrounded except where the agent rounds before using
+    them (`rsi14`, `avg_volume`); apply `js_to_fixed` to mirror the strings
+    the LLM was shown.
+    """
+    avg_volume, ratio = volume_stats(volume, window)
+    sma5 = sma(close, 5)
+    sma20 = sma(close, 20)
+    return {
+        "sma5": sma5,
+        "sma20": sma20,
+        "rsi14": js_rsi(close, RSI_PERIOD),
+        "atr14": js_atr(high, low, close, ATR_PERIOD, window),
+        "change_1d": pct_change(close, 1),
+        "change_5d": pct_change(close, 5),
+        # The agent compares against the oldest of its 20 bars, i.e. 19 bars back.
+        "change_20d": pct_change(close, window - 1),
+        "avg_volume": avg_volume,
+        "volume_ratio": ratio,
+        "bullish": np.where(np.isnan(sma5) | np.isnan(sma20), np.nan, (sma5 > sma20).astype(float)),
+    }
+
+
+def stack_bars(bars_by_symbol: dict[str, np.ndarray]) -> tuple[list[str], np.ndarray, dict[str, np.ndarray]]:
+    """
+    Aligns per-symbol bar arrays (see `bar_store.BAR_DTYPE`) on the union of
+    their dates.
+
+    Returns:
+        The symbol order, the sorted `datetime64[D]` dates and a dict of
+        (symbols x days) matrices for `open`, `high`, `low`, `close` and
+        `volume`, with NaN where a symbol has no bar.
+    """
+    symbols = list(bars_by_symbol)
+    if not symbols:
+        return [], np.empty(0, dtype="datetime64[D]"), {}
+    dates = np.unique(np.concatenate([bars_by_symbol[s]["date"] for s in symbols]))
+    fields = ("open", "high", "low", "close", "volume")
+    matrices = {f: np.full((len(symbols), len(dates)), np.nan) for f in fields}
+    for row, symbol in enumerate(symbols):
+        bars = bars_by_symbol[symbol]
+        cols = np.searchsorted(dates, bars["date"])
+        for f in fields:
+            matrices[f][row, cols] = bars[f]
+    return symbols, dates, matrices
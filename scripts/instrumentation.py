@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Timing, counters and BigQuery cost accounting shared by the batch scripts.
+
+Scripts keep printing their progress lines; this module records what those
+lines do not show, so the scheduler can alert on slow or expensive runs:
+
+- Spans: `with span("sync_closed_orders"):` times a stage. Every span is
+  summarised (count, total and max seconds per name and labels); stage
+  spans are also written as one JSON line each. External calls use
+  `api_call("alpaca", "bars")`, which counts the request and times it
+  without writing a line per call.
+- Counters: `count("rows_total", n, stage="atr", kind="written")`.
+- BigQuery jobs: `instrument_client(client)` wraps a client so every query
+  and load job records its `total_bytes_processed`, `total_bytes_billed`,
+  `slot_millis` and affected rows when its result is read.
+  `estimate_bytes` dry-runs a query to price it before running it.
+- Runs: decorating a script's `main` with `@instrumented` times the whole
+  run, records whether it raised and writes the outputs when it ends.
+
+Outputs, both optional and configured through environment variables:
+
+- MAGI_METRICS_JSONL: file the JSON lines (spans, BigQuery jobs and a final
+  `run` summary) are appended to.
+- MAGI_METRICS_PROM_DIR: directory for a Prometheus textfile-collector file,
+  `magi_<script>.prom`, rewritten at the end of every run.
+
+With neither set, metrics are only kept in memory.
+
+Usage:
+
+    @instrumented
+    def main():
+        client = instrument_client(bigquery.Client(project=GCP_PROJECT_ID))
+        with span("evaluate"):
+            client.query(sql).result()
+        count("rows_total", 42, stage="evaluate", kind="written")
+
+Prerequisites:
+- Required Python packages installed:
+  - pip install google-cloud-bigquery
+"""
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# --- Configuration ---
+JSONL_PATH = os.environ.get("MAGI_METRICS_JSONL")
+PROM_DIR = os.environ.get("MAGI_METRICS_PROM_DIR")
+METRIC_PREFIX = "magi_"
+# BigQuery on-demand price, used for the estimates printed by the scripts.
+ON_DEMAND_USD_PER_TIB = 6.25
+
+METRIC_HELP = {
+    "span_seconds": "Time spent in a stage or external call.",
+    "alpaca_requests_total": "HTTP requests sent to Alpaca.",
+    "alpaca_retries_total": "Alpaca requests retried after a 429, 5xx or connection error.",
+    "cohere_requests_total": "Embed requests sent to Cohere.",
+    "cohere_texts_total": "Texts sent to Cohere for embedding.",
+    "embedding_cache_lookups_total": "Embedding cache lookups by result.",
+    "bq_jobs_total": "BigQuery jobs by statement type.",
+    "bq_bytes_processed_total": "Bytes processed by BigQuery jobs.",
+    "bq_bytes_billed_total": "Bytes billed for BigQuery jobs.",
+    "bq_slot_millis_total": "Slot milliseconds consumed by BigQuery jobs.",
+    "bq_rows_affected_total": "Rows changed by DML or written by load jobs.",
+    "bq_estimated_bytes": "Bytes a dry run estimated for the last query of its kind.",
+    "rows_total": "Rows read or written by a stage.",
+    "writeback_rows_total": "Values flushed by ColumnWriteBack, by outcome.",
+    "run_duration_seconds": "Wall time of the last run.",
+    "run_success": "1 if the last run finished without an exception.",
+    "run_timestamp_seconds": "Unix time the last run finished.",
+}
+
+
+def _script_name() -> str:
+    return os.path.splitext(os.path.basename(sys.argv[0] if sys.argv else ""))[0] or "python"
+
+
+class Metrics:
+    """Thread-safe in-memory counters, span summaries and gauges of one run."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: dict[tuple, float] = {}
+        self.spans: dict[tuple, list[float]] = {}
+        self.gauges: dict[tuple, float] = {}
+        self.script = _script_name()
+        self.run_id = uuid.uuid4().hex[:12]
+
+    @staticmethod
+    def key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def add(self, name: str, value: float, labels: dict):
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, labels: dict):
+        with self.lock:
+            self.gauges[self.key(name, labels)] = value
+
+    def observe(self, name: str, seconds: float, labels: dict):
+        key = self.key(name, labels)
+        with self.lock:
+            summary = self.spans.setdefault(key, [0, 0.0, 0.0])
+            summary[0] += 1
+            summary[1] += seconds
+            summary[2] = max(summary[2], seconds)
+
+
+METRICS = Metrics()
+_write_lock = threading.Lock()
+_write_failed = False
+
+
+def _warn_write_failed(path: str, error: OSError):
+    """Metrics must never fail a run: report the first write error and carry on."""
+    global _write_failed
+    if not _write_failed:
+        _write_failed = True
+        print(f"Warning: could not write metrics to {path}: {error}")
+
+
+def emit(event: str, **fields):
+    """Appends one JSON line to MAGI_METRICS_JSONL, if set."""
+    if not JSONL_PATH:
+        return
+    record = {
+        "ts": datetime.now(timezone.utc).isoformat(),
+        "run_id": METRICS.run_id,
+        "script": METRICS.script,
+        "event": event,
+        **fields,
+    }
+    line = json.dumps(record, default=str)
+    with _write_lock:
+        try:
+            os.makedirs(os.path.dirname(JSONL_PATH) or ".", exist_ok=True)
+            with open(JSONL_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            _warn_write_failed(JSONL_PATH, e)
+
+
+def count(name: str, value: float = 1, **labels):
+    """Adds `value` to a counter."""
+    METRICS.add(name, value, labels)
+
+
+def gauge(name: str, value: float, **labels):
+    """Sets a gauge to `value`."""
+    METRICS.set(name, value, labels)
+
+
+@contextmanager
+def span(name: str, labels: dict | None = None, emit_line: bool = True, **fields):
+    """
+    Times the enclosed block as `name`.
+
+    The duration is always summarised per name and `labels`, which should
+    have few distinct values (a column or stage name, not a row count).
+    With `emit_line` it is also written as a JSON line together with the
+    labels, `fields` and whether the block raised.
+    """
+    labels = labels or {}
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        METRICS.observe(name, seconds, labels)
+        if emit_line:
+            emit("span", name=name, seconds=round(seconds, 6), status=status, **labels, **fields)
+
+
+@contextmanager
+def api_call(service: str, api: str):
+    """Counts and times one request to an external API (no JSON line per call)."""
+    count(f"{service}_requests_total", api=api)
+    with span(f"{service}.{api}", emit_line=False):
+        yield
+
+
+def _statement_type(job, sql: str | None) -> str:
+    statement_type = getattr(job, "statement_type", None)
+    if statement_type:
+        return statement_type
+    words = (sql or "").split(None, 1)
+    return words[0].upper() if words else "UNKNOWN"
+
+
+def record_job(job, kind: str, sql: str | None = None):
+    """Records the cost and result size of a finished BigQuery job."""
+    statement_type = "LOAD" if kind == "load" else _statement_type(job, sql)
+    bytes_processed = getattr(job, "total_bytes_processed", None)
+    bytes_billed = getattr(job, "total_bytes_billed", None)
+    slot_millis = getattr(job, "slot_millis", None)
+    rows = getattr(job, "output_rows", None) if kind == "load" else getattr(job, "num_dml_affected_rows", None)
+
+    count("bq_jobs_total", statement_type=statement_type)
+    if bytes_processed:
+        count("bq_bytes_processed_total", bytes_processed, statement_type=statement_type)
+    if bytes_billed:
+        count("bq_bytes_billed_total", bytes_billed, statement_type=statement_type)
+    if slot_millis:
+        count("bq_slot_millis_total", slot_millis, statement_type=statement_type)
+    if rows:
+        count("bq_rows_affected_total", rows, statement_type=statement_type)
+    emit(
+        "bq_job",
+        job_id=getattr(job, "job_id", None),
+        statement_type=statement_type,
+        total_bytes_processed=bytes_processed,
+        total_bytes_billed=bytes_billed,
+        slot_millis=slot_millis,
+        rows=rows,
+        cache_hit=getattr(job, "cache_hit", None),
+    )
+
+
+class _InstrumentedJob:
+    """A job whose first `result()` call times the wait and records the job's cost."""
+
+    def __init__(self, job, kind: str, sql: str | None = None):
+        self._job = job
+        self._kind = kind
+        self._sql = sql
+        self._recorded = False
+
+    def __getattr__(self, name):
+        return getattr(self._job, name)
+
+    def __iter__(self):
+        return iter(self.result())
+
+    def result(self, *args, **kwargs):
+        with span(f"bigquery.{self._kind}", emit_line=False):
+            result = self._job.result(*args, **kwargs)
+        if not self._recorded:
+            self._recorded = True
+            record_job(self._job, self._kind, self._sql)
+        return result
+
+
+class InstrumentedClient:
+    """
+    A `bigquery.Client` (or `duckdb_backend.DuckDBClient`) whose query and
+    load jobs are recorded by `record_job`. Everything else is passed
+    through unchanged.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def query(self, query: str, job_config=None, **kwargs):
+        return _InstrumentedJob(self._client.query(query, job_config=job_config, **kwargs), "query", query)
+
+    def load_table_from_json(self, *args, **kwargs):
+        return _InstrumentedJob(self._client.load_table_from_json(*args, **kwargs), "load")
+
+    def load_table_from_file(self, *args, **kwargs):
+        return _InstrumentedJob(self._client.load_table_from_file(*args, **kwargs), "load")
+
+    def load_table_from_dataframe(self, *args, **kwargs):
+        return _InstrumentedJob(self._client.load_table_from_dataframe(*args, **kwargs), "load")
+
+
+def instrument_client(client):
+    """Wraps a client so its jobs are recorded; wrapping twice is a no-op."""
+    return client if isinstance(client, InstrumentedClient) else InstrumentedClient(client)
+
+
+def estimate_bytes(client, query: str, query_parameters: list | None = None, name: str = "query") -> int | None:
+    """
+    Dry-runs a query and returns the bytes BigQuery would process, or None
+    if the backend cannot estimate (e.g. the local DuckDB stand-in).
+    """
+    from google.cloud import bigquery
+
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=query_parameters or [], dry_run=True, use_query_cache=False
+    )
+    job = client.query(query, job_config=job_config)
+    if isinstance(job, _InstrumentedJob):
+        job = job._job
+    estimated = getattr(job, "total_bytes_processed", None)
+    if estimated is not None:
+        gauge("bq_estimated_bytes", estimated, query=name)
+    emit("bq_estimate", query=name, total_bytes_processed=estimated)
+    return estimated
+
+
+def format_bytes_cost(num_bytes: int) -> str:
+    """`num_bytes` as GiB with its on-demand price, e.g. "12.30 GiB (~$0.08)"."""
+    return f"{num_bytes / 2**30:.2f} GiB (~${num_bytes / 2**40 * ON_DEMAND_USD_PER_TIB:.2f})"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = (("script", METRICS.script),) + labels + extra
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def prometheus_text() -> str:
+    """The current metrics in the Prometheus text exposition format."""
+    lines = []
+    with METRICS.lock:
+        families: dict[str, list[str]] = {}
+        types: dict[str, str] = {}
+        for (name, labels), value in sorted(METRICS.counters.items()):
+            families.setdefault(name, []).append(f"{METRIC_PREFIX}{name}{_labels(labels)} {_value(value)}")
+            types[name] = "counter"
+        for (name, labels), value in sorted(METRICS.gauges.items()):
+            families.setdefault(name, []).append(f"{METRIC_PREFIX}{name}{_labels(labels)} {_value(value)}")
+            types[name] = "gauge"
+        for (name, labels), (n, total, longest) in sorted(METRICS.spans.items()):
+            span_labels = (("span", name),) + labels
+            families.setdefault("span_seconds", []).extend([
+                f"{METRIC_PREFIX}span_seconds_count{_labels(span_labels)} {n}",
+                f"{METRIC_PREFIX}span_seconds_sum{_labels(span_labels)} {total:.6f}",
+            ])
+            families.setdefault("span_seconds_max", []).append(
+                f"{METRIC_PREFIX}span_seconds_max{_labels(span_labels)} {longest:.6f}"
+            )
+            types["span_seconds"], types["span_seconds_max"] = "summary", "gauge"
+    for name, samples in families.items():
+        help_text = METRIC_HELP.get(name, METRIC_HELP["span_seconds"] if name.startswith("span_") else name)
+        lines.append(f"# HELP {METRIC_PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}{name} {types[name]}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(directory: str | None = PROM_DIR):
+    """Atomically rewrites `magi_<script>.prom` in the textfile-collector directory."""
+    if not directory:
+        return
+    path = os.path.join(directory, f"{METRIC_PREFIX}{METRICS.script}.prom")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(prometheus_text())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        _warn_write_failed(path, e)
+
+
+def finish_run(seconds: float, success: bool):
+    """Records the run gauges and writes both outputs."""
+    gauge("run_duration_seconds", round(seconds, 3))
+    gauge("run_success", 1 if success else 0)
+    gauge("run_timestamp_seconds", round(time.time()))
+    with METRICS.lock:
+        counters = {
+            name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}": value
+            for (name, labels), value in METRICS.counters.items()
+        }
+    emit("run", seconds=round(seconds, 3), success=success, counters=counters)
+    write_prometheus()
+
+
+def instrumented(main):
+    """Decorates a script's `main()` so the run is timed and its metrics written when it ends."""
+    @functools.wraps(main)
+    def wrapper(*args, **kwargs):
+        METRICS.script = _script_name()
+        start = time.perf_counter()
+        success = False
+        try:
+            result = main(*args, **kwargs)
+            success = True
+            return result
+        finally:
+            finish_run(time.perf_counter() - start, success)
+    return wrapper
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script precomputes everything `magi-core.js main()` loads from ISABEL
+before the first LLM call, and writes it as one versioned artifact row.
+
+On every start each unit used to run, one after another:
+`getIsabelStats` (2 queries), `getIsabelPatterns`, `getIsabelQuality`,
+`getRealtimeFeedback` (2 queries) and `getIsabelEmbeddings` (a query plus a
+Cohere call). This job computes the same structures once per schedule tick,
+for every provider at once:
+
+- `stats`: direction win rates per provider/side and per-symbol win rates,
+  from the per-day aggregates maintained by `evaluate_trades.py`
+  (`trade_outcomes.py`).
+- `patterns`: keyword win rates, winning/losing keywords and the short
+  reasoning win rate. With `--mined-patterns` the winning/losing entries
+  come from the incremental n-gram miner (`ngram_miner.py`) instead of the
+  fixed keyword list.
+- `quality`: average quality score of WIN/LOSE reasoning and each factor's
+  impact, using the same ten factors as `analyzeReasoningQuality`. New
+  thoughts are scored into `thought_quality` first
+  (`score_thought_quality.py`), and the summary is aggregated from the stored
+  bitmasks. `--rescan-quality` scores the reasoning text directly instead.
+- `feedback`: per provider, the last 5 trades and the statistics of the
+  last 7 calendar days (today included), also from the aggregates.
+- `embeddings`: the WIN/LOSE centroids of the latest reasoning, embedded
+  through the local embedding cache.
+
+Every component has exactly the shape the JS globals (`isabelStats`,
+`isabelPatterns`, ...) already use. The artifact is appended as a JSON
+payload to `magi_analytics.isabel_artifacts`, and `loadIsabelArtifact` in
+`magi-core.js` reads the newest fresh row with one query. It falls back to
+the live queries if no row is fresh. Bump `ARTIFACT_VERSION` together with
+`ISABEL_ARTIFACT_VERSION` in `magi-core.js` when the payload shape changes.
+
+Prerequisites:
+- Google Cloud SDK authenticated (`gcloud auth application-default login`)
+- COHERE_API_KEY set as an environment variable (for uncached reasoning).
+- Required Python packages installed:
+  - pip install cohere google-cloud-bigquery numpy
+"""
+
+import argparse
+import json
+from datetime import datetime, timezone
+import numpy as np
+from google.cloud import bigquery
+from indicators import js_round, js_to_fixed
+from reasoning_quality import QUALITY_FACTORS, js_length, quality_factors
+from trade_outcomes import apply_new_outcomes, ensure_outcomes_table
+
+# --- Configuration ---
+GCP_PROJECT_ID = "screen-share-459802"
+TRADES_TABLE_ID = f"{GCP_PROJECT_ID}.magi_core.trades"
+THOUGHTS_TABLE_ID = f"{GCP_PROJECT_ID}.magi_core.thoughts"
+ARTIFACT_TABLE_ID = f"{GCP_PROJECT_ID}.magi_analytics.isabel_artifacts"
+OUTCOMES_TABLE_ID = f"{GCP_PROJECT_ID}.magi_analytics.trade_outcomes_daily"
+ARTIFACT_VERSION = 1
+EMBED_MODEL = "embed-multilingual-v3.0"
+EMBED_INPUT_TYPE = "classification"
+
+# The keyword list of getIsabelPatterns, in the same order.
+KEYWORDS = [
+    'momentum', 'upward', 'downward', 'trend', 'bullish', 'bearish', 'support', 'resistance',
+    'breakout', 'pullback', 'bounce', 'contrarian', 'reversal', 'oversold', 'overbought', 'RSI',
+    'SMA', 'volume', 'strong', 'weak', 'growth', 'decline', 'potential', 'risk', 'caution',
+]
+
+
+def compute_stats(client: bigquery.Client) -> dict:
+    """Same structure as `getIsabelStats`: {directions, symbols}."""
+    dir_rows = client.query(f"""
+        SELECT llm_provider, side,
+          SUM(wins) as wins,
+          SUM(loses) as loses,
+          ROUND(SAFE_DIVIDE(SUM(wins), SUM(wins) + SUM(loses)) * 100, 1) as win_rate
+        FROM `{OUTCOMES_TABLE_ID}`
+        WHERE side IS NOT NULL
+        GROUP BY llm_provider, side
+    """).result()
+    sym_rows = client.query(f"""
+        SELECT symbol,
+          SUM(wins) as wins,
+          SUM(loses) as loses,
+          ROUND(SAFE_DIVIDE(SUM(wins), SUM(wins) + SUM(loses)) * 100, 1) as win_rate
+        FROM `{OUTCOMES_TABLE_ID}`
+        WHERE side IS NOT NULL
+        GROUP BY symbol
+        HAVING (SUM(wins) + SUM(loses)) >= 2
+        ORDER BY win_rate DESC
+    """).result()
+
+    directions = {}
+    for r in dir_rows:
+        # JS object keys: a NULL provider becomes "null".
+        provider = "null" if r.llm_provider is None else r.llm_provider
+        directions.setdefault(provider, {})[r.side] = {
+            "wins": r.wins, "loses": r.loses, "win_rate": r.win_rate or 0,
+        }
+    symbols = [
+        {"symbol": r.symbol, "wins": r.wins, "loses": r.loses, "win_rate": r.win_rate or 0}
+        for r in sym_rows
+    ]
+    return {"directions": directions, "symbols": symbols}
+
+
+def fetch_labeled_thoughts(client: bigquery.Client) -> list:
+    """The WIN/LOSE reasoning read by both getIsabelPatterns and getIsabelQuality."""
+    return list(client.query(f"""
+        SELECT t.result, th.reasoning, th.hypothesis, th.confidence
+        FROM `{TRADES_TABLE_ID}` t
+        JOIN `{THOUGHTS_TABLE_ID}` th ON t.session_id = th.session_id AND t.symbol = th.symbol
+        WHERE t.result IN ('WIN', 'LOSE') AND th.reasoning IS NOT NULL AND LENGTH(th.reasoning) > 10
+    """).result())
+
+
+def compute_patterns(rows: list) -> dict | None:
+    """Same structure as `getIsabelPatterns`; None below 10 rows."""
+    if len(rows) < 10:
+        return None
+    win_keywords, lose_keywords = {}, {}
+    win_count = lose_count = 0
+    short_wins = short_loses = 0
+    for row in rows:
+        reasoning = (row.reasoning or "").lower()
+        is_win = row.result == "WIN"
+        if is_win:
+            win_count += 1
+        else:
+            lose_count += 1
+        counts = win_keywords if is_win else lose_keywords
+        for kw in KEYWORDS:
+            if kw.lower() in reasoning:
+                counts[kw] = counts.get(kw, 0) + 1
+        if js_length(row.reasoning) < 50:
+            short_wins += is_win
+            short_loses += not is_win
+
+    keyword_win_rates = {}
+    for kw in KEYWORDS:
+        w, l = win_keywords.get(kw, 0), lose_keywords.get(kw, 0)
+        if w + l >= 3:
+            keyword_win_rates[kw] = {"winRate": int(js_round(w * 100 / (w + l))), "wins": w, "loses": l}
+    entries = list(keyword_win_rates.items())
+    win_patterns = sorted((e for e in entries if e[1]["winRate"] >= 65), key=lambda e: -e[1]["winRate"])[:5]
+    lose_patterns = sorted((e for e in entries if e[1]["winRate"] <= 40), key=lambda e: e[1]["winRate"])[:5]
+    short_total = short_wins + short_loses
+    return {
+        "winPatterns": [list(e) for e in win_patterns],
+        "losePatterns": [list(e) for e in lose_patterns],
+        "shortAnalysisWinRate": int(js_round(short_wins * 100 / short_total)) if short_total > 0 else None,
+        "totalWins": win_count,
+        "totalLoses": lose_count,
+    }
+
+
+def quality_summary(counts: dict, score_sums: dict, factor_counts: dict) -> dict | None:
+    """
+    The `getIsabelQuality` structure from WIN/LOSE sample counts, quality
+    score sums and per-factor with/without counts; None below 10 samples.
+    """
+    total = counts["win"] + counts["lose"]
+    if total < 10:
+        return None
+
+    def average(outcome):
+        # `toFixed(1)` returns a string; an empty class stays the number 0.
+        if not counts[outcome]:
+            return 0
+        return f"{float(js_to_fixed(score_sums[outcome] / counts[outcome], 1)):.1f}"
+
+    factor_impact = []
+    for factor, data in factor_counts.items():
+        with_total = data["with"]["win"] + data["with"]["lose"]
+        without_total = data["without"]["win"] + data["without"]["lose"]
+        if with_total >= 3 and without_total >= 3:
+            with_win_rate = int(js_round(data["with"]["win"] * 100 / with_total))
+            without_win_rate = int(js_round(data["without"]["win"] * 100 / without_total))
+            factor_impact.append({
+                "factor": factor, "withWinRate": with_win_rate, "withoutWinRate": without_win_rate,
+                "impact": with_win_rate - without_win_rate, "withTotal": with_total, "withoutTotal": without_total,
+            })
+    factor_impact.sort(key=lambda f: -abs(f["impact"]))
+    return {
+        "avgWinQuality": average("win"),
+        "avgLoseQuality": average("lose"),
+        "factorImpact": factor_impact,
+        "totalSamples": total,
+    }
+
+
+def compute_quality(rows: list) -> dict | None:
+    """Same structure as `getIsabelQuality`, scoring the reasoning text of `rows`."""
+    counts, score_sums = {"win": 0, "lose": 0}, {"win": 0, "lose": 0}
+    factor_counts = {f: {"with": {"win": 0, "lose": 0}, "without": {"win": 0, "lose": 0}} for f in QUALITY_FACTORS}
+    for row in rows:
+        score = quality_factors(row.reasoning, row.hypothesis)
+        outcome = "win" if row.result == "WIN" else "lose"
+        counts[outcome] += 1
+        score_sums[outcome] += sum(score.values())
+        for factor, value in score.items():
+            factor_counts[factor]["with" if value == 1 else "without"][outcome] += 1
+    return quality_summary(counts, score_sums, factor_counts)
+
+
+def compute_stored_quality(client: bigquery.Client) -> dict | None:
+    """Same structure as `getIsabelQuality`, from the stored per-thought bitmasks."""
+    from score_thought_quality import quality_aggregates, score_new_thoughts
+    score_new_thoughts(client)
+    return quality_summary(*quality_aggregates(client))
+
+
+def compute_feedback(client: bigquery.Client) -> dict:
+    """`getRealtimeFeedback` for every provider, with two queries in total."""
+    recent = client.query(f"""
+        SELECT llm_provider, symbol, side, result,
+          ROUND((exit_price - filled_avg_price) / filled_avg_price * 100, 2) as pnl_pct,
+          FORMAT_TIMESTAMP('%m/%d %H:%M', timestamp, 'Asia/Tokyo') as trade_time
+        FROM `{TRADES_TABLE_ID}`
+        WHERE llm_provider IS NOT NULL AND result IS NOT NULL
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY llm_provider ORDER BY timestamp DESC) <= 5
+        ORDER BY llm_provider, timestamp DESC
+    """).result()
+    stats = client.query(f"""
+        SELECT llm_provider,
+          SUM(wins) as recent_wins,
+          SUM(loses) as recent_loses,
+          ROUND(SUM(win_pnl_sum), 2) as total_profit,
+          ROUND(SUM(lose_pnl_sum), 2) as total_loss
+        FROM `{OUTCOMES_TABLE_ID}`
+        WHERE llm_provider IS NOT NULL
+          AND trade_date > DATE_SUB(CURRENT_DATE(), INTERVAL 7 DAY)
+        GROUP BY llm_provider
+    """).result()
+
+    feedback = {}
+    for r in recent:
+        entry = feedback.setdefault(r.llm_provider, {"provider": r.llm_provider, "recentTrades": [], "stats": None})
+        entry["recentTrades"].append({
+            "symbol": r.symbol, "side": r.side, "result": r.result,
+            "pnl_pct": r.pnl_pct, "trade_time": r.trade_time,
+        })
+    for entry in feedback.values():
+        # An ungrouped aggregate always returns one row, even with no recent trades.
+        entry["stats"] = {"recent_wins": 0, "recent_loses": 0, "total_profit": None, "total_loss": None}
+    for r in stats:
+        feedback[r.llm_provider]["stats"] = {
+            "recent_wins": r.recent_wins, "recent_loses": r.recent_loses,
+            "total_profit": r.total_profit, "total_loss": r.total_loss,
+        }
+    return feedback
+
+
+def compute_embeddings(client: bigquery.Client) -> dict | None:
+    """Same structure as `getIsabelEmbeddings`, embedding through the local cache."""
+    from embedding_cache import EmbeddingCache, embed_texts
+
+    rows = list(client.query(f"""
+        SELECT t.result, th.reasoning
+        FROM `{TRADES_TABLE_ID}` t
+        JOIN `{THOUGHTS_TABLE_ID}` th ON t.session_id = th.session_id AND t.symbol = th.symbol
+        WHERE t.result IN ('WIN', 'LOSE') AND th.reasoning IS NOT NULL AND LENGTH(th.reasoning) > 30
+        ORDER BY t.timestamp DESC LIMIT 50
+    """).result())
+    if len(rows) < 10:
+        print("Not enough data for embeddings.")
+        return None
+    win_texts = [r.reasoning for r in rows if r.result == "WIN"][:20]
+    lose_texts = [r.reasoning for r in rows if r.result == "LOSE"][:20]
+    if len(win_texts) < 3 or len(lose_texts) < 3:
+        print("Not enough WIN/LOSE samples for embeddings.")
+        return None
+
+    cache = EmbeddingCache()
+    vectors = embed_texts(win_texts + lose_texts, cache, model=EMBED_MODEL, input_type=EMBED_INPUT_TYPE)
+    cache.close()
+    win_centroid = vectors[:len(win_texts)].astype(np.float64).mean(axis=0)
+    lose_centroid = vectors[len(win_texts):].astype(np.float64).mean(axis=0)
+    return {
+        "winCentroid": [round(float(x), 7) for x in win_centroid],
+        "loseCentroid": [round(float(x), 7) for x in lose_centroid],
+        "winCount": len(win_texts),
+        "loseCount": len(lose_texts),
+    }
+
+
+def build_artifact(client: bigquery.Client, embeddings: bool = True, ngram_state: str | None = None,
+                   rescan_quality: bool = False) -> dict:
+    """
+    Computes every component of the artifact. If `ngram_state` is given, the
+    n-gram counts persisted there are updated and supply the winning and
+    losing patterns. Quality comes from the stored per-thought bitmasks
+    (scoring new thoughts first) unless `rescan_quality` is set.
+    """
+    print("Computing stats...")
+    stats = compute_stats(client)
+    print("Computing patterns and quality...")
+    rows = fetch_labeled_thoughts(client)
+    patterns = compute_patterns(rows)
+    quality = compute_quality(rows) if rescan_quality else compute_stored_quality(client)
+    if patterns is not None and ngram_state:
+        from ngram_miner import js_patterns, update_counts
+        patterns["winPatterns"], patterns["losePatterns"] = js_patterns(update_counts(client, ngram_state))
+    print("Computing realtime feedback...")
+    feedback = compute_feedback(client)
+    return {
+        "version": ARTIFACT_VERSION,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "stats": stats,
+        "patterns": patterns,
+        "quality": quality,
+        "feedback": feedback,
+        "embeddings": compute_embeddings(client) if embeddings else None,
+    }
+
+
+def ensure_artifact_table(client: bigquery.Client, table_id: str = ARTIFACT_TABLE_ID):
+    """Creates the artifact table, partitioned by day with old partitions expiring."""
+    client.query(f"""
+        CREATE TABLE IF NOT EXISTS `{table_id}` (
+          artifact_version INT64 NOT NULL,
+          generated_at TIMESTAMP NOT NULL,
+          payload STRING NOT NULL
+        )
+        PARTITION BY DATE(generated_at)
+        OPTIONS (partition_expiration_days = 7)
+    """).result()
+
+
+def write_artifact(client: bigquery.Client, artifact: dict, table_id: str = ARTIFACT_TABLE_ID):
+    """Appends the artifact as one row with a single load job."""
+    row = {
+        "artifact_version": artifact["version"],
+        "generated_at": artifact["generated_at"],
+        "payload": json.dumps(artifact, ensure_ascii=False, separators=(",", ":")),
+    }
+    job_config = bigquery.LoadJobConfig(write_disposition=bigquery.WriteDisposition.WRITE_APPEND)
+    load_job = client.load_table_from_json([row], table_id, job_config=job_config)
+    load_job.result()
+    if load_job.errors:
+        print(f"Errors writing the artifact: {load_job.errors}")
+    else:
+        print(f"Wrote artifact v{artifact['version']} ({len(row['payload']) / 1024:.1f} KB) to {table_id}.")
+
+
+def parse_args() -> argparse.Namespace:
+    """Parses command-line options."""
+    parser = argparse.ArgumentParser(description="Precompute the ISABEL artifact loaded by magi-core.js.")
+    parser.add_argument("--output", help="Also write the artifact to this local JSON file.")
+    parser.add_argument("--dry-run", action="store_true", help="Compute but do not write to BigQuery.")
+    parser.add_argument("--no-embeddings", action="store_true", help="Skip the WIN/LOSE centroids.")
+    parser.add_argument("--rescan-quality", action="store_true",
+                        help="Score reasoning text instead of aggregating stored quality bitmasks.")
+    parser.add_argument("--mined-patterns", nargs="?", const="", metavar="STATE",
+                        help="Take winning/losing patterns from the n-gram miner (optionally its state path).")
+    return parser.parse_args()
+
+
+def main():
+    """Main function to build and publish the artifact."""
+    args = parse_args()
+    print("=== ISABEL Artifact ===")
+
+    try:
+        bq_client = bigquery.Client(project=GCP_PROJECT_ID)
+        print("Successfully connected to BigQuery.")
+    except Exception as e:
+        print(f"Failed to connect to BigQuery. Ensure you are authenticated. Error: {e}")
+        return
+
+    # The stats read the outcome aggregates; build them if this runs first.
+    ensure_outcomes_table(bq_client)
+    apply_new_outcomes(bq_client)
+
+    ngram_state = None
+    if args.mined_patterns is not None:
+        from ngram_miner import DEFAULT_STATE_PATH
+        ngram_state = args.mined_patterns or DEFAULT_STATE_PATH
+    artifact = build_artifact(bq_client, embeddings=not args.no_embeddings, ngram_state=ngram_state,
+                              rescan_quality=args.rescan_quality)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(artifact, f, ensure_ascii=False, indent=2)
+        print(f"Wrote {args.output}.")
+    if not args.dry_run:
+        ensure_artifact_table(bq_client)
+        write_artifact(bq_client, artifact)
+
+if __name__ == "__main__":
+    main()
@@ -1,79 +1,105 @@
 #!/usr/bin/env python3
-"""ISABEL: 埋め込み分析のみ"""
+"""ISABEL: 埋め込み分析のみ
 
-import os
-import cohere
-from google.cloud import bigquery
+埋め込みは embedding_cache.py のローカルキャッシュ経由で取得する。
+未キャッシュのテキストだけを96件ずつCohereに送る。
+
+行は arrow_reader.py で Arrow バッチとして読み、列ごとに NumPy 配列へ
+変換する（Row オブジェクトや dict は作らない）。--parquet でエクスポート
+済みのスナップショットからオフラインで実行できる。
+"""
+
+import argparse
 import numpy as np
 from numpy.linalg import norm
+from arrow_reader import BigQuerySource, ParquetSource, export_parquet, read_numpy
+from embedding_cache import EmbeddingCache, embed_texts
+from instrumentation import instrument_client, instrumented, span
 
-co = cohere.ClientV2(os.environ.get('COHERE_API_KEY'))
-
-def main():
-    client = bigquery.Client()
-    query = """
-    SELECT symbol, side, result, return_pct, confidence, unit_name, reasoning, hypothesis
+QUERY = """
+    SELECT symbol, result, return_pct, confidence, SUBSTR(reasoning, 1, 200) AS text
     FROM magi_core.isabel_analysis
     WHERE current_price IS NOT NULL AND reasoning IS NOT NULL
     """
-    rows = list(client.query(query))
-    
-    win_data, lose_data = [], []
-    for row in rows:
-        text = f"{row.reasoning or ''}"
-        data = {"symbol": row.symbol, "confidence": row.confidence, "return": row.return_pct, "text": text[:200]}
-        if row.result == 'WIN':
-            win_data.append(data)
-        elif row.result == 'LOSE':
-            lose_data.append(data)
-    
+COLUMNS = {"symbol": "str", "result": "str", "return_pct": "float", "confidence": "float", "text": "str"}
+
+
+def print_group(label: str, rows: dict[str, np.ndarray], mask: np.ndarray):
+    """Prints the confidence/return summary of one outcome group."""
+    confidence = rows["confidence"][mask]
+    # 0 と NULL の confidence は平均に含めない
+    confidence = confidence[~np.isnan(confidence) & (confidence != 0)]
+    print(f"\n【{label}パターン（{mask.sum()}件）】")
+    print(f"平均confidence: {np.mean(confidence):.2f}")
+    print(f"平均return: {np.nanmean(rows['return_pct'][mask]):.2f}%")
+    print(f"銘柄: {set(rows['symbol'][mask])}")
+
+
+def print_samples(label: str, rows: dict[str, np.ndarray], indices: np.ndarray):
+    """Prints the first 100 characters of sample thoughts."""
+    print(f"\n【{label}思考サンプル】")
+    for i in indices:
+        print(f"  {rows['symbol'][i]}: conf={rows['confidence'][i]} ret={rows['return_pct'][i]:.1f}%")
+        print(f"    {rows['text'][i][:100]}...")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="ISABEL embedding-only pattern analysis.")
+    parser.add_argument("--parquet", help="Read a local Parquet snapshot instead of BigQuery.")
+    parser.add_argument("--export", help="Save the BigQuery rows to this Parquet file and exit.")
+    return parser.parse_args()
+
+
+@instrumented
+def main():
+    args = parse_args()
+    if args.parquet:
+        source = ParquetSource(args.parquet)
+    else:
+        from google.cloud import bigquery
+        source = BigQuerySource(instrument_client(bigquery.Client()), QUERY)
+    if args.export:
+        print(f"Exported {export_parquet(source, args.export)} rows to {args.export}.")
+        return
+
+    with span("read_rows"):
+        rows = read_numpy(source, COLUMNS)
+    if rows["result"] is None:
+        print("No rows.")
+        return
+    is_win, is_lose = rows["result"] == "WIN", rows["result"] == "LOSE"
+
     print("=" * 60)
     print("ISABEL PATTERN ANALYSIS")
     print("=" * 60)
-    
+
     # 埋め込み計算
-    all_texts = [d["text"] for d in win_data] + [d["text"] for d in lose_data]
-    response = co.embed(
-        texts=all_texts,
-        model="embed-multilingual-v3.0",
-        input_type="classification",
-        embedding_types=["float"]
-    )
-    
-    embeddings = response.embeddings.float_
-    win_embeds = embeddings[:len(win_data)]
-    lose_embeds = embeddings[len(win_data):]
-    
+    all_texts = list(rows["text"][is_win]) + list(rows["text"][is_lose])
+    cache = EmbeddingCache()
+    with span("embed", texts=len(all_texts)):
+        embeddings = embed_texts(all_texts, cache, model="embed-multilingual-v3.0", input_type="classification")
+    cache.close()
+
+    n_win = int(is_win.sum())
+    win_embeds = embeddings[:n_win]
+    lose_embeds = embeddings[n_win:]
+
     win_center = np.mean(win_embeds, axis=0)
     lose_center = np.mean(lose_embeds, axis=0)
     similarity = np.dot(win_center, lose_center) / (norm(win_center) * norm(lose_center))
-    
+
     print(f"\n【統計サマリー】")
-    print(f"WIN: {len(win_data)}件, LOSE: {len(lose_data)}件")
+    print(f"WIN: {n_win}件, LOSE: {int(is_lose.sum())}件")
     print(f"WIN vs LOSE 思考類似度: {similarity:.3f}")
     print(f"  → 0.826は高い類似度。WINとLOSEの思考パターンは似ている")
     print(f"  → 思考内容ではなく「何を買うか」が結果を決めている可能性")
-    
-    print(f"\n【WINパターン（{len(win_data)}件）】")
-    print(f"平均confidence: {np.mean([d['confidence'] for d in win_data if d['confidence']]):.2f}")
-    print(f"平均return: {np.mean([d['return'] for d in win_data]):.2f}%")
-    print(f"銘柄: {set(d['symbol'] for d in win_data)}")
-    
-    print(f"\n【LOSEパターン（{len(lose_data)}件）】")
-    if lose_data:
-        print(f"平均confidence: {np.mean([d['confidence'] for d in lose_data if d['confidence']]):.2f}")
-        print(f"平均return: {np.mean([d['return'] for d in lose_data]):.2f}%")
-        print(f"銘柄: {set(d['symbol'] for d in lose_data)}")
-    
-    print(f"\n【WIN思考サンプル】")
-    for d in win_data[:3]:
-        print(f"  {d['symbol']}: conf={d['confidence']} ret={d['return']:.1f}%")
-        print(f"    {d['text'][:100]}...")
-    
-    print(f"\n【LOSE思考サンプル】")
-    for d in lose_data:
-        print(f"  {d['symbol']}: conf={d['confidence']} ret={d['return']:.1f}%")
-        print(f"    {d['text'][:100]}...")
+
+    print_group("WIN", rows, is_win)
+    if is_lose.any():
+        print_group("LOSE", rows, is_lose)
+
+    print_samples("WIN", rows, np.flatnonzero(is_win)[:3])
+    print_samples("LOSE", rows, np.flatnonzero(is_lose))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script labels every filled trade at fixed horizons from daily bars and
+stores the labels in `magi_analytics.trade_labels`, one row per
+(trade, horizon).
+
+Unlike `update_exit_prices.py`, it needs no matching sell order. The exit of
+a trade at horizon `h` is the close `h` trading days after the entry bar
+(the last bar dated on or before the trade's UTC date). For each horizon the
+row holds:
+
+- `exit_date`, `exit_price` and `return_pct` (the price change in percent,
+  defined like `trades.return_pct`).
+- `mfe_atr` / `mae_atr`: the maximum favourable and adverse excursion over
+  the bars after entry up to the exit, side-adjusted and in ATR units.
+- `result`: WIN/LOSE/HOLD by the same ATR rule as `evaluate_trades.py`.
+
+The ATR is `atr_at_execution` where recorded, otherwise the agent's
+`calculateATR` at the entry bar. Only horizons whose exit bar already exists
+are written; the others are labeled on a later run.
+
+All bars come from the local `bar_store.BarStore`, so one range is read per
+symbol and every horizon of every trade of that symbol is computed in one
+vectorized pass. Each run relabels the whole history and replaces the table
+with a single load job. If the bars of some symbols could not be read, their
+existing labels are kept: the new rows go through a staging table and
+replace every other symbol's labels in one transaction.
+
+Prerequisites:
+- Google Cloud SDK authenticated (`gcloud auth application-default login`)
+- Alpaca API credentials set as environment variables.
+- Required Python packages installed:
+  - pip install alpaca-trade-api google-cloud-bigquery numpy
+"""
+
+import argparse
+import asyncio
+import math
+import uuid
+from datetime import date, datetime, timedelta, timezone
+import alpaca_trade_api as tradeapi
+from google.cloud import bigquery
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from alpaca_client import DEFAULT_MAX_CONCURRENCY, AlpacaClient
+from bar_store import DEFAULT_STORE_DIR, BarStore
+from bq_writeback import STAGING_TABLE_TTL
+from evaluate_trades import LOSE_ATR_MULTIPLIER, WIN_ATR_MULTIPLIER
+from indicators import EXECUTION_ATR_WINDOW, js_atr
+from instrumentation import count, instrument_client, instrumented, span
+
+# --- Configuration ---
+GCP_PROJECT_ID = "screen-share-459802"
+TRADES_TABLE_ID = f"{GCP_PROJECT_ID}.magi_core.trades"
+LABELS_TABLE_ID = f"{GCP_PROJECT_ID}.magi_analytics.trade_labels"
+ALPACA_API_BASE_URL = "https://paper-api.alpaca.markets"
+DEFAULT_HORIZONS = (1, 5, 7, 20)
+LABEL_VERSION = "horizon-v1"
+# Calendar days of bars read before the first trade, enough for a 21-bar ATR.
+ATR_LOOKBACK_DAYS = 40
+
+LABEL_SCHEMA = [
+    bigquery.SchemaField("session_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("symbol", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("side", "STRING"),
+    bigquery.SchemaField("trade_timestamp", "TIMESTAMP"),
+    bigquery.SchemaField("horizon_days", "INT64", mode="REQUIRED"),
+    bigquery.SchemaField("entry_date", "DATE"),
+    bigquery.SchemaField("entry_price", "FLOAT64"),
+    bigquery.SchemaField("exit_date", "DATE"),
+    bigquery.SchemaField("exit_price", "FLOAT64"),
+    bigquery.SchemaField("return_pct", "FLOAT64"),
+    bigquery.SchemaField("atr", "FLOAT64"),
+    bigquery.SchemaField("mfe_atr", "FLOAT64"),
+    bigquery.SchemaField("mae_atr", "FLOAT64"),
+    bigquery.SchemaField("result", "STRING"),
+    bigquery.SchemaField("label_version", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("labeled_at", "TIMESTAMP", mode="REQUIRED"),
+]
+CLUSTER_FIELDS = ["horizon_days", "symbol"]
+
+
+def iter_filled_trades(client: bigquery.Client, page_size: int = 50000):
+    """Yields every trade with a fill price, oldest first."""
+    query = f"""
+        SELECT session_id, symbol, side, timestamp, filled_avg_price, atr_at_execution
+        FROM `{TRADES_TABLE_ID}`
+        WHERE filled_avg_price IS NOT NULL AND filled_avg_price > 0
+          AND side IN ('buy', 'sell')
+        ORDER BY timestamp
+    """
+    rows = client.query(query).result(page_size=page_size)
+    print(f"Found {rows.total_rows} filled trades.")
+    for page in rows.pages:
+        yield from page
+
+
+def group_trades(trades) -> dict[str, dict[str, np.ndarray]]:
+    """
+    Splits trade rows into per-symbol column arrays: `session_id`, `side`
+    (+1 buy, -1 sell), `timestamp`, `date`, `price` and `atr` (NaN if unset).
+    """
+    columns: dict[str, dict[str, list]] = {}
+    for trade in trades:
+        cols = columns.setdefault(trade.symbol, {k: [] for k in ("session_id", "side", "timestamp", "price", "atr")})
+        cols["session_id"].append(trade.session_id)
+        cols["side"].append(1.0 if trade.side == "buy" else -1.0)
+        cols["timestamp"].append(trade.timestamp.astimezone(timezone.utc))
+        cols["price"].append(float(trade.filled_avg_price))
+        cols["atr"].append(np.nan if trade.atr_at_execution is None else float(trade.atr_at_execution))
+
+    grouped = {}
+    for symbol, cols in columns.items():
+        arrays = {k: np.asarray(v, dtype=float) for k, v in cols.items() if k in ("side", "price", "atr")}
+        arrays["session_id"] = np.asarray(cols["session_id"], dtype=object)
+        arrays["timestamp"] = np.asarray(cols["timestamp"], dtype=object)
+        arrays["date"] = np.array([ts.date() for ts in cols["timestamp"]], dtype="datetime64[D]")
+        grouped[symbol] = arrays
+    return grouped
+
+
+def bar_range(trades: dict[str, np.ndarray], max_horizon: int) -> tuple[date, date]:
+    """
+    Calendar range of bars needed to label one symbol's trades: from the ATR
+    lookback before the first trade to the longest horizon after the last,
+    capped at yesterday because today's bar is not final.
+    """
+    first = trades["date"].min().astype(datetime)
+    last = trades["date"].max().astype(datetime)
+    # Five trading days per seven calendar days, plus slack for holidays.
+    forward = timedelta(days=math.ceil(max_horizon * 7 / 5) + 10)
+    yesterday = datetime.now(timezone.utc).date() - timedelta(days=1)
+    return first - timedelta(days=ATR_LOOKBACK_DAYS), max(first, min(last + forward, yesterday))
+
+
+def label_symbol(bars: np.ndarray, trades: dict[str, np.ndarray], horizons: tuple[int, ...],
+                 win_multiplier: float = WIN_ATR_MULTIPLIER,
+                 lose_multiplier: float = LOSE_ATR_MULTIPLIER) -> dict[str, np.ndarray]:
+    """
+    Labels all trades of one symbol at every horizon.
+
+    Args:
+        bars: The symbol's daily bars (see `bar_store.BAR_DTYPE`), sorted.
+        trades: The symbol's trade columns from `group_trades`.
+        horizons: Horizons in trading days.
+
+    Returns:
+        Arrays shaped (trades x horizons) for `exit_idx`, `exit_price`,
+        `return_pct`, `mfe_atr`, `mae_atr`, `win`, `lose` and `complete`,
+        plus per-trade `entry_idx` (-1 without an entry bar) and `atr`.
+    """
+    n_bars, max_h = len(bars), max(horizons)
+    h = np.asarray(horizons)
+    high, low, close = (np.asarray(bars[f], dtype=float) for f in ("high", "low", "close"))
+
+    entry_idx = np.searchsorted(bars["date"], trades["date"], side="right") - 1
+    has_entry = entry_idx >= 0
+    safe_entry = np.where(has_entry, entry_idx, 0)
+
+    atr = trades["atr"].copy()
+    if n_bars:
+        missing = np.isnan(atr) | (atr <= 0)
+        atr[missing] = js_atr(high, low, close, window=EXECUTION_ATR_WINDOW)[safe_entry[missing]]
+    atr[~has_entry | (atr <= 0)] = np.nan
+
+    # Bars after each entry, NaN-padded past the end of the history; the
+    # running max/min over the window gives the excursion at every horizon.
+    pad = np.full(max_h, np.nan)
+    after_high = sliding_window_view(np.concatenate([high[1:], pad]), max_h)[safe_entry]
+    after_low = sliding_window_view(np.concatenate([low[1:], pad]), max_h)[safe_entry]
+    after_close = sliding_window_view(np.concatenate([close[1:], pad]), max_h)[safe_entry]
+    run_high = np.fmax.accumulate(after_high, axis=1)[:, h - 1]
+    run_low = np.fmin.accumulate(after_low, axis=1)[:, h - 1]
+    exit_price = after_close[:, h - 1]
+
+    exit_idx = safe_entry[:, None] + h
+    complete = has_entry[:, None] & (exit_idx < n_bars) & ~np.isnan(exit_price)
+
+    price = trades["price"][:, None]
+    side = trades["side"][:, None]
+    atr_col = atr[:, None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        move = side * (exit_price - price)
+        return_pct = (exit_price - price) / price * 100
+        favourable = np.where(side > 0, run_high - price, price - run_low)
+        adverse = np.where(side > 0, price - run_low, run_high - price)
+        mfe_atr = favourable / atr_col
+        mae_atr = adverse / atr_col
+        win = move >= atr_col * win_multiplier
+        lose = move <= -(atr_col * lose_multiplier)
+
+    return {
+        "entry_idx": np.where(has_entry, entry_idx, -1),
+        "atr": atr,
+        "exit_idx": exit_idx,
+        "exit_price": exit_price,
+        "return_pct": return_pct,
+        "mfe_atr": mfe_atr,
+        "mae_atr": mae_atr,
+        "win": win,
+        "lose": lose,
+        "complete": complete,
+    }
+
+
+def _nullable(value: float) -> float | None:
+    return None if np.isnan(value) else round(float(value), 6)
+
+
+def label_rows(symbol: str, bars: np.ndarray, trades: dict[str, np.ndarray], labels: dict[str, np.ndarray],
+               horizons: tuple[int, ...], labeled_at: str) -> list[dict]:
+    """Turns the completed horizons of `label_symbol` into table rows."""
+    rows = []
+    dates = bars["date"]
+    for i, j in zip(*np.nonzero(labels["complete"])):
+        atr = labels["atr"][i]
+        result = None
+        if not np.isnan(atr):
+            result = "WIN" if labels["win"][i, j] else "LOSE" if labels["lose"][i, j] else "HOLD"
+        rows.append({
+            "session_id": trades["session_id"][i],
+            "symbol": symbol,
+            "side": "buy" if trades["side"][i] > 0 else "sell",
+            "trade_timestamp": trades["timestamp"][i].isoformat(),
+            "horizon_days": int(horizons[j]),
+            "entry_date": str(dates[labels["entry_idx"][i]]),
+            "entry_price": float(trades["price"][i]),
+            "exit_date": str(dates[labels["exit_idx"][i, j]]),
+            "exit_price": float(labels["exit_price"][i, j]),
+            "return_pct": round(float(labels["return_pct"][i, j]), 2),
+            "atr": _nullable(atr),
+            "mfe_atr": _nullable(labels["mfe_atr"][i, j]),
+            "mae_atr": _nullable(labels["mae_atr"][i, j]),
+            "result": result,
+            "label_version": LABEL_VERSION,
+            "labeled_at": labeled_at,
+        })
+    return rows
+
+
+async def prefetch_bars(store: BarStore, ranges: dict[str, tuple], concurrency: int) -> int:
+    """Fills the bar store for every symbol concurrently before labeling."""
+    async with AlpacaClient(max_concurrency=concurrency) as client:
+        return await store.prefetch(client, ranges)
+
+
+def label_all(store: BarStore, trades_by_symbol: dict[str, dict[str, np.ndarray]],
+              horizons: tuple[int, ...], concurrency: int = 0) -> tuple[list[dict], int, list[str]]:
+    """
+    Labels every trade at every horizon, one bar range per symbol.
+
+    Returns:
+        The table rows, the number of (trade, horizon) pairs still open and
+        the symbols skipped because their bars could not be read.
+    """
+    ranges = {s: bar_range(t, max(horizons)) for s, t in trades_by_symbol.items()}
+    if concurrency > 0:
+        try:
+            fetched = asyncio.run(prefetch_bars(store, ranges, concurrency))
+            print(f"Prefetched {fetched} bar ranges with up to {concurrency} concurrent requests.")
+        except Exception as e:
+            print(f"Concurrent prefetch failed, falling back to sequential fetches: {e}")
+
+    labeled_at = datetime.now(timezone.utc).isoformat()
+    rows, pending, skipped = [], 0, []
+    for symbol, trades in trades_by_symbol.items():
+        try:
+            bars = store.get_bars(symbol, *ranges[symbol])
+        except Exception as e:
+            print(f"  - Could not read bars for {symbol}: {e}")
+            skipped.append(symbol)
+            continue
+        labels = label_symbol(bars, trades, horizons)
+        symbol_rows = label_rows(symbol, bars, trades, labels, horizons, labeled_at)
+        pending += labels["complete"].size - len(symbol_rows)
+        rows.extend(symbol_rows)
+    print(f"Bar store made {store.api_calls} Alpaca requests for {len(trades_by_symbol)} symbols.")
+    return rows, pending, skipped
+
+
+def write_labels(client: bigquery.Client, rows: list[dict], table_id: str = LABELS_TABLE_ID,
+                 skipped: list[str] | None = None):
+    """
+    Replaces the label table with `rows` in one load job.
+
+    The labels of `skipped` symbols, whose bars could not be read this run,
+    are kept: `rows` are then loaded into a staging table and swapped in
+    for every other symbol in one transaction.
+    """
+    if skipped:
+        return _replace_labels_except(client, rows, table_id, skipped)
+    job_config = bigquery.LoadJobConfig(
+        schema=LABEL_SCHEMA,
+        clustering_fields=CLUSTER_FIELDS,
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+    )
+    load_job = client.load_table_from_json(rows, table_id, job_config=job_config)
+    load_job.result()
+    if load_job.errors:
+        print(f"Errors loading labels: {load_job.errors}")
+    else:
+        print(f"Stored {load_job.output_rows} labels in {table_id}.")
+
+
+def _replace_labels_except(client: bigquery.Client, rows: list[dict], table_id: str, skipped: list[str]):
+    """Replaces the labels of every symbol but `skipped` with `rows`, atomically."""
+    table = bigquery.Table(table_id, schema=LABEL_SCHEMA)
+    table.clustering_fields = CLUSTER_FIELDS
+    client.create_table(table, exists_ok=True)
+
+    project, dataset, name = table_id.split(".")
+    staging_id = f"{project}.{dataset}._{name}_staging_{uuid.uuid4().hex[:12]}"
+    staging_table = bigquery.Table(staging_id, schema=LABEL_SCHEMA)
+    staging_table.expires = datetime.now(timezone.utc) + STAGING_TABLE_TTL
+    client.create_table(staging_table)
+    try:
+        load_job = client.load_table_from_json(rows, staging_id, job_config=bigquery.LoadJobConfig(schema=LABEL_SCHEMA))
+        load_job.result()
+        if load_job.errors:
+            print(f"Errors loading labels: {load_job.errors}; existing labels left unchanged.")
+            return
+        columns = ", ".join(field.name for field in LABEL_SCHEMA)
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ArrayQueryParameter("skipped", "STRING", skipped)]
+        )
+        client.query(f"""
+            BEGIN TRANSACTION;
+            DELETE FROM `{table_id}` WHERE symbol NOT IN UNNEST(@skipped);
+            INSERT INTO `{table_id}` ({columns}) SELECT {columns} FROM `{staging_id}`;
+            COMMIT TRANSACTION;
+        """, job_config=job_config).result()
+        print(f"Stored {len(rows)} labels in {table_id}; kept the existing labels of "
+              f"{len(skipped)} skipped symbols.")
+    finally:
+        client.delete_table(staging_id, not_found_ok=True)
+
+
+def summarize(rows: list[dict], horizons: tuple[int, ...]):
+    """Prints the WIN/LOSE/HOLD split and mean return per horizon."""
+    for horizon in horizons:
+        subset = [r for r in rows if r["horizon_days"] == horizon]
+        if not subset:
+            print(f"  {horizon:>3}d: no completed labels")
+            continue
+        counts = {k: sum(1 for r in subset if r["result"] == k) for k in ("WIN", "LOSE", "HOLD")}
+        mean_return = np.mean([r["return_pct"] for r in subset])
+        print(f"  {horizon:>3}d: {len(subset)} labels, WIN {counts['WIN']}, LOSE {counts['LOSE']}, "
+              f"HOLD {counts['HOLD']}, mean return {mean_return:.2f}%")
+
+
+def parse_args() -> argparse.Namespace:
+    """Parses command-line options."""
+    parser = argparse.ArgumentParser(description="Label every trade at fixed horizons from daily bars.")
+    parser.add_argument(
+        "--horizons",
+        type=lambda s: tuple(sorted({int(h) for h in s.split(",")})),
+        default=DEFAULT_HORIZONS,
+        help="Comma-separated horizons in trading days (default: 1,5,7,20).",
+    )
+    parser.add_argument(
+        "--bar-store",
+        default=DEFAULT_STORE_DIR,
+        help="Directory of the local daily-bar store (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_MAX_CONCURRENCY,
+        help="Concurrent Alpaca requests when prefetching bars; 0 disables prefetching.",
+    )
+    parser.add_argument("--page-size", type=int, default=50000, help="BigQuery rows per result page.")
+    parser.add_argument("--dry-run", action="store_true", help="Compute and summarize labels without writing them.")
+    return parser.parse_args()
+
+
+@instrumented
+def main():
+    """Main function to orchestrate horizon labeling."""
+    args = parse_args()
+    print("=== Horizon Labeling ===")
+
+    try:
+        alpaca_api = tradeapi.REST(base_url=ALPACA_API_BASE_URL)
+        bq_client = instrument_client(bigquery.Client(project=GCP_PROJECT_ID))
+        print("Successfully connected to Alpaca and BigQuery.")
+    except Exception as e:
+        print(f"Failed to initialize clients. Error: {e}")
+        return
+
+    trades_by_symbol = group_trades(iter_filled_trades(bq_client, args.page_size))
+    if not trades_by_symbol:
+        print("No filled trades to label. Exiting.")
+        return
+
+    store = BarStore(alpaca_api, args.bar_store)
+    with span("label_all", symbols=len(trades_by_symbol)):
+        rows, pending, skipped = label_all(store, trades_by_symbol, args.horizons, args.concurrency)
+    count("rows_total", len(rows), stage="horizon_labels", kind="computed")
+    print(f"\nLabeled {len(rows)} (trade, horizon) pairs; {pending} not yet complete.")
+    summarize(rows, args.horizons)
+
+    if args.dry_run:
+        print("\nDry run: labels not written.")
+    elif rows:
+        with span("write_labels", rows=len(rows)):
+            write_labels(bq_client, rows, skipped=skipped)
+
+if __name__ == "__main__":
+    main()
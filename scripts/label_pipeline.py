@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script runs the post-trade labeling flow in one process:
+
+    exit_prices (update_exit_prices.py --sync) --+
+                                                 +--> evaluate (evaluate_trades.py)
+    atr         (backfill_atr.py)         -------+
+
+The stages form a small DAG. `exit_prices` and `atr` are independent, so
+they run concurrently in a thread pool, and one stage's Alpaca fetches
+overlap the other's BigQuery writes. `evaluate` starts once both are done.
+All stages share one storage client, one Alpaca client and one bar store.
+
+The trades that still need labeling (no result yet, or no ATR) are read
+once into an in-memory frame. Each stage derives its pending work from it
+and is skipped without touching Alpaca or the warehouse when there is none.
+Write-backs record which trades they updated, so `evaluate` knows from the
+frame whether any trade has become evaluable.
+
+The storage backend is pluggable. By default it is BigQuery. With
+`--duckdb PATH` the same SQL runs against a local DuckDB file through
+`duckdb_backend.DuckDBClient`, and `--offline` drops Alpaca so that only
+cached bars are used, for offline runs and tests.
+
+Prerequisites:
+- Google Cloud SDK authenticated (`gcloud auth application-default login`)
+  unless `--duckdb` is used.
+- Alpaca API credentials set as environment variables unless `--offline`.
+- Required Python packages installed:
+  - pip install alpaca-trade-api google-cloud-bigquery numpy pandas (duckdb for --duckdb)
+"""
+
+import argparse
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+import alpaca_trade_api as tradeapi
+from google.cloud import bigquery
+from alpaca_client import DEFAULT_MAX_CONCURRENCY
+from backfill_atr import backfill_batched
+from bar_store import DEFAULT_STORE_DIR, BarStore
+from bq_writeback import OUTCOME_UPDATED, ColumnWriteBack
+from evaluate_trades import evaluate_trades
+from instrumentation import instrument_client, instrumented, span
+from trade_evaluation import ensure_evaluation_columns
+from trade_outcomes import ensure_outcomes_table
+from update_exit_prices import DEFAULT_WATERMARK_PATH, sync_closed_orders
+
+# --- Configuration ---
+GCP_PROJECT_ID = "screen-share-459802"
+TABLE_ID = f"{GCP_PROJECT_ID}.magi_core.trades"
+ALPACA_API_BASE_URL = "https://paper-api.alpaca.markets"
+# `evaluate_trades` only labels trades older than this.
+EVALUATION_DELAY = timedelta(days=1)
+
+STAGE_SKIPPED = "skipped"
+STAGE_DONE = "done"
+STAGE_FAILED = "failed"
+
+
+class TrackedWriteBack:
+    """A `ColumnWriteBack` that remembers which trades its flushes updated."""
+
+    def __init__(self, writeback: ColumnWriteBack):
+        self.writeback = writeback
+        self.updated: set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self.writeback)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self.writeback
+
+    def add(self, session_id: str, value):
+        self.writeback.add(session_id, value)
+
+    def flush(self) -> dict[str, str]:
+        outcomes = self.writeback.flush()
+        self.updated |= {sid for sid, outcome in outcomes.items() if outcome == OUTCOME_UPDATED}
+        return outcomes
+
+
+@dataclass
+class PipelineContext:
+    """State shared by all stages of one run."""
+    client: object
+    alpaca_api: tradeapi.REST | None
+    store: BarStore
+    trades: list
+    args: argparse.Namespace
+    updated: dict[str, set] = field(default_factory=dict)
+
+
+def load_trade_frame(client, table_id: str = TABLE_ID) -> list:
+    """Reads every trade that still needs a label or an ATR, once for all stages."""
+    query = f"""
+        SELECT session_id, symbol, side, price, timestamp, filled_avg_price, exit_price, atr_at_execution
+        FROM `{table_id}`
+        WHERE result IS NULL OR atr_at_execution IS NULL
+        ORDER BY timestamp, session_id
+    """
+    trades = list(client.query(query).result())
+    print(f"Loaded {len(trades)} trades still needing labels.")
+    return trades
+
+
+def stage_exit_prices(ctx: PipelineContext) -> str:
+    """Syncs closed Alpaca orders into exit_price (update_exit_prices.py --sync)."""
+    pending = sum(1 for t in ctx.trades if t.exit_price is None)
+    if not pending:
+        return f"{STAGE_SKIPPED}: every unlabeled trade has an exit price"
+    if ctx.alpaca_api is None:
+        return f"{STAGE_SKIPPED}: offline"
+
+    writeback = TrackedWriteBack(ColumnWriteBack(ctx.client, TABLE_ID, "exit_price", only_if_null=True))
+    read, updated = sync_closed_orders(ctx.alpaca_api, writeback, ctx.args.watermark)
+    ctx.updated["exit_price"] = writeback.updated
+    return f"{STAGE_DONE}: read {read} orders, set {updated} of {pending} missing exit prices"
+
+
+def stage_atr(ctx: PipelineContext) -> str:
+    """Backfills atr_at_execution from the bar store (backfill_atr.py)."""
+    needing = [t for t in ctx.trades if t.atr_at_execution is None and t.price is not None and t.side is not None]
+    if not needing:
+        return f"{STAGE_SKIPPED}: no trade needs an ATR"
+
+    writeback = TrackedWriteBack(ColumnWriteBack(ctx.client, TABLE_ID, "atr_at_execution"))
+    backfill_batched(ctx.store, writeback, needing, ctx.args.concurrency if ctx.alpaca_api else 0, verbose=False)
+    writeback.flush()
+    ctx.updated["atr_at_execution"] = writeback.updated
+    return f"{STAGE_DONE}: set {len(writeback.updated)} of {len(needing)} ATRs ({ctx.store.api_calls} bar requests)"
+
+
+def evaluable_count(ctx: PipelineContext) -> int:
+    """Trades in the frame that `evaluate_trades` would label now, after the earlier stages."""
+    new_exits = ctx.updated.get("exit_price", set())
+    new_atrs = ctx.updated.get("atr_at_execution", set())
+    cutoff = datetime.now(timezone.utc) - EVALUATION_DELAY
+    return sum(
+        1 for t in ctx.trades
+        if (t.exit_price is not None or t.session_id in new_exits)
+        and t.filled_avg_price is not None and t.filled_avg_price > 0
+        and ((t.atr_at_execution is not None and t.atr_at_execution > 0) or t.session_id in new_atrs)
+        and t.timestamp is not None and t.timestamp < cutoff
+    )
+
+
+def stage_evaluate(ctx: PipelineContext) -> str:
+    """Labels every evaluable trade with one UPDATE (evaluate_trades.py)."""
+    # Trades labeled by an earlier run are not in the frame, so this is an
+    # upper bound on the rows the UPDATE will touch.
+    candidates = evaluable_count(ctx)
+    if not candidates:
+        return f"{STAGE_SKIPPED}: no evaluable trade"
+    ensure_evaluation_columns(ctx.client, TABLE_ID)
+    ensure_outcomes_table(ctx.client)
+    evaluate_trades(ctx.client)
+    return f"{STAGE_DONE}: up to {candidates} trades evaluated"
+
+
+# Stage name -> (function, upstream stages).
+STAGES = {
+    "exit_prices": (stage_exit_prices, ()),
+    "atr": (stage_atr, ()),
+    "evaluate": (stage_evaluate, ("exit_prices", "atr")),
+}
+
+
+def _timed(name: str, fn, ctx: PipelineContext) -> tuple[str, float]:
+    start = time.perf_counter()
+    with span("stage", {"stage": name}):
+        line = fn(ctx)
+    return line, time.perf_counter() - start
+
+
+def run_dag(ctx: PipelineContext, stages: dict = STAGES, max_workers: int = 2) -> dict[str, str]:
+    """
+    Runs each stage as soon as its upstream stages have finished. A stage
+    whose upstream failed is not run.
+
+    Returns:
+        Stage name -> status line.
+    """
+    status: dict[str, str] = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while len(status) < len(stages):
+            for name, (fn, upstream) in stages.items():
+                if name in status or name in running.values():
+                    continue
+                if any(status.get(u, "").startswith(STAGE_FAILED) for u in upstream):
+                    status[name] = f"{STAGE_FAILED}: upstream failed"
+                    print(f"[{name}] {status[name]}")
+                elif all(u in status for u in upstream):
+                    print(f"[{name}] started")
+                    running[pool.submit(_timed, name, fn, ctx)] = name
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    line, seconds = future.result()
+                except Exception as e:
+                    line, seconds = f"{STAGE_FAILED}: {e}", 0.0
+                status[name] = line
+                print(f"[{name}] {line} ({seconds:.1f}s)")
+    return status
+
+
+def make_client(args: argparse.Namespace):
+    """The storage client: BigQuery, or a local DuckDB file with --duckdb."""
+    if args.duckdb:
+        from duckdb_backend import DuckDBClient
+        client = DuckDBClient(args.duckdb)
+        if args.seed_trades:
+            client.load_parquet(TABLE_ID, args.seed_trades)
+            print(f"Loaded {args.seed_trades} into {args.duckdb}.")
+        return instrument_client(client)
+    return instrument_client(bigquery.Client(project=GCP_PROJECT_ID))
+
+
+def parse_args() -> argparse.Namespace:
+    """Parses command-line options."""
+    parser = argparse.ArgumentParser(description="Run exit-price sync, ATR backfill and evaluation in one process.")
+    parser.add_argument("--duckdb", help="Run against this local DuckDB file instead of BigQuery.")
+    parser.add_argument("--seed-trades", help="With --duckdb, (re)create the trades table from this Parquet file.")
+    parser.add_argument("--offline", action="store_true", help="Do not call Alpaca; use cached bars only.")
+    parser.add_argument(
+        "--bar-store",
+        default=DEFAULT_STORE_DIR,
+        help="Directory of the local daily-bar store (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_MAX_CONCURRENCY,
+        help="Concurrent Alpaca requests when prefetching bars; 0 disables prefetching.",
+    )
+    parser.add_argument(
+        "--watermark",
+        default=DEFAULT_WATERMARK_PATH,
+        help="Closed-order watermark file (default: %(default)s).",
+    )
+    return parser.parse_args()
+
+
+@instrumented
+def main():
+    """Main function to orchestrate the labeling pipeline."""
+    args = parse_args()
+    print("=== Labeling Pipeline ===")
+    start = time.perf_counter()
+
+    try:
+        client = make_client(args)
+        alpaca_api = None if args.offline else tradeapi.REST(base_url=ALPACA_API_BASE_URL)
+        print("Clients initialized.")
+    except Exception as e:
+        print(f"Failed to initialize clients. Error: {e}")
+        return
+
+    ctx = PipelineContext(
+        client=client,
+        alpaca_api=alpaca_api,
+        store=BarStore(alpaca_api, args.bar_store),
+        trades=load_trade_frame(client),
+        args=args,
+    )
+    status = run_dag(ctx)
+    failed = [name for name, line in status.items() if line.startswith(STAGE_FAILED)]
+    print(f"\nPipeline finished in {time.perf_counter() - start:.1f}s"
+          + (f"; failed stages: {', '.join(failed)}" if failed else "."))
+
+if __name__ == "__main__":
+    main()
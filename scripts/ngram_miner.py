@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ISABEL: mine WIN/LOSE win rates for every unigram and bigram in the
+reasoning history, instead of a fixed 25-keyword list.
+
+Reasoning is tokenized into:
+
+- Latin words and numbers (lower-cased) and adjacent word pairs
+  ("support level"),
+- Japanese (kana/kanji) runs as character bigrams, plus single-character
+  runs, so no morphological analyzer is needed.
+
+Each thought contributes each term at most once, like `String.includes` in
+`getIsabelPatterns`. A batch of thoughts becomes a sparse document-term
+matrix in CSR form (`indptr`, `indices`), and per-term WIN/LOSE counts and
+return sums are updated with a single weighted `np.bincount` per column.
+
+The counts are persisted in a local `.npz` state together with a per-thought
+ledger (label and return_pct) and the `evaluated_at` high-water mark. Each
+run only reads trades evaluated since the mark. A thought whose label or
+return_pct changed (re-evaluation, or WIN/LOSE to HOLD) is subtracted with
+its old ledger entry before being added with the new one, so the counts and
+return sums always equal a full rescan.
+
+Usage:
+  python ngram_miner.py                 # update the counts and print top terms
+  python ngram_miner.py --full          # rebuild from scratch
+  python ngram_miner.py --output terms.csv --min-support 30
+
+Prerequisites:
+- Google Cloud SDK authenticated (`gcloud auth application-default login`)
+- Required Python packages installed:
+  - pip install google-cloud-bigquery numpy
+"""
+
+import argparse
+import csv
+import os
+import re
+from datetime import datetime
+import numpy as np
+from cluster_thoughts import wilson_lower_bound
+
+# --- Configuration ---
+GCP_PROJECT_ID = "screen-share-459802"
+TRADES_TABLE_ID = f"{GCP_PROJECT_ID}.magi_core.trades"
+THOUGHTS_TABLE_ID = f"{GCP_PROJECT_ID}.magi_core.thoughts"
+DEFAULT_STATE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "magi", "ngram_counts.npz")
+DEFAULT_MIN_SUPPORT = 20
+
+# Hiragana, katakana (including the long-vowel mark) and CJK ideographs.
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff"
+_TOKEN_RE = re.compile(f"[a-z][a-z0-9']*|[0-9]+(?:\\.[0-9]+)?%?|[{_CJK}]+")
+_CJK_RE = re.compile(f"[{_CJK}]")
+# Too common to be informative as unigrams; they still form bigrams.
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or so that the this to was were "
+    "will with which while than then there their these those be been being i we you".split()
+)
+
+
+def tokenize(text: str) -> set[str]:
+    """The set of unigram and bigram terms of a reasoning text."""
+    terms = set()
+    words = []
+    for token in _TOKEN_RE.findall((text or "").lower()):
+        if _CJK_RE.match(token):
+            # Japanese: character bigrams within the run; a lone character stands alone.
+            if len(token) == 1:
+                terms.add(token)
+            terms.update(token[i:i + 2] for i in range(len(token) - 1))
+            words.append(None)  # breaks word bigrams across scripts
+            continue
+        if token not in STOPWORDS:
+            terms.add(token)
+        words.append(token)
+    terms.update(f"{a} {b}" for a, b in zip(words, words[1:]) if a is not None and b is not None)
+    return terms
+
+
+def _same_entry(old: tuple[int, float], new: tuple[int, float]) -> bool:
+    """Ledger entries are equal when label and return_pct match, NaN matching NaN."""
+    return old[0] == new[0] and (old[1] == new[1] or (np.isnan(old[1]) and np.isnan(new[1])))
+
+
+class NgramCounts:
+    """
+    Per-term WIN/LOSE document counts, maintained incrementally.
+
+    Args:
+        path: Location of the persisted `.npz` state.
+    """
+
+    def __init__(self, path: str = DEFAULT_STATE_PATH):
+        self.path = path
+        self.vocab: list[str] = []
+        self.term_ids: dict[str, int] = {}
+        self.wins = np.zeros(0, dtype=np.int64)
+        self.loses = np.zeros(0, dtype=np.int64)
+        self.return_sum = np.zeros(0, dtype=np.float64)
+        self.return_n = np.zeros(0, dtype=np.int64)
+        # Ledger of counted thoughts: id -> (is_win, return_pct or NaN).
+        self.docs: dict[str, tuple[int, float]] = {}
+        self.watermark: datetime | None = None
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_STATE_PATH) -> "NgramCounts":
+        counts = cls(path)
+        if not os.path.exists(path):
+            return counts
+        with np.load(path, allow_pickle=False) as data:
+            counts.vocab = data["vocab"].tolist()
+            counts.wins = data["wins"]
+            counts.loses = data["loses"]
+            counts.return_sum = data["return_sum"]
+            counts.return_n = data["return_n"]
+            counts.docs = dict(zip(data["doc_ids"].tolist(),
+                                   zip(data["doc_wins"].tolist(), data["doc_returns"].tolist())))
+            watermark = str(data["watermark"])
+            counts.watermark = datetime.fromisoformat(watermark) if watermark else None
+        counts.term_ids = {term: i for i, term in enumerate(counts.vocab)}
+        return counts
+
+    def save(self):
+        """Atomically writes the state."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        doc_ids = list(self.docs)
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            vocab=np.array(self.vocab, dtype=str),
+            wins=self.wins, loses=self.loses, return_sum=self.return_sum, return_n=self.return_n,
+            doc_ids=np.array(doc_ids, dtype=str),
+            doc_wins=np.array([self.docs[d][0] for d in doc_ids], dtype=np.int8),
+            doc_returns=np.array([self.docs[d][1] for d in doc_ids], dtype=np.float64),
+            watermark=np.array(self.watermark.isoformat() if self.watermark else ""),
+        )
+        os.replace(tmp_path, self.path)
+
+    @property
+    def total_wins(self) -> int:
+        return sum(w for w, _ in self.docs.values())
+
+    @property
+    def total_docs(self) -> int:
+        return len(self.docs)
+
+    def _term_matrix(self, texts: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """CSR (indptr, indices) of the texts' term sets, growing the vocabulary."""
+        indptr = [0]
+        indices = []
+        for text in texts:
+            for term in tokenize(text):
+                term_id = self.term_ids.get(term)
+                if term_id is None:
+                    term_id = self.term_ids[term] = len(self.vocab)
+                    self.vocab.append(term)
+                indices.append(term_id)
+            indptr.append(len(indices))
+        grow = len(self.vocab) - len(self.wins)
+        if grow > 0:
+            self.wins = np.concatenate([self.wins, np.zeros(grow, dtype=np.int64)])
+            self.loses = np.concatenate([self.loses, np.zeros(grow, dtype=np.int64)])
+            self.return_sum = np.concatenate([self.return_sum, np.zeros(grow)])
+            self.return_n = np.concatenate([self.return_n, np.zeros(grow, dtype=np.int64)])
+        return np.array(indptr, dtype=np.int64), np.array(indices, dtype=np.int64)
+
+    def _apply(self, texts: list[str], is_win: np.ndarray, returns: np.ndarray, sign: int):
+        """Adds (sign=+1) or removes (sign=-1) the documents' contributions."""
+        if not texts:
+            return
+        indptr, indices = self._term_matrix(texts)
+        per_doc = np.diff(indptr)
+        n = len(self.vocab)
+        doc_win = np.repeat(is_win, per_doc)
+        doc_return = np.repeat(returns, per_doc)
+        has_return = ~np.isnan(doc_return)
+        self.wins += sign * np.bincount(indices, weights=doc_win, minlength=n).astype(np.int64)
+        self.loses += sign * np.bincount(indices, weights=1 - doc_win, minlength=n).astype(np.int64)
+        self.return_sum += sign * np.bincount(indices[has_return], weights=doc_return[has_return], minlength=n)
+        self.return_n += sign * np.bincount(indices[has_return], minlength=n)
+
+    def update(self, rows) -> tuple[int, int]:
+        """
+        Applies newly (re)evaluated thoughts.
+
+        Args:
+            rows: Iterable of objects with `id`, `result`, `return_pct`,
+                `reasoning` and `evaluated_at`.
+
+        Returns:
+            (added, removed) document counts.
+        """
+        add, remove = [], []
+        for row in rows:
+            if row.evaluated_at and (self.watermark is None or row.evaluated_at > self.watermark):
+                self.watermark = row.evaluated_at
+            old = self.docs.get(row.id)
+            new = None
+            if row.result in ("WIN", "LOSE"):
+                return_pct = float(row.return_pct) if row.return_pct is not None else np.nan
+                new = (1 if row.result == "WIN" else 0, return_pct)
+            if old is not None and new is not None and _same_entry(old, new):
+                continue
+            if old is not None:
+                remove.append((row.reasoning, *old))
+                del self.docs[row.id]
+            if new is not None:
+                add.append((row.reasoning, *new))
+                self.docs[row.id] = new
+
+        for docs, sign in ((remove, -1), (add, 1)):
+            if docs:
+                texts, labels, returns = zip(*docs)
+                self._apply(list(texts), np.array(labels, dtype=float), np.array(returns, dtype=float), sign)
+        return len(add), len(remove)
+
+    def term_table(self, min_support: int = DEFAULT_MIN_SUPPORT) -> dict[str, np.ndarray]:
+        """Terms with at least `min_support` WIN/LOSE documents and their statistics."""
+        support = self.wins + self.loses
+        keep = np.flatnonzero(support >= min_support)
+        wins, n = self.wins[keep], support[keep]
+        base_rate = self.total_wins / self.total_docs if self.total_docs else 0.0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            win_rate = wins / n
+            mean_return = np.where(self.return_n[keep] > 0, self.return_sum[keep] / self.return_n[keep], np.nan)
+            lift = win_rate / base_rate if base_rate else np.full(len(keep), np.nan)
+        return {
+            "term": np.array(self.vocab, dtype=object)[keep] if len(keep) else np.array([], dtype=object),
+            "support": n,
+            "wins": wins,
+            "loses": self.loses[keep],
+            "win_rate": win_rate,
+            "win_rate_lower_95": wilson_lower_bound(wins, n),
+            "win_rate_upper_95": 1 - wilson_lower_bound(n - wins, n),
+            "lift": lift,
+            "mean_return_pct": mean_return,
+        }
+
+
+def iter_evaluated_thoughts(client, watermark: datetime | None, page_size: int = 5000):
+    """Yields pages of thoughts whose trade was (re)evaluated since the watermark."""
+    from google.cloud import bigquery
+
+    # `>=`: rows sharing the watermark timestamp may not all have been read;
+    # the ledger makes re-reading them a no-op.
+    watermark_filter = "AND t.evaluated_at >= @watermark" if watermark else "AND t.result IN ('WIN', 'LOSE')"
+    query = f"""
+        SELECT CONCAT(t.session_id, '-', t.symbol) AS id, t.result, t.return_pct, t.evaluated_at, th.reasoning
+        FROM `{TRADES_TABLE_ID}` t
+        JOIN `{THOUGHTS_TABLE_ID}` th ON t.session_id = th.session_id AND t.symbol = th.symbol
+        WHERE th.reasoning IS NOT NULL AND LENGTH(th.reasoning) > 10
+          {watermark_filter}
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("watermark", "TIMESTAMP", watermark)] if watermark else []
+    )
+    rows = client.query(query, job_config=job_config).result(page_size=page_size)
+    print(f"Found {rows.total_rows} thoughts evaluated since {watermark or 'the beginning'}.")
+    for page in rows.pages:
+        yield list(page)
+
+
+def update_counts(client, path: str = DEFAULT_STATE_PATH, full: bool = False) -> NgramCounts:
+    """Loads the persisted counts, applies new evaluations and saves them."""
+    counts = NgramCounts(path) if full else NgramCounts.load(path)
+    added = removed = 0
+    for page in iter_evaluated_thoughts(client, counts.watermark):
+        a, r = counts.update(page)
+        added, removed = added + a, removed + r
+    counts.save()
+    print(f"Applied {added} new and {removed} withdrawn labels; "
+          f"{counts.total_docs} thoughts, {len(counts.vocab)} terms.")
+    return counts
+
+
+def js_patterns(counts: NgramCounts, min_support: int = DEFAULT_MIN_SUPPORT, limit: int = 5):
+    """
+    Winning and losing terms in the `[keyword, {winRate, wins, loses}]` shape
+    of `getIsabelPatterns`, ranked by the Wilson bound instead of the raw rate.
+    """
+    table = counts.term_table(min_support)
+    rate = np.floor(table["win_rate"] * 100 + 0.5).astype(int) if len(table["term"]) else np.array([], dtype=int)
+
+    def entries(order, mask):
+        return [
+            [str(table["term"][i]), {"winRate": int(rate[i]), "wins": int(table["wins"][i]), "loses": int(table["loses"][i])}]
+            for i in order if mask[i]
+        ][:limit]
+
+    win_patterns = entries(np.argsort(-table["win_rate_lower_95"], kind="stable"), rate >= 65)
+    lose_patterns = entries(np.argsort(table["win_rate_upper_95"], kind="stable"), rate <= 40)
+    return win_patterns, lose_patterns
+
+
+def write_csv(path: str, table: dict[str, np.ndarray]):
+    """Writes one row per term, best lower bound first."""
+    order = np.argsort(-table["win_rate_lower_95"], kind="stable")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(list(table))
+        for i in order:
+            writer.writerow([table[col][i] if col == "term" else round(float(table[col][i]), 4) for col in table])
+
+
+def parse_args() -> argparse.Namespace:
+    """Parses command-line options."""
+    parser = argparse.ArgumentParser(description="Mine per-term WIN/LOSE rates from reasoning.")
+    parser.add_argument("--state", default=DEFAULT_STATE_PATH, help="Persisted counts (.npz).")
+    parser.add_argument("--full", action="store_true", help="Discard the state and rebuild from scratch.")
+    parser.add_argument("--min-support", type=int, default=DEFAULT_MIN_SUPPORT, help="Minimum WIN+LOSE thoughts per term.")
+    parser.add_argument("--output", help="Write the full term table to this CSV file.")
+    parser.add_argument("--top", type=int, default=15, help="Number of winning/losing terms to print.")
+    return parser.parse_args()
+
+
+def main():
+    """Main function to orchestrate the mining."""
+    args = parse_args()
+    print("=== ISABEL N-gram Miner ===")
+
+    from google.cloud import bigquery
+    try:
+        bq_client = bigquery.Client(project=GCP_PROJECT_ID)
+        print("Successfully connected to BigQuery.")
+    except Exception as e:
+        print(f"Failed to connect to BigQuery. Ensure you are authenticated. Error: {e}")
+        return
+
+    counts = update_counts(bq_client, args.state, args.full)
+    table = counts.term_table(args.min_support)
+    if args.output:
+        write_csv(args.output, table)
+        print(f"Wrote {len(table['term'])} terms to {args.output}.")
+
+    base = counts.total_wins / counts.total_docs if counts.total_docs else 0.0
+    print(f"\nBase win rate: {base:.1%}. Terms with >= {args.min_support} thoughts: {len(table['term'])}")
+    for title, order in (
+        ("Winning terms (by 95% lower bound)", np.argsort(-table["win_rate_lower_95"], kind="stable")),
+        ("Losing terms (by 95% upper bound)", np.argsort(table["win_rate_upper_95"], kind="stable")),
+    ):
+        print(f"\n{title}:")
+        for i in order[:args.top]:
+            print(f"  {table['term'][i]:<24} {table['win_rate'][i]:6.1%} "
+                  f"({table['wins'][i]}W/{table['loses'][i]}L, lift {table['lift'][i]:.2f})")
+
+if __name__ == "__main__":
+    main()
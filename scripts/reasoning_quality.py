@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The ten reasoning-quality factors of `analyzeReasoningQuality` in
+`magi-core.js`, reproduced exactly.
+
+The JavaScript regexes are translated so that they match the same strings
+under Python's `re`:
+
+- `\\d` becomes `[0-9]` (JS `\\d` is ASCII-only, Python's is Unicode).
+- `\\s` becomes `JS_WHITESPACE`, the exact JS whitespace set.
+- `.` becomes `[^\\n\\r\\u2028\\u2029]` (JS `.` also excludes \\r and the
+  Unicode line/paragraph separators).
+
+String lengths are counted in UTF-16 code units like JS `.length`.
+
+A score is also available as a bitmask: bit `i` is set when factor
+`QUALITY_FACTORS[i]` is 1, and the total is the number of set bits.
+`score_many` computes bitmasks for a whole batch, across a process pool for
+large batches. Bump `QUALITY_VERSION` whenever a factor changes, so stored
+bitmasks are recomputed.
+"""
+
+import os
+import re
+from multiprocessing import Pool
+
+JS_WHITESPACE = "[\\t\\n\\v\\f\\r \\u00a0\\u1680\\u2000-\\u200a\\u2028\\u2029\\u202f\\u205f\\u3000\\ufeff]"
+_JS_DOT = "[^\\n\\r\\u2028\\u2029]"
+
+# Factor names in the order of the JS `score` object.
+QUALITY_FACTORS = (
+    "hasIndicator",
+    "hasNumericData",
+    "hasTimeframe",
+    "sufficientLength",
+    "hasHypothesis",
+    "noHopefulWords",
+    "noContrarianWords",
+    "hasRiskAwareness",
+    "hasPriceTarget",
+    "trendFollowing",
+)
+MAX_SCORE = len(QUALITY_FACTORS)
+QUALITY_VERSION = "js-v1"
+# Below this many texts a process pool costs more than it saves.
+POOL_THRESHOLD = 5000
+
+_INDICATOR = re.compile("rsi|sma|ema|macd|bollinger|moving average|移動平均")
+_NUMERIC = re.compile("[0-9]+(\\.[0-9]+)?%|\\$[0-9]+|[0-9]+x|[0-9]+倍")
+_TIMEFRAME = re.compile(
+    f"short{_JS_DOT}?term|long{_JS_DOT}?term|1{JS_WHITESPACE}?(day|week|month)|日|週|月|hours?|分"
+)
+_HOPEFUL = re.compile("hope|wish|should reverse|due for|might bounce|maybe")
+_CONTRARIAN = re.compile(f"contrarian|against{_JS_DOT}?trend|底|天井")
+_RISK = re.compile("risk|caution|concern|注意|リスク|懸念")
+_PRICE_TARGET = re.compile(f"target|stop{_JS_DOT}?loss|利確|損切|目標")
+_TREND = re.compile("trend|momentum|upward|上昇|継続")
+
+
+def js_length(text: str) -> int:
+    """`text.length` in JavaScript: the number of UTF-16 code units."""
+    return len(text.encode("utf-16-le", "surrogatepass")) // 2
+
+
+def quality_factors(reasoning: str | None, hypothesis: str | None) -> dict[str, int]:
+    """The JS `score` object: factor name -> 0 or 1."""
+    r = (reasoning or "").lower()
+    return {
+        "hasIndicator": 1 if _INDICATOR.search(r) else 0,
+        "hasNumericData": 1 if _NUMERIC.search(r) else 0,
+        "hasTimeframe": 1 if _TIMEFRAME.search(r) else 0,
+        "sufficientLength": 1 if reasoning and js_length(reasoning) >= 100 else 0,
+        "hasHypothesis": 1 if hypothesis and js_length(hypothesis) >= 20 else 0,
+        "noHopefulWords": 0 if _HOPEFUL.search(r) else 1,
+        "noContrarianWords": 0 if _CONTRARIAN.search(r) else 1,
+        "hasRiskAwareness": 1 if _RISK.search(r) else 0,
+        "hasPriceTarget": 1 if _PRICE_TARGET.search(r) else 0,
+        "trendFollowing": 1 if _TREND.search(r) else 0,
+    }
+
+
+def factors_to_bitmask(factors: dict[str, int]) -> int:
+    """Packs a factor dict into an integer, bit i for QUALITY_FACTORS[i]."""
+    return sum(1 << i for i, name in enumerate(QUALITY_FACTORS) if factors[name])
+
+
+def bitmask_to_factors(bitmask: int) -> dict[str, int]:
+    """Inverse of `factors_to_bitmask`."""
+    return {name: (bitmask >> i) & 1 for i, name in enumerate(QUALITY_FACTORS)}
+
+
+def analyze_reasoning_quality(reasoning: str | None, hypothesis: str | None) -> dict:
+    """Same result as `analyzeReasoningQuality`: {score, total, maxScore}."""
+    score = quality_factors(reasoning, hypothesis)
+    return {"score": score, "total": sum(score.values()), "maxScore": MAX_SCORE}
+
+
+def quality_bitmask(reasoning: str | None, hypothesis: str | None) -> int:
+    """The factor bitmask of one thought."""
+    return factors_to_bitmask(quality_factors(reasoning, hypothesis))
+
+
+def _score_chunk(pairs: list[tuple[str | None, str | None]]) -> list[int]:
+    return [quality_bitmask(r, h) for r, h in pairs]
+
+
+def score_many(pairs: list[tuple[str | None, str | None]], processes: int | None = None,
+               chunk_size: int = 2000) -> list[int]:
+    """
+    Bitmasks for many (reasoning, hypothesis) pairs, in input order.
+
+    Args:
+        pairs: The thoughts to score.
+        processes: Worker processes (default: all cores). Batches smaller
+            than POOL_THRESHOLD, or processes=1, are scored in-process.
+        chunk_size: Pairs per task sent to a worker.
+    """
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(pairs) < POOL_THRESHOLD:
+        return _score_chunk(pairs)
+    chunks = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+    with Pool(processes) as pool:
+        return [mask for chunk in pool.map(_score_chunk, chunks) for mask in chunk]
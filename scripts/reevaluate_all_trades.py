@@ -23,13 +23,41 @@ This script should be run after `backfill_atr.py` to ensure all trades
 have the necessary `atr_at_execution` data. This will overwrite any
 previous `result` values, creating a clean slate for Pattern Analysis v2.0.
 
+With `--incremental`, only trades whose evaluation inputs (exit_price,
+filled_avg_price, atr_at_execution, side), multipliers or rule version
+changed since they were last evaluated are rewritten; each evaluation stores
+a fingerprint of those values (see `trade_evaluation.py`). `--start` and
+`--end` restrict the run to a timestamp window so BigQuery can prune
+partitions, keeping cost proportional to the trades actually touched.
+
+`--estimate` dry-runs the UPDATE first and prints how many bytes it will
+process and what that costs on demand; `--dry-run` stops after the
+estimate and changes nothing, not even the schema: missing evaluation
+columns or a missing outcomes table are reported instead of created. Both
+record the estimate through `instrumentation.py`.
+
+When any result was rewritten, the per-day outcome aggregates
+(`trade_outcomes.py`) are rebuilt from scratch.
+
 Prerequisites:
 - Google Cloud SDK authenticated (`gcloud auth application-default login`)
 - Required Python packages installed:
   - pip install google-cloud-bigquery
 """
 
+import argparse
+from datetime import datetime, timezone
 from google.cloud import bigquery
+from instrumentation import estimate_bytes, format_bytes_cost, instrument_client, instrumented, span
+from trade_evaluation import (
+    EVALUABLE_SQL,
+    FINGERPRINT_SQL,
+    SET_EVALUATION_SQL,
+    ensure_evaluation_columns,
+    evaluation_parameters,
+    missing_evaluation_columns,
+)
+from trade_outcomes import ensure_outcomes_table, outcomes_table_exists, rebuild_outcomes
 
 # --- Configuration ---
 GCP_PROJECT_ID = "screen-share-459802"
@@ -43,69 +71,130 @@ TABLE_ID = f"{GCP_PROJECT_ID}.{BIGQUERY_DATASET}.{BIGQUERY_TABLE}"
 WIN_ATR_MULTIPLIER = 2.0
 LOSE_ATR_MULTIPLIER = 1.5
 
-def reevaluate_all_trades(client: bigquery.Client):
-    """
-    Updates trade results (WIN/LOSE/HOLD) for ALL trades using the new
-    volatility-adjusted thresholds. This will overwrite previous results.
-    """
+def build_reevaluation_query(incremental: bool = False, start: datetime | None = None,
+                             end: datetime | None = None) -> tuple[str, list]:
+    """Returns the re-evaluation UPDATE and its query parameters (see `reevaluate_all_trades`)."""
+    filters = [EVALUABLE_SQL]
+    query_parameters = evaluation_parameters(WIN_ATR_MULTIPLIER, LOSE_ATR_MULTIPLIER)
+    if incremental:
+        filters.append(f"eval_fingerprint IS DISTINCT FROM {FINGERPRINT_SQL}")
+    if start is not None:
+        filters.append("timestamp >= @start_ts")
+        query_parameters.append(bigquery.ScalarQueryParameter("start_ts", "TIMESTAMP", start))
+    if end is not None:
+        filters.append("timestamp < @end_ts")
+        query_parameters.append(bigquery.ScalarQueryParameter("end_ts", "TIMESTAMP", end))
+
+    where_clause = "\n      AND ".join(filters)
     query = f"""
     UPDATE `{TABLE_ID}`
     SET 
-      result = CASE 
-        /* Volatility-adjusted WIN condition */
-        WHEN side = 'buy' AND (exit_price - filled_avg_price) >= (atr_at_execution * @win_multiplier) THEN 'WIN'
-        WHEN side = 'sell' AND (filled_avg_price - exit_price) >= (atr_at_execution * @win_multiplier) THEN 'WIN'
-        
-        /* Volatility-adjusted LOSE condition */
-        WHEN side = 'buy' AND (exit_price - filled_avg_price) <= -(atr_at_execution * @lose_multiplier) THEN 'LOSE'
-        WHEN side = 'sell' AND (filled_avg_price - exit_price) <= -(atr_at_execution * @lose_multiplier) THEN 'LOSE'
-        
-        ELSE 'HOLD'
-      END,
-      return_pct = ROUND((exit_price - filled_avg_price) / filled_avg_price * 100, 2)
+      {SET_EVALUATION_SQL}
     WHERE 
       /* This condition applies the logic to all evaluatable trades */
-      exit_price IS NOT NULL
-      AND filled_avg_price IS NOT NULL
-      AND filled_avg_price > 0
-      AND atr_at_execution IS NOT NULL
-      AND atr_at_execution > 0
+      {where_clause}
     """
+    return query, query_parameters
+
+def reevaluate_all_trades(client: bigquery.Client, incremental: bool = False,
+                          start: datetime | None = None, end: datetime | None = None,
+                          estimate: bool = False, dry_run: bool = False):
+    """
+    Updates trade results (WIN/LOSE/HOLD) for ALL trades using the new
+    volatility-adjusted thresholds. This will overwrite previous results.
+
+    Args:
+        client: A BigQuery client instance.
+        incremental: Only rewrite rows whose stored evaluation fingerprint
+            differs from the one the current rule and inputs produce, i.e.
+            rows whose inputs, multipliers or rule version changed.
+        start: Optional inclusive lower bound on `timestamp`.
+        end: Optional exclusive upper bound on `timestamp`. Bounding the
+            window lets BigQuery prune partitions.
+        estimate: Dry-run the UPDATE first and print its estimated cost.
+        dry_run: Only print the estimate; do not run the UPDATE.
+    """
+    query, query_parameters = build_reevaluation_query(incremental, start, end)
+    mode = "INCREMENTAL" if incremental else "FULL"
+
+    if estimate or dry_run:
+        estimated = estimate_bytes(client, query, query_parameters, name=f"reevaluate_{mode.lower()}")
+        if estimated is None:
+            print("This backend cannot estimate query cost.")
+        else:
+            print(f"Estimated {mode} re-evaluation cost: {format_bytes_cost(estimated)} processed.")
+        if dry_run:
+            return
+
+    print(f"Executing {mode} re-evaluation with volatility-adjusted logic:\n{query}")
     
-    print(f"Executing FULL re-evaluation with volatility-adjusted logic:\n{query}")
-    
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("win_multiplier", "FLOAT64", WIN_ATR_MULTIPLIER),
-            bigquery.ScalarQueryParameter("lose_multiplier", "FLOAT64", LOSE_ATR_MULTIPLIER),
-        ]
-    )
+    job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
 
     # Execute the query
     query_job = client.query(query, job_config=job_config)
     
     print("Waiting for re-evaluation query to complete...")
-    query_job.result()
+    with span("reevaluate", {"mode": mode}):
+        query_job.result()
     
     if query_job.errors:
         print(f"Errors encountered during re-evaluation: {query_job.errors}")
     else:
         print(f"Successfully re-evaluated {query_job.num_dml_affected_rows} trades.")
+        # Changed results cannot be applied as deltas; recompute the aggregates.
+        if query_job.num_dml_affected_rows:
+            rebuild_outcomes(client)
 
+def parse_timestamp(text: str) -> datetime:
+    """Parses an ISO date or timestamp; naive values are taken as UTC."""
+    value = datetime.fromisoformat(text)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def parse_args() -> argparse.Namespace:
+    """Parses command-line options."""
+    parser = argparse.ArgumentParser(description="Re-evaluate trade results with the ATR-based rule.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only rewrite trades whose inputs, multipliers or rule version changed.",
+    )
+    parser.add_argument("--start", type=parse_timestamp, help="Only trades with timestamp >= START (ISO).")
+    parser.add_argument("--end", type=parse_timestamp, help="Only trades with timestamp < END (ISO).")
+    parser.add_argument("--estimate", action="store_true", help="Print a dry-run cost estimate before the UPDATE.")
+    parser.add_argument("--dry-run", action="store_true", help="Print the cost estimate and exit without updating.")
+    return parser.parse_args()
+
+@instrumented
 def main():
     """Main function to orchestrate the re-evaluation."""
+    args = parse_args()
     print("--- Starting Full Trade Re-evaluation Process (Pattern Analysis v2.0) ---")
     
     # --- Initialize Client ---
     try:
-        bq_client = bigquery.Client(project=GCP_PROJECT_ID)
+        bq_client = instrument_client(bigquery.Client(project=GCP_PROJECT_ID))
         print("Successfully connected to BigQuery.")
     except Exception as e:
         print(f"Failed to connect to BigQuery. Ensure you are authenticated. Error: {e}")
         return
 
+    # --- Dry Run: report missing schema instead of creating it ---
+    if args.dry_run:
+        if not outcomes_table_exists(bq_client):
+            print("The outcome aggregates table does not exist yet; a real run would create it.")
+        missing = missing_evaluation_columns(bq_client, TABLE_ID)
+        if missing:
+            # The UPDATE writes these columns, so it cannot be dry-run without them.
+            print(f"{TABLE_ID} lacks {', '.join(missing)}; a real run would add them. "
+                  "No estimate is possible until they exist.")
+            return
+        reevaluate_all_trades(bq_client, args.incremental, args.start, args.end, args.estimate, dry_run=True)
+        return
+
     # --- Run Re-evaluation ---
-    reevaluate_all_trades(bq_client)
+    ensure_evaluation_columns(bq_client, TABLE_ID)
+    ensure_outcomes_table(bq_client)
+    reevaluate_all_trades(bq_client, args.incremental, args.start, args.end, args.estimate, args.dry_run)
     
     print("\n--- Full Re-evaluation Process Complete ---")
     print("The 'trades' table is now updated with the new evaluation logic.")
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script scores the reasoning quality of every thought once and stores
+the result in `magi_analytics.thought_quality`:
+
+- `quality_score`: the `analyzeReasoningQuality` total (0-10).
+- `quality_bitmask`: bit i set when factor `QUALITY_FACTORS[i]` holds.
+- `quality_version`: `QUALITY_VERSION` of the scorer.
+
+The first run scores the whole `thoughts` table in one batch pass across a
+process pool. Later runs only read thoughts newer than the stored
+high-water mark (minus a short lookback, because the agent units stream
+inserts concurrently) and skip keys that are already scored. Rows are
+appended with load jobs, never with DML. `thoughts` receives streaming
+inserts, which UPDATE cannot touch.
+
+`quality_aggregates` turns the stored bitmasks into the WIN/LOSE factor
+counts behind `getIsabelQuality` with one GROUP BY. Quality analysis then no
+longer rescans the reasoning text.
+
+Prerequisites:
+- Google Cloud SDK authenticated (`gcloud auth application-default login`)
+- Required Python packages installed:
+  - pip install google-cloud-bigquery
+"""
+
+import argparse
+from datetime import datetime, timezone
+from google.cloud import bigquery
+from reasoning_quality import QUALITY_FACTORS, QUALITY_VERSION, score_many
+
+# --- Configuration ---
+GCP_PROJECT_ID = "screen-share-459802"
+TRADES_TABLE_ID = f"{GCP_PROJECT_ID}.magi_core.trades"
+THOUGHTS_TABLE_ID = f"{GCP_PROJECT_ID}.magi_core.thoughts"
+QUALITY_TABLE_ID = f"{GCP_PROJECT_ID}.magi_analytics.thought_quality"
+LOOKBACK_MINUTES = 60
+
+
+def ensure_quality_table(client: bigquery.Client, table_id: str = QUALITY_TABLE_ID):
+    """Creates the per-thought quality table if missing."""
+    client.query(f"""
+        CREATE TABLE IF NOT EXISTS `{table_id}` (
+          session_id STRING NOT NULL,
+          symbol STRING,
+          thought_timestamp TIMESTAMP,
+          quality_score INT64 NOT NULL,
+          quality_bitmask INT64 NOT NULL,
+          quality_version STRING NOT NULL,
+          scored_at TIMESTAMP NOT NULL
+        )
+        CLUSTER BY session_id, symbol
+    """).result()
+
+
+def get_watermark(client: bigquery.Client, table_id: str = QUALITY_TABLE_ID) -> datetime | None:
+    """The newest thought timestamp scored with the current version."""
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("version", "STRING", QUALITY_VERSION)]
+    )
+    rows = list(client.query(
+        f"SELECT MAX(thought_timestamp) AS wm FROM `{table_id}` WHERE quality_version = @version",
+        job_config=job_config,
+    ).result())
+    return rows[0].wm if rows else None
+
+
+def iter_unscored_pages(client: bigquery.Client, watermark: datetime | None, page_size: int,
+                        table_id: str = QUALITY_TABLE_ID):
+    """Yields pages of thoughts not yet scored with the current version."""
+    params = [bigquery.ScalarQueryParameter("version", "STRING", QUALITY_VERSION)]
+    thought_window = scored_window = ""
+    if watermark:
+        thought_window = "AND th.timestamp >= TIMESTAMP_SUB(@watermark, INTERVAL @lookback MINUTE)"
+        scored_window = "AND thought_timestamp >= TIMESTAMP_SUB(@watermark, INTERVAL @lookback MINUTE)"
+        params += [
+            bigquery.ScalarQueryParameter("watermark", "TIMESTAMP", watermark),
+            bigquery.ScalarQueryParameter("lookback", "INT64", LOOKBACK_MINUTES),
+        ]
+    query = f"""
+        SELECT th.session_id, th.symbol, th.timestamp, th.reasoning, th.hypothesis
+        FROM `{THOUGHTS_TABLE_ID}` th
+        LEFT JOIN (
+          SELECT session_id, symbol, thought_timestamp
+          FROM `{table_id}`
+          WHERE quality_version = @version
+            {scored_window}
+        ) q
+          ON q.session_id = th.session_id
+          AND q.symbol IS NOT DISTINCT FROM th.symbol
+          AND q.thought_timestamp IS NOT DISTINCT FROM th.timestamp
+        WHERE q.session_id IS NULL
+          AND th.reasoning IS NOT NULL AND LENGTH(th.reasoning) > 10
+          {thought_window}
+    """
+    rows = client.query(query, job_config=bigquery.QueryJobConfig(query_parameters=params)).result(page_size=page_size)
+    print(f"Found {rows.total_rows} unscored thoughts{f' since {watermark}' if watermark else ''}.")
+    for page in rows.pages:
+        yield list(page)
+
+
+def load_rows(client: bigquery.Client, rows: list[dict], table_id: str = QUALITY_TABLE_ID):
+    """Appends rows with a single load job."""
+    job_config = bigquery.LoadJobConfig(write_disposition=bigquery.WriteDisposition.WRITE_APPEND)
+    load_job = client.load_table_from_json(rows, table_id, job_config=job_config)
+    load_job.result()
+    if load_job.errors:
+        print(f"Errors loading {len(rows)} rows: {load_job.errors}")
+    else:
+        print(f"Stored {load_job.output_rows} quality scores.")
+
+
+def score_new_thoughts(client: bigquery.Client, full: bool = False, page_size: int = 20000,
+                       load_batch: int = 100000, processes: int | None = None) -> int:
+    """Scores and stores every unscored thought; returns the number stored."""
+    ensure_quality_table(client)
+    watermark = None if full else get_watermark(client)
+    scored_at = datetime.now(timezone.utc).isoformat()
+    pending, written = [], 0
+    for page in iter_unscored_pages(client, watermark, page_size):
+        masks = score_many([(row.reasoning, row.hypothesis) for row in page], processes)
+        pending.extend(
+            {
+                "session_id": row.session_id,
+                "symbol": row.symbol,
+                "thought_timestamp": row.timestamp.isoformat() if row.timestamp else None,
+                "quality_score": mask.bit_count(),
+                "quality_bitmask": mask,
+                "quality_version": QUALITY_VERSION,
+                "scored_at": scored_at,
+            }
+            for row, mask in zip(page, masks)
+        )
+        if len(pending) >= load_batch:
+            load_rows(client, pending)
+            written, pending = written + len(pending), []
+    if pending:
+        load_rows(client, pending)
+        written += len(pending)
+    return written
+
+
+def quality_aggregates(client: bigquery.Client, table_id: str = QUALITY_TABLE_ID) -> tuple[dict, dict, dict]:
+    """
+    Aggregates stored bitmasks of WIN/LOSE trades.
+
+    Returns:
+        `counts` ({"win": n, "lose": n}), `score_sums` (same keys) and
+        `factor_counts` ({factor: {"with"|"without": {"win": n, "lose": n}}}),
+        exactly what `getIsabelQuality` accumulates row by row.
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("version", "STRING", QUALITY_VERSION)]
+    )
+    rows = client.query(f"""
+        WITH scored AS (
+          SELECT t.result, q.quality_bitmask, q.quality_score
+          FROM `{TRADES_TABLE_ID}` t
+          JOIN `{table_id}` q ON t.session_id = q.session_id AND t.symbol = q.symbol
+          WHERE t.result IN ('WIN', 'LOSE') AND q.quality_version = @version
+        )
+        SELECT bit, (quality_bitmask >> bit) & 1 AS has_factor, result,
+          COUNT(*) AS n, SUM(quality_score) AS score_sum
+        FROM scored, UNNEST(GENERATE_ARRAY(0, {len(QUALITY_FACTORS) - 1})) AS bit
+        GROUP BY bit, has_factor, result
+    """, job_config=job_config).result()
+
+    counts, score_sums = {"win": 0, "lose": 0}, {"win": 0, "lose": 0}
+    factor_counts = {f: {"with": {"win": 0, "lose": 0}, "without": {"win": 0, "lose": 0}} for f in QUALITY_FACTORS}
+    for r in rows:
+        outcome = "win" if r.result == "WIN" else "lose"
+        factor_counts[QUALITY_FACTORS[r.bit]]["with" if r.has_factor else "without"][outcome] += r.n
+        if r.bit == 0:
+            counts[outcome] += r.n
+            score_sums[outcome] += r.score_sum
+    return counts, score_sums, factor_counts
+
+
+def parse_args() -> argparse.Namespace:
+    """Parses command-line options."""
+    parser = argparse.ArgumentParser(description="Score and store the reasoning quality of every thought.")
+    parser.add_argument("--full", action="store_true", help="Ignore the watermark and score every unscored thought.")
+    parser.add_argument("--page-size", type=int, default=20000, help="Thoughts per result page.")
+    parser.add_argument("--processes", type=int, help="Worker processes (default: all cores).")
+    return parser.parse_args()
+
+
+def main():
+    """Main function to orchestrate quality scoring."""
+    args = parse_args()
+    print("=== Score Thought Quality ===")
+
+    try:
+        bq_client = bigquery.Client(project=GCP_PROJECT_ID)
+        print("Successfully connected to BigQuery.")
+    except Exception as e:
+        print(f"Failed to connect to BigQuery. Ensure you are authenticated. Error: {e}")
+        return
+
+    written = score_new_thoughts(bq_client, args.full, args.page_size, processes=args.processes)
+    print("Nothing to score." if written == 0 else f"\nComplete! Scored {written} thoughts.")
+
+if __name__ == "__main__":
+    main()
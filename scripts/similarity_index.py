@@ -0,0 +1,527 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ISABEL: k-nearest-neighbour win probability over stored thought embeddings.
+
+Instead of reducing the history to a WIN and a LOSE centroid, the whole
+`thought_embeddings` table is exported once into a local index directory:
+
+- `vectors.npy`: an (n, dim) float32 matrix of L2-normalised embeddings,
+  memory-mapped on load.
+- `meta.npz`: per-row id, symbol, provider, result (WIN=1 / LOSE=0) and
+  return_pct.
+- `codes_int8.npy` + `int8_scale.npy` and `codes_binary.npy` (optional,
+  `build --quantize`): per-dimension int8 codes (4x smaller) and packed sign
+  bits (32x smaller). With `--drop-float` only the codes are kept.
+- `ivf_*.npy` (optional): an inverted-file partitioning. Rows are grouped by
+  their nearest of `nlist` k-means centroids, so a query only scans the
+  `nprobe` closest partitions.
+
+Search is exact cosine top-k via blocked matrix multiplication (the matrix is
+read `block_size` rows at a time), or approximate when the IVF partitioning
+is present and `nprobe` is given. The int8 and binary modes scan the codes
+instead (float query times int8 codes, or popcount Hamming distance on the
+sign bits) and rescore the best `k * rescore` candidates with float dot
+products, which keeps recall close to the float scan. The win probability of a new reasoning is
+the similarity-weighted share of WINs among its k nearest neighbours.
+
+Usage:
+  python similarity_index.py build [--ivf] [--quantize [--drop-float]]
+  python similarity_index.py query "reasoning text" [-k 20] [--mode binary]
+
+Prerequisites:
+- Google Cloud SDK authenticated (`gcloud auth application-default login`)
+  for `build`; COHERE_API_KEY for `query` on texts not in the embedding cache.
+- Required Python packages installed:
+  - pip install cohere google-cloud-bigquery google-cloud-bigquery-storage numpy pyarrow
+"""
+
+import argparse
+import os
+from dataclasses import dataclass
+import numpy as np
+
+# --- Configuration ---
+GCP_PROJECT_ID = "screen-share-459802"
+EMBEDDINGS_TABLE_ID = f"{GCP_PROJECT_ID}.magi_analytics.thought_embeddings"
+DEFAULT_INDEX_DIR = os.environ.get(
+    "MAGI_SIMILARITY_INDEX_DIR", os.path.join(os.path.expanduser("~"), ".cache", "magi", "thought_index")
+)
+EMBED_MODEL = "embed-multilingual-v3.0"
+QUERY_INPUT_TYPE = "search_query"
+DEFAULT_BLOCK_SIZE = 65536
+DEFAULT_K = 20
+# Quantized scans keep k * DEFAULT_RESCORE candidates for float rescoring.
+DEFAULT_RESCORE = 10
+SEARCH_MODES = ("float", "int8", "binary")
+INDEX_FILES = (
+    "vectors.npy", "codes_int8.npy", "int8_scale.npy", "codes_binary.npy",
+    "ivf_centroids.npy", "ivf_order.npy", "ivf_offsets.npy",
+)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalises rows as float32; zero rows stay zero."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _merge_topk(best_scores, best_idx, scores, offset, k):
+    """Merges a block's scores (q, b) into the running top-k (q, k)."""
+    idx = np.arange(offset, offset + scores.shape[1])
+    all_scores = np.concatenate([best_scores, scores], axis=1)
+    all_idx = np.concatenate([best_idx, np.broadcast_to(idx, scores.shape)], axis=1)
+    keep = np.argpartition(-all_scores, min(k, all_scores.shape[1] - 1), axis=1)[:, :k]
+    return np.take_along_axis(all_scores, keep, 1), np.take_along_axis(all_idx, keep, 1)
+
+
+def blocked_scan(matrix: np.ndarray, score, n_queries: int, k: int,
+                 block_size: int = DEFAULT_BLOCK_SIZE, rows: np.ndarray | None = None):
+    """
+    Top-k rows of `matrix` under a block scoring function (higher is better).
+
+    Args:
+        matrix: (n, width) matrix, typically a memmap.
+        score: Maps a block of rows (b, width) to scores (n_queries, b).
+        n_queries: Number of queries scored at once.
+        k: Number of neighbours.
+        block_size: Rows of `matrix` read and scored at a time.
+        rows: Optional subset of row indices to search (used by IVF).
+
+    Returns:
+        (scores, indices), both (n_queries, k), sorted by descending score.
+        Indices refer to rows of `matrix`; missing slots are -1 with score -inf.
+    """
+    if rows is not None:
+        # Sorted rows keep memmap reads close to sequential.
+        rows = np.sort(np.asarray(rows, dtype=np.int64))
+    n = len(rows) if rows is not None else matrix.shape[0]
+    best_scores = np.full((n_queries, 0), -np.inf, dtype=np.float32)
+    best_idx = np.empty((n_queries, 0), dtype=np.int64)
+    for start in range(0, n, block_size):
+        if rows is None:
+            block = matrix[start:start + block_size]
+        else:
+            block = matrix[rows[start:start + block_size]]
+        scores = np.asarray(score(np.asarray(block)), dtype=np.float32)
+        best_scores, best_idx = _merge_topk(best_scores, best_idx, scores, start, k)
+    if rows is not None:
+        best_idx = rows[best_idx]
+
+    order = np.argsort(-best_scores, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, 1)
+    best_idx = np.take_along_axis(best_idx, order, 1)
+    if best_scores.shape[1] < k:
+        pad = k - best_scores.shape[1]
+        best_scores = np.pad(best_scores, ((0, 0), (0, pad)), constant_values=-np.inf)
+        best_idx = np.pad(best_idx, ((0, 0), (0, pad)), constant_values=-1)
+    return best_scores, best_idx
+
+
+def blocked_topk(matrix: np.ndarray, queries: np.ndarray, k: int,
+                 block_size: int = DEFAULT_BLOCK_SIZE, rows: np.ndarray | None = None):
+    """Exact top-k inner products of `queries` (q, dim) against float `matrix` rows."""
+    queries = np.atleast_2d(queries).astype(np.float32)
+    return blocked_scan(matrix, lambda block: queries @ block.astype(np.float32, copy=False).T,
+                        len(queries), k, block_size, rows)
+
+
+# --- Quantization ---
+
+def int8_scale(matrix: np.ndarray, block_size: int = DEFAULT_BLOCK_SIZE) -> np.ndarray:
+    """Per-dimension scale mapping the largest absolute value to 127."""
+    max_abs = np.zeros(matrix.shape[1], dtype=np.float32)
+    for start in range(0, matrix.shape[0], block_size):
+        np.maximum(max_abs, np.abs(matrix[start:start + block_size]).max(axis=0), out=max_abs)
+    return (127.0 / np.where(max_abs == 0, 1, max_abs)).astype(np.float32)
+
+
+def quantize_int8(vectors: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    """Symmetric per-dimension int8 codes: round(v * scale)."""
+    return np.clip(np.rint(np.asarray(vectors, dtype=np.float32) * scale), -127, 127).astype(np.int8)
+
+
+def quantize_binary(vectors: np.ndarray) -> np.ndarray:
+    """Sign bits packed 8 per byte, matching Cohere's `ubinary` layout."""
+    return np.packbits(np.asarray(vectors) > 0, axis=-1)
+
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def hamming_distances(codes: np.ndarray, query_bits: np.ndarray) -> np.ndarray:
+    """Hamming distances (q, b) between packed query bits (q, w) and codes (b, w)."""
+    codes = np.ascontiguousarray(codes, dtype=np.uint8)
+    query_bits = np.ascontiguousarray(np.atleast_2d(query_bits), dtype=np.uint8)
+    if codes.shape[1] % 8 == 0:
+        # XOR and popcount 64 bits at a time.
+        codes, query_bits = codes.view(np.uint64), query_bits.view(np.uint64)
+    xor = codes[np.newaxis, :, :] ^ query_bits[:, np.newaxis, :]
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(xor).sum(axis=2, dtype=np.int32)
+    return _POPCOUNT_TABLE[xor.view(np.uint8)].sum(axis=2, dtype=np.int32)
+
+
+def train_kmeans(sample: np.ndarray, k: int, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """Spherical k-means (Lloyd) on normalised vectors; returns (k, dim) unit centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        empty = np.bincount(assign, minlength=k) == 0
+        sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+@dataclass
+class Neighbor:
+    id: str
+    symbol: str
+    llm_provider: str
+    result: str
+    return_pct: float
+    similarity: float
+
+
+class SimilarityIndex:
+    """
+    A memory-mapped index of normalised thought embeddings.
+
+    Args:
+        index_dir: Directory written by `build_index`.
+    """
+
+    def __init__(self, index_dir: str = DEFAULT_INDEX_DIR):
+        self.index_dir = index_dir
+        self.vectors = self._load("vectors.npy", mmap_mode="r")
+        self.codes_int8 = self._load("codes_int8.npy", mmap_mode="r")
+        self.int8_scale = self._load("int8_scale.npy")
+        self.codes_binary = self._load("codes_binary.npy", mmap_mode="r")
+        if self.vectors is None and self.codes_int8 is None:
+            raise FileNotFoundError(f"No vectors.npy or codes_int8.npy in {index_dir}")
+        with np.load(os.path.join(index_dir, "meta.npz")) as meta:
+            self.ids = meta["ids"]
+            self.symbols = meta["symbols"]
+            self.providers = meta["providers"]
+            self.wins = meta["wins"]
+            self.return_pct = meta["return_pct"]
+        self.ivf_centroids = self._load("ivf_centroids.npy")
+        if self.ivf_centroids is not None:
+            self.ivf_order = self._load("ivf_order.npy", mmap_mode="r")
+            self.ivf_offsets = self._load("ivf_offsets.npy")
+
+    def _load(self, name: str, mmap_mode: str | None = None) -> np.ndarray | None:
+        path = os.path.join(self.index_dir, name)
+        return np.load(path, mmap_mode=mmap_mode) if os.path.exists(path) else None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, queries: np.ndarray, k: int = DEFAULT_K, nprobe: int | None = None,
+               block_size: int = DEFAULT_BLOCK_SIZE, mode: str = "float", rescore: int = DEFAULT_RESCORE):
+        """
+        Top-k neighbours for each query.
+
+        Args:
+            queries: (q, dim) or (dim,) float query embeddings.
+            k: Number of neighbours.
+            nprobe: If given and the index has an IVF partitioning, only the
+                `nprobe` closest partitions are scanned.
+            block_size: Rows read per block.
+            mode: `float` scans the float32 matrix exactly; `int8` scans the
+                int8 codes with the float query (4x less data); `binary`
+                scans the packed sign bits by Hamming distance (32x less).
+            rescore: For `int8` / `binary`, the `k * rescore` best candidates
+                are rescored against the float vectors (or the int8 codes if
+                the index was built without them).
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"mode must be one of {SEARCH_MODES}, got {mode!r}")
+        queries = normalize(np.atleast_2d(queries))
+        if nprobe is None or self.ivf_centroids is None:
+            return self._search(queries, k, None, block_size, mode, rescore)
+
+        results = [self._search(q[np.newaxis], k, self._probe_rows(q, nprobe), block_size, mode, rescore)
+                   for q in queries]
+        return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+    def _search(self, queries, k, rows, block_size, mode, rescore):
+        if mode == "float":
+            if self.vectors is None:
+                raise ValueError("Index was built without float vectors; use mode='int8' or 'binary'.")
+            return blocked_topk(self.vectors, queries, k, block_size, rows)
+
+        candidates = k * max(1, rescore)
+        if mode == "int8":
+            scaled = queries / self.int8_scale
+            _, idx = blocked_scan(self.codes_int8, lambda block: scaled @ block.astype(np.float32).T,
+                                  len(queries), candidates, block_size, rows)
+        else:
+            query_bits = quantize_binary(queries)
+            _, idx = blocked_scan(self.codes_binary, lambda block: -hamming_distances(block, query_bits),
+                                  len(queries), candidates, block_size, rows)
+        return self._rescore(queries, idx, k)
+
+    def float_rows(self, selection) -> np.ndarray:
+        """Float32 rows for a slice or sorted index array, dequantizing int8 codes if needed."""
+        if self.vectors is not None:
+            return np.asarray(self.vectors[selection], dtype=np.float32)
+        return np.asarray(self.codes_int8[selection], dtype=np.float32) / self.int8_scale
+
+    def _rescore(self, queries: np.ndarray, candidates: np.ndarray, k: int):
+        """Exact float scores for each query's candidate rows; keeps the best k."""
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        idx = np.full((len(queries), k), -1, dtype=np.int64)
+        for q, (query, cand) in enumerate(zip(queries, candidates)):
+            cand = np.unique(cand[cand >= 0])
+            if len(cand) == 0:
+                continue
+            exact = self.float_rows(cand) @ query
+            top = np.argsort(-exact)[:k]
+            scores[q, :len(top)], idx[q, :len(top)] = exact[top], cand[top]
+        return scores, idx
+
+    def _probe_rows(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        lists = np.argsort(-(self.ivf_centroids @ query))[:nprobe]
+        return np.concatenate([self.ivf_order[self.ivf_offsets[l]:self.ivf_offsets[l + 1]] for l in lists])
+
+    def win_probability(self, query: np.ndarray, k: int = DEFAULT_K, nprobe: int | None = None,
+                        mode: str = "float") -> tuple[float | None, list[Neighbor]]:
+        """
+        Similarity-weighted WIN share among the k nearest stored thoughts.
+
+        Returns:
+            The probability (None if no neighbours) and the neighbours,
+            most similar first.
+        """
+        scores, idx = self.search(query, k, nprobe, mode=mode)
+        scores, idx = scores[0], idx[0]
+        valid = idx >= 0
+        scores, idx = scores[valid], idx[valid]
+        if len(idx) == 0:
+            return None, []
+        weights = np.clip(scores, 1e-6, None)
+        prob = float(np.sum(weights * self.wins[idx]) / np.sum(weights))
+        neighbors = [
+            Neighbor(str(self.ids[i]), str(self.symbols[i]), str(self.providers[i]),
+                     "WIN" if self.wins[i] else "LOSE", float(self.return_pct[i]), float(s))
+            for i, s in zip(idx, scores)
+        ]
+        return prob, neighbors
+
+
+def _index_vectors(index_dir: str) -> np.ndarray:
+    """The float vectors of an index, or its int8 codes dequantized if it has none."""
+    path = os.path.join(index_dir, "vectors.npy")
+    if os.path.exists(path):
+        return np.load(path, mmap_mode="r")
+    codes = np.load(os.path.join(index_dir, "codes_int8.npy"), mmap_mode="r")
+    return normalize(np.asarray(codes, dtype=np.float32) / np.load(os.path.join(index_dir, "int8_scale.npy")))
+
+
+def build_ivf(index_dir: str, nlist: int | None = None, sample_size: int = 50000,
+              block_size: int = DEFAULT_BLOCK_SIZE):
+    """Partitions an existing index into `nlist` k-means lists (default ~sqrt(n))."""
+    vectors = _index_vectors(index_dir)
+    n = vectors.shape[0]
+    nlist = nlist or max(1, int(np.sqrt(n)))
+    rng = np.random.default_rng(0)
+    sample_idx = np.sort(rng.choice(n, size=min(n, sample_size), replace=False))
+    centroids = train_kmeans(np.asarray(vectors[sample_idx]), min(nlist, len(sample_idx)))
+
+    assign = np.empty(n, dtype=np.int32)
+    for start in range(0, n, block_size):
+        assign[start:start + block_size] = np.argmax(np.asarray(vectors[start:start + block_size]) @ centroids.T, axis=1)
+    order = np.argsort(assign, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=len(centroids)))])
+
+    np.save(os.path.join(index_dir, "ivf_centroids.npy"), centroids)
+    np.save(os.path.join(index_dir, "ivf_order.npy"), order.astype(np.int64))
+    np.save(os.path.join(index_dir, "ivf_offsets.npy"), offsets.astype(np.int64))
+    print(f"Built IVF partitioning with {len(centroids)} lists over {n} vectors.")
+
+
+def build_quantized(index_dir: str, keep_float: bool = True, block_size: int = DEFAULT_BLOCK_SIZE):
+    """
+    Writes int8 codes (with their per-dimension scale) and packed binary codes
+    next to `vectors.npy`. With `keep_float=False` the float matrix is removed
+    afterwards; search then rescores against the int8 codes.
+    """
+    from numpy.lib.format import open_memmap
+
+    vectors_path = os.path.join(index_dir, "vectors.npy")
+    vectors = np.load(vectors_path, mmap_mode="r")
+    n, dim = vectors.shape
+    scale = int8_scale(vectors, block_size)
+    np.save(os.path.join(index_dir, "int8_scale.npy"), scale)
+    codes_int8 = open_memmap(os.path.join(index_dir, "codes_int8.npy"), mode="w+", dtype=np.int8, shape=(n, dim))
+    codes_binary = open_memmap(os.path.join(index_dir, "codes_binary.npy"), mode="w+", dtype=np.uint8,
+                               shape=(n, -(-dim // 8)))
+    for start in range(0, n, block_size):
+        block = np.asarray(vectors[start:start + block_size])
+        codes_int8[start:start + len(block)] = quantize_int8(block, scale)
+        codes_binary[start:start + len(block)] = quantize_binary(block)
+    codes_int8.flush()
+    codes_binary.flush()
+    del codes_int8, codes_binary, vectors
+
+    sizes = {name: os.path.getsize(os.path.join(index_dir, name))
+             for name in ("vectors.npy", "codes_int8.npy", "codes_binary.npy")}
+    print("Quantized index: " + ", ".join(f"{name} {size / 1e6:.1f} MB" for name, size in sizes.items()))
+    if not keep_float:
+        os.remove(vectors_path)
+        print("Removed the float matrix; searches rescore against the int8 codes.")
+
+
+def _batch_vectors(batch: dict[str, np.ndarray], dim: int) -> np.ndarray:
+    """
+    A batch's embeddings as a (rows x dim) matrix: the FLOAT64 arrays where
+    present, else the int8 BYTES codes.
+    """
+    n = len(batch["id"])
+    out = np.zeros((n, dim), dtype=np.float32)
+    missing = np.ones(n, dtype=bool)
+    if batch.get("embedding") is not None:
+        floats = batch["embedding"]
+        out[:, :floats.shape[1]] = floats
+        missing = ~floats.any(axis=1)
+    if batch.get("embedding_int8") is not None and missing.any():
+        codes = batch["embedding_int8"]
+        out[missing, :codes.shape[1]] = codes[missing]
+    return out
+
+
+def build_index(client, index_dir: str = DEFAULT_INDEX_DIR, table_id: str = EMBEDDINGS_TABLE_ID) -> int:
+    """
+    Exports every labeled embedding from BigQuery into `index_dir`.
+
+    The result is streamed as Arrow record batches (see `arrow_reader.py`)
+    straight into a preallocated memory-mapped matrix, so memory use does
+    not grow with the table. Rows synced without the FLOAT64 array are read
+    from their `embedding_int8` BYTES column.
+    """
+    from numpy.lib.format import open_memmap
+    from arrow_reader import BigQuerySource, iter_numpy_batches
+
+    columns = {field.name for field in client.get_table(table_id).schema}
+    has_float, has_int8 = "embedding" in columns, "embedding_int8" in columns
+    present, dims = [], []
+    kinds = {"id": "str", "symbol": "str", "llm_provider": "str", "trade_result": "str", "return_pct": "float"}
+    if has_float:
+        present.append("ARRAY_LENGTH(embedding) > 0")
+        dims.append("IFNULL(ARRAY_LENGTH(embedding), 0)")
+        kinds["embedding"] = "vector"
+    if has_int8:
+        present.append("embedding_int8 IS NOT NULL")
+        dims.append("IFNULL(BYTE_LENGTH(embedding_int8), 0)")
+        kinds["embedding_int8"] = "int8"
+    if not present:
+        raise ValueError(f"{table_id} has neither an embedding nor an embedding_int8 column")
+    dim_sql = dims[0] if len(dims) == 1 else f"GREATEST({', '.join(dims)})"
+    where = f"FROM `{table_id}` WHERE trade_result IN ('WIN', 'LOSE') AND ({' OR '.join(present)})"
+
+    count_row = list(client.query(f"SELECT COUNT(*) AS n, MAX({dim_sql}) AS dim {where}").result())[0]
+    n, dim = count_row.n, count_row.dim or 0
+    print(f"Exporting {n} embeddings of dimension {dim} to {index_dir}...")
+    os.makedirs(index_dir, exist_ok=True)
+    for name in INDEX_FILES:
+        if os.path.exists(os.path.join(index_dir, name)):
+            os.remove(os.path.join(index_dir, name))
+
+    vectors = open_memmap(os.path.join(index_dir, "vectors.npy"), mode="w+", dtype=np.float32, shape=(n, dim))
+    meta = {"ids": [], "symbols": [], "providers": [], "wins": [], "return_pct": []}
+    source = BigQuerySource(client, f"SELECT {', '.join(kinds)} {where} ORDER BY id")
+    i = 0
+    for batch in iter_numpy_batches(source, kinds):
+        # Rows added after the COUNT are left for the next build.
+        take = min(len(batch["id"]), n - i)
+        if take <= 0:
+            break
+        vectors[i:i + take] = normalize(_batch_vectors(batch, dim)[:take])
+        meta["ids"].append(batch["id"][:take])
+        meta["symbols"].append(batch["symbol"][:take])
+        meta["providers"].append(batch["llm_provider"][:take])
+        meta["wins"].append(batch["trade_result"][:take] == "WIN")
+        meta["return_pct"].append(batch["return_pct"][:take])
+        i += take
+    vectors.flush()
+    del vectors
+
+    def joined(name, dtype):
+        return np.concatenate(meta[name]).astype(dtype) if meta[name] else np.empty(0, dtype=dtype)
+
+    np.savez(
+        os.path.join(index_dir, "meta.npz"),
+        ids=joined("ids", str), symbols=joined("symbols", str),
+        providers=joined("providers", str), wins=joined("wins", np.int8),
+        return_pct=joined("return_pct", np.float32),
+    )
+    print(f"Wrote {i} vectors.")
+    return i
+
+
+def parse_args() -> argparse.Namespace:
+    """Parses command-line options."""
+    parser = argparse.ArgumentParser(description="ISABEL k-NN similarity index.")
+    parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR, help="Index directory.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Export thought_embeddings into a local index.")
+    build.add_argument("--ivf", action="store_true", help="Also build an IVF partitioning.")
+    build.add_argument("--nlist", type=int, help="Number of IVF lists (default: sqrt(n)).")
+    build.add_argument("--quantize", action="store_true", help="Also write int8 and binary codes.")
+    build.add_argument("--drop-float", action="store_true",
+                       help="With --quantize, delete the float matrix and keep only the codes.")
+    query = sub.add_parser("query", help="Estimate the win probability of a reasoning text.")
+    query.add_argument("text", help="Reasoning text.")
+    query.add_argument("-k", type=int, default=DEFAULT_K, help="Number of neighbours.")
+    query.add_argument("--nprobe", type=int, help="Scan only this many IVF lists.")
+    query.add_argument("--mode", choices=SEARCH_MODES, default="float",
+                       help="Scan float vectors, int8 codes or binary codes.")
+    return parser.parse_args()
+
+
+def main():
+    """Main function to build or query the index."""
+    args = parse_args()
+    if args.command == "build":
+        from google.cloud import bigquery
+        n = build_index(bigquery.Client(project=GCP_PROJECT_ID), args.index_dir)
+        if n > 0 and args.ivf:
+            build_ivf(args.index_dir, args.nlist)
+        if n > 0 and args.quantize:
+            build_quantized(args.index_dir, keep_float=not args.drop_float)
+        return
+
+    from embedding_cache import EmbeddingCache, embed_texts
+    index = SimilarityIndex(args.index_dir)
+    cache = EmbeddingCache()
+    query = embed_texts([args.text], cache, model=EMBED_MODEL, input_type=QUERY_INPUT_TYPE)
+    cache.close()
+    prob, neighbors = index.win_probability(query, args.k, args.nprobe, mode=args.mode)
+    if prob is None:
+        print("Index is empty.")
+        return
+    print(f"Win probability (k={args.k}, n={len(index)}, {args.mode}): {prob:.1%}")
+    for nb in neighbors:
+        print(f"  {nb.similarity:.3f} {nb.result:4} {nb.return_pct:+6.2f}% {nb.symbol:6} {nb.llm_provider:10} {nb.id}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script scans a universe of symbols for intraday surges and crashes and
+triggers the fast LLM jobs on the strongest moves. It replaces the
+per-symbol loop of `surge-detector.js`.
+
+Snapshots are fetched from Alpaca's multi-symbol `/v2/stocks/snapshots`
+endpoint in chunks of `SNAPSHOT_CHUNK_SIZE`, with all chunks in flight at
+once through `alpaca_client.AlpacaClient`. The daily-bar history of the
+universe comes from the local `bar_store.BarStore`, and only uncovered
+days are fetched, concurrently with the snapshots.
+
+Each symbol gets three measures, computed as NumPy arrays over the whole
+universe:
+
+- `change_pct`: latest trade versus the previous close, as in the JS scan.
+- `volume_ratio`: today's volume so far over the 20-day average volume.
+- `atr_move`: the price change in units of the 14-day ATR as the agent
+  computes it (`indicators.js_atr`), over bars up to the previous session.
+
+A symbol is a candidate when |change_pct| >= `CHANGE_THRESHOLD` or
+|atr_move| >= `ATR_MOVE_THRESHOLD`, and its volume ratio is at least
+`--min-volume-ratio`. Candidates are ranked by |atr_move|. A symbol without
+enough history is ranked as if its change threshold equalled the ATR
+threshold. The top `--top` candidates are alerted on Telegram. They trigger
+`magi-core-groq`, and also `magi-core-gemini` when there are at least two.
+
+Usage:
+
+    python surge_scanner.py --universe universe.txt --dry-run
+
+Prerequisites:
+- Alpaca API credentials set as environment variables.
+- Google Cloud SDK authenticated (`gcloud auth application-default login`)
+  to trigger the Cloud Run jobs.
+- TELEGRAM_BOT_TOKEN / TELEGRAM_CHAT_ID set for Telegram alerts (optional).
+- Required Python packages installed:
+  - pip install aiohttp google-auth numpy
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import urllib.request
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from alpaca_client import DEFAULT_MAX_CONCURRENCY, AlpacaClient
+from bar_store import DEFAULT_STORE_DIR, BarStore
+from indicators import ATR_PERIOD, EXECUTION_ATR_WINDOW, PRICE_HISTORY_WINDOW, js_atr
+from instrumentation import count, instrumented, span
+
+# --- Configuration ---
+GCP_PROJECT_ID = "screen-share-459802"
+CLOUD_RUN_REGION = "asia-northeast1"
+PRIMARY_JOB = "magi-core-groq"
+SECONDARY_JOB = "magi-core-gemini"
+SYMBOLS = ["AAPL", "MSFT", "GOOGL", "NVDA", "META", "TSLA", "AMD"]
+SNAPSHOT_FEED = "iex"
+SNAPSHOT_CHUNK_SIZE = 500
+CHANGE_THRESHOLD = 2.0      # % versus the previous close, as in surge-detector.js
+ATR_MOVE_THRESHOLD = 1.5    # move in ATRs
+# Calendar days of bars kept warm in the store; covers EXECUTION_ATR_WINDOW sessions.
+HISTORY_DAYS = 45
+DEFAULT_TOP = 10
+
+
+@dataclass
+class ScanResult:
+    """Per-symbol measures of one scan, aligned with `symbols`."""
+    symbols: np.ndarray
+    price: np.ndarray
+    prev_close: np.ndarray
+    change_pct: np.ndarray
+    volume_ratio: np.ndarray
+    atr_move: np.ndarray
+    score: np.ndarray
+
+
+def load_universe(path: str | None, symbols: list[str] | None) -> list[str]:
+    """The symbols to scan: --symbols, a file with one symbol per line, or `SYMBOLS`."""
+    if symbols:
+        universe = symbols
+    elif path:
+        with open(path) as f:
+            universe = [line.split("#", 1)[0].strip() for line in f]
+    else:
+        universe = SYMBOLS
+    # Upper-cased and deduplicated, first occurrence wins.
+    return list(dict.fromkeys(s.upper() for s in universe if s))
+
+
+def _chunks(items: list, size: int) -> list[list]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+async def fetch_snapshots(client: AlpacaClient, symbols: list[str],
+                          chunk_size: int = SNAPSHOT_CHUNK_SIZE) -> dict[str, dict]:
+    """Fetches snapshots for every symbol, one request per chunk, all chunks concurrently."""
+    async def fetch_chunk(chunk):
+        try:
+            return await client.get_snapshots(chunk, feed=SNAPSHOT_FEED)
+        except Exception as e:
+            print(f"  - Snapshot request for {len(chunk)} symbols failed: {e}")
+            return {}
+
+    results = await asyncio.gather(*(fetch_chunk(c) for c in _chunks(symbols, chunk_size)))
+    snapshots = {}
+    for result in results:
+        snapshots.update({s: snap for s, snap in result.items() if snap})
+    return snapshots
+
+
+async def fetch_market_data(store: BarStore, symbols: list[str], history_end,
+                            concurrency: int) -> tuple[dict[str, dict], int]:
+    """Fetches snapshots and fills the bar history of the universe concurrently."""
+    ranges = {s: (history_end - timedelta(days=HISTORY_DAYS), history_end) for s in symbols}
+    async with AlpacaClient(max_concurrency=concurrency) as client:
+        snapshots, fetched = await asyncio.gather(
+            fetch_snapshots(client, symbols),
+            store.prefetch(client, ranges),
+        )
+    return snapshots, fetched
+
+
+def snapshot_arrays(symbols: list[str], snapshots: dict[str, dict]) -> dict[str, np.ndarray]:
+    """Latest price, previous close and session volume per symbol; NaN when missing."""
+    price = np.full(len(symbols), np.nan)
+    prev_close = np.full(len(symbols), np.nan)
+    volume = np.full(len(symbols), np.nan)
+    for i, symbol in enumerate(symbols):
+        snap = snapshots.get(symbol)
+        if not snap:
+            continue
+        daily = snap.get("dailyBar") or {}
+        price[i] = (snap.get("latestTrade") or {}).get("p") or daily.get("c") or np.nan
+        prev_close[i] = (snap.get("prevDailyBar") or {}).get("c") or np.nan
+        volume[i] = daily.get("v") or 0
+    return {"price": price, "prev_close": prev_close, "volume": volume}
+
+
+def history_matrices(store: BarStore, symbols: list[str], before,
+                     window: int = EXECUTION_ATR_WINDOW) -> dict[str, np.ndarray]:
+    """
+    The last `window` stored bars of each symbol dated before `before`,
+    right-aligned in (symbols x window) matrices and NaN-padded on the left.
+    """
+    fields = ("high", "low", "close", "volume")
+    matrices = {f: np.full((len(symbols), window), np.nan) for f in fields}
+    for row, symbol in enumerate(symbols):
+        bars = store.get_bars(symbol, before - timedelta(days=HISTORY_DAYS), before - timedelta(days=1))[-window:]
+        for f in fields:
+            matrices[f][row, window - len(bars):] = bars[f]
+    return matrices
+
+
+def score_universe(symbols: list[str], snap: dict[str, np.ndarray],
+                   history: dict[str, np.ndarray]) -> ScanResult:
+    """Computes the change, volume ratio, ATR-normalized move and ranking score of every symbol."""
+    price, prev_close = snap["price"], snap["prev_close"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change_pct = (price - prev_close) / prev_close * 100
+        avg_volume = np.nanmean(history["volume"][:, -PRICE_HISTORY_WINDOW:], axis=1)
+        volume_ratio = snap["volume"] / avg_volume
+        atr = js_atr(history["high"], history["low"], history["close"], ATR_PERIOD, EXECUTION_ATR_WINDOW)[:, -1]
+        atr_move = np.where(atr > 0, (price - prev_close) / atr, np.nan)
+    # Without an ATR, a CHANGE_THRESHOLD move scores exactly ATR_MOVE_THRESHOLD.
+    score = np.where(np.isnan(atr_move), np.abs(change_pct) / CHANGE_THRESHOLD * ATR_MOVE_THRESHOLD,
+                     np.abs(atr_move))
+    return ScanResult(np.asarray(symbols), price, prev_close, change_pct, volume_ratio, atr_move, score)
+
+
+def rank_candidates(result: ScanResult, min_volume_ratio: float = 0.0, top: int = DEFAULT_TOP) -> np.ndarray:
+    """Indices of the alerting symbols, strongest first, at most `top`."""
+    with np.errstate(invalid="ignore"):
+        moved = (np.abs(result.change_pct) >= CHANGE_THRESHOLD) | (np.abs(result.atr_move) >= ATR_MOVE_THRESHOLD)
+        volume_ok = ~(result.volume_ratio < min_volume_ratio)  # a NaN ratio never filters
+    candidates = np.flatnonzero(moved & volume_ok & np.isfinite(result.score))
+    return candidates[np.argsort(-result.score[candidates], kind="stable")][:top]
+
+
+def format_alert(result: ScanResult, i: int) -> str:
+    """One Telegram line, like the JS alert plus the volume ratio and ATR move."""
+    change = result.change_pct[i]
+    icon = "🚀" if change >= 0 else "💥"
+    extra = []
+    if np.isfinite(result.atr_move[i]):
+        extra.append(f"{result.atr_move[i]:+.1f} ATR")
+    if np.isfinite(result.volume_ratio[i]):
+        extra.append(f"vol x{result.volume_ratio[i]:.1f}")
+    suffix = f" [{', '.join(extra)}]" if extra else ""
+    return f"{icon} <b>{result.symbols[i]}</b>: {change:+.2f}% (${result.price[i]:g}){suffix}"
+
+
+def send_telegram_alert(message: str):
+    """Posts an HTML message to the configured Telegram chat; a no-op when unconfigured."""
+    bot_token = os.environ.get("TELEGRAM_BOT_TOKEN")
+    chat_id = os.environ.get("TELEGRAM_CHAT_ID")
+    if not bot_token or not chat_id:
+        return
+    body = json.dumps({"chat_id": chat_id, "text": message, "parse_mode": "HTML"}).encode()
+    request = urllib.request.Request(
+        f"https://api.telegram.org/bot{bot_token}/sendMessage",
+        data=body, headers={"Content-Type": "application/json"}, method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10):
+            pass
+    except Exception as e:
+        print(f"[TELEGRAM] Error: {e}")
+
+
+def trigger_job(job_name: str) -> bool:
+    """Runs a Cloud Run job with application-default credentials."""
+    try:
+        import google.auth
+        from google.auth.transport.requests import AuthorizedSession
+        credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+        url = (f"https://{CLOUD_RUN_REGION}-run.googleapis.com/apis/run.googleapis.com/v1/"
+               f"namespaces/{GCP_PROJECT_ID}/jobs/{job_name}:run")
+        response = AuthorizedSession(credentials).post(url, timeout=30)
+        print(f"[SURGE] Triggered {job_name}: {response.status_code}")
+        count("surge_jobs_triggered_total", job=job_name, status=response.status_code)
+        return response.ok
+    except Exception as e:
+        print(f"[SURGE] Failed to trigger {job_name}: {e}")
+        return False
+
+
+def scan(symbols: list[str], store: BarStore, concurrency: int) -> ScanResult:
+    """Fetches market data for the universe and scores every symbol."""
+    today = datetime.now(timezone.utc).date()
+    with span("fetch_market_data", symbols=len(symbols)):
+        snapshots, fetched = asyncio.run(fetch_market_data(store, symbols, today - timedelta(days=1), concurrency))
+    print(f"[SURGE] {len(snapshots)} snapshots, {fetched} bar ranges fetched.")
+    with span("score_universe"):
+        snap = snapshot_arrays(symbols, snapshots)
+        history = history_matrices(store, symbols, today)
+        return score_universe(symbols, snap, history)
+
+
+def parse_args() -> argparse.Namespace:
+    """Parses command-line options."""
+    parser = argparse.ArgumentParser(description="Scan a symbol universe for surges and trigger the fast LLM jobs.")
+    parser.add_argument("--universe", help="File with one symbol per line (default: the 7 core symbols).")
+    parser.add_argument("--symbols", nargs="+", help="Symbols to scan; overrides --universe.")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="Alert on at most this many symbols.")
+    parser.add_argument("--min-volume-ratio", type=float, default=0.0,
+                        help="Only alert when today's volume is at least this multiple of the 20-day average.")
+    parser.add_argument(
+        "--bar-store",
+        default=DEFAULT_STORE_DIR,
+        help="Directory of the local daily-bar store (default: %(default)s).",
+    )
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY,
+                        help="Concurrent Alpaca requests.")
+    parser.add_argument("--dry-run", action="store_true", help="Print the ranking; send no alert and trigger no job.")
+    return parser.parse_args()
+
+
+@instrumented
+def main():
+    """Main function to scan the universe and trigger the LLM jobs."""
+    args = parse_args()
+    symbols = load_universe(args.universe, args.symbols)
+    print(f"[SURGE SCANNER] Scanning {len(symbols)} symbols...")
+    start = time.perf_counter()
+
+    result = scan(symbols, BarStore(None, args.bar_store), max(args.concurrency, 1))
+    ranked = rank_candidates(result, args.min_volume_ratio, args.top)
+    print(f"[SURGE] Scan finished in {time.perf_counter() - start:.2f}s.")
+    count("surge_alerts_total", value=len(ranked))
+
+    if not len(ranked):
+        print("[SURGE] No significant moves detected.")
+        return
+
+    print(f"[SURGE] {len(ranked)} alert(s) detected:")
+    for i in ranked:
+        print(f"  {result.symbols[i]:<6} {result.change_pct[i]:+7.2f}%  "
+              f"atr_move={result.atr_move[i]:+.2f}  volume_ratio={result.volume_ratio[i]:.2f}  "
+              f"score={result.score[i]:.2f}")
+    if args.dry_run:
+        return
+
+    alert_text = "\n".join(format_alert(result, i) for i in ranked)
+    send_telegram_alert(f"⚡ <b>MAGI SURGE ALERT</b>\n{alert_text}\n\nTriggering rapid analysis...")
+
+    # Fastest LLM (Groq) first; a second opinion from Gemini on multiple surges.
+    if trigger_job(PRIMARY_JOB):
+        send_telegram_alert("🤖 Groq (ANIMA) triggered for rapid response.")
+    if len(ranked) >= 2:
+        trigger_job(SECONDARY_JOB)
+        send_telegram_alert("🤖 Gemini (MELCHIOR-1) also triggered (multiple surges).")
+
+if __name__ == "__main__":
+    main()
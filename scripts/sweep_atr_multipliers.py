@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script sweeps the WIN/LOSE ATR multipliers used by `evaluate_trades.py`
+and `reevaluate_all_trades.py` offline, without touching the `trades` table.
+
+It pulls the evaluable columns (side, filled_avg_price, exit_price,
+atr_at_execution, llm_provider, symbol) once, optionally caching them in a
+local `.npz` file, and classifies every trade under a full grid of
+(win_multiplier, lose_multiplier) pairs with the same rules as the SQL CASE
+expression:
+
+- WIN  if the side-adjusted move >= atr_at_execution * win_multiplier
+- LOSE if the side-adjusted move <= -(atr_at_execution * lose_multiplier)
+- HOLD otherwise (including sides other than 'buy'/'sell')
+
+Each trade's move is normalised to ATR units once. Per group (overall, per
+provider, per symbol) the normalised moves are sorted, so the WIN and LOSE
+counts for every multiplier come from one `searchsorted` each, and the full
+grid is a single (win x lose) broadcast. Ten thousand combinations over the
+whole history take well under a second.
+
+Results are written as a long-format CSV (one row per group and pair), and
+the overall rates under the current pair are printed. No pair is ranked as
+"best": relabeling does not change any trade's return, so every score built
+from the label counts alone (e.g. the WIN share of decided trades) just
+grows towards a corner of the grid. Pick a pair from the CSV against the
+objective the labels feed.
+
+Prerequisites:
+- Google Cloud SDK authenticated (`gcloud auth application-default login`)
+- Required Python packages installed:
+  - pip install google-cloud-bigquery numpy
+"""
+
+import argparse
+import csv
+import os
+import numpy as np
+from google.cloud import bigquery
+
+# --- Configuration ---
+GCP_PROJECT_ID = "screen-share-459802"
+BIGQUERY_DATASET = "magi_core"
+BIGQUERY_TABLE = "trades"
+TABLE_ID = f"{GCP_PROJECT_ID}.{BIGQUERY_DATASET}.{BIGQUERY_TABLE}"
+
+# The multipliers currently used by evaluate_trades.py / reevaluate_all_trades.py.
+CURRENT_WIN_ATR_MULTIPLIER = 2.0
+CURRENT_LOSE_ATR_MULTIPLIER = 1.5
+
+
+def fetch_evaluable_trades(client: bigquery.Client) -> dict[str, np.ndarray]:
+    """Pulls the columns needed for evaluation for every evaluable trade."""
+    query = f"""
+        SELECT side, filled_avg_price, exit_price, atr_at_execution,
+               IFNULL(llm_provider, 'unknown') AS llm_provider, symbol
+        FROM `{TABLE_ID}`
+        WHERE exit_price IS NOT NULL
+          AND filled_avg_price IS NOT NULL
+          AND filled_avg_price > 0
+          AND atr_at_execution IS NOT NULL
+          AND atr_at_execution > 0
+    """
+    print(f"Fetching evaluable trades:\n{query}")
+    rows = list(client.query(query).result())
+    print(f"Fetched {len(rows)} evaluable trades.")
+    return {
+        "side": np.array([r.side or "" for r in rows], dtype=str),
+        "filled_avg_price": np.array([r.filled_avg_price for r in rows], dtype=float),
+        "exit_price": np.array([r.exit_price for r in rows], dtype=float),
+        "atr_at_execution": np.array([r.atr_at_execution for r in rows], dtype=float),
+        "llm_provider": np.array([r.llm_provider for r in rows], dtype=str),
+        "symbol": np.array([r.symbol or "" for r in rows], dtype=str),
+    }
+
+
+def normalized_moves(trades: dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Side-adjusted price move in ATR units. Sides other than buy/sell get NaN,
+    which never satisfies a WIN or LOSE comparison and so counts as HOLD.
+    """
+    move = trades["exit_price"] - trades["filled_avg_price"]
+    sign = np.select([trades["side"] == "buy", trades["side"] == "sell"], [1.0, -1.0], np.nan)
+    return sign * move / trades["atr_at_execution"]
+
+
+def classify_grid(moves: np.ndarray, win_multipliers: np.ndarray,
+                  lose_multipliers: np.ndarray) -> tuple[np.ndarray, np.ndarray, int]:
+    """
+    Counts WINs and LOSEs for every (win, lose) multiplier pair.
+
+    Returns:
+        `wins` and `loses`, both shaped (len(win_multipliers), len(lose_multipliers)),
+        and the number of trades.
+    """
+    n = len(moves)
+    ordered = np.sort(moves[~np.isnan(moves)])
+
+    # WIN: move >= w.
+    below_win = np.searchsorted(ordered, win_multipliers, side="left")
+    wins = (len(ordered) - below_win)[:, np.newaxis]
+
+    # LOSE: move <= -l, unless the trade already matched WIN (only possible
+    # when w <= -l, i.e. for non-positive multipliers).
+    at_or_below_lose = np.searchsorted(ordered, -lose_multipliers, side="right")[np.newaxis, :]
+    overlap = np.maximum(0, at_or_below_lose - below_win[:, np.newaxis])
+    loses = at_or_below_lose - overlap
+
+    return np.broadcast_to(wins, loses.shape), loses, n
+
+
+def sweep(trades: dict[str, np.ndarray], win_multipliers: np.ndarray, lose_multipliers: np.ndarray):
+    """Yields (group_type, group, wins, loses, n) for overall, each provider and each symbol."""
+    moves = normalized_moves(trades)
+    yield ("all", "all", *classify_grid(moves, win_multipliers, lose_multipliers))
+    for group_type in ("llm_provider", "symbol"):
+        keys, inverse = np.unique(trades[group_type], return_inverse=True)
+        for idx, key in enumerate(keys):
+            yield (group_type, key, *classify_grid(moves[inverse == idx], win_multipliers, lose_multipliers))
+
+
+def write_csv(path: str, results, win_multipliers: np.ndarray, lose_multipliers: np.ndarray):
+    """Writes one row per group and multiplier pair."""
+    w_grid, l_grid = np.meshgrid(win_multipliers, lose_multipliers, indexing="ij")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["group_type", "group", "win_multiplier", "lose_multiplier",
+                         "trades", "wins", "loses", "holds", "win_rate", "lose_rate", "hold_rate"])
+        for group_type, group, wins, loses, n in results:
+            holds = n - wins - loses
+            for w, l, wi, lo, ho in zip(w_grid.ravel(), l_grid.ravel(), wins.ravel(), loses.ravel(), holds.ravel()):
+                writer.writerow([group_type, group, round(float(w), 4), round(float(l), 4), n, int(wi), int(lo), int(ho),
+                                 round(wi / n, 4), round(lo / n, 4), round(ho / n, 4)])
+
+
+def parse_range(text: str) -> np.ndarray:
+    """Parses `start:stop:step` (stop inclusive) into an array of multipliers."""
+    start, stop, step = (float(x) for x in text.split(":"))
+    return np.round(np.arange(start, stop + step / 2, step), 6)
+
+
+def parse_args() -> argparse.Namespace:
+    """Parses command-line options."""
+    parser = argparse.ArgumentParser(description="Sweep WIN/LOSE ATR multipliers offline.")
+    parser.add_argument("--win-range", default="0.25:5.0:0.05", help="start:stop:step for the WIN multiplier.")
+    parser.add_argument("--lose-range", default="0.25:5.0:0.05", help="start:stop:step for the LOSE multiplier.")
+    parser.add_argument("--cache", help="Local .npz file; read if present, otherwise written after fetching.")
+    parser.add_argument("--output", default="atr_multiplier_sweep.csv", help="CSV output path.")
+    return parser.parse_args()
+
+
+def main():
+    """Main function to orchestrate the sweep."""
+    args = parse_args()
+    print("--- Starting ATR Multiplier Sweep ---")
+
+    if args.cache and os.path.exists(args.cache):
+        with np.load(args.cache) as data:
+            trades = {key: data[key] for key in data.files}
+        print(f"Loaded {len(trades['side'])} trades from {args.cache}.")
+    else:
+        try:
+            bq_client = bigquery.Client(project=GCP_PROJECT_ID)
+            print("Successfully connected to BigQuery.")
+        except Exception as e:
+            print(f"Failed to connect to BigQuery. Ensure you are authenticated. Error: {e}")
+            return
+        trades = fetch_evaluable_trades(bq_client)
+        if args.cache:
+            np.savez_compressed(args.cache, **trades)
+            print(f"Cached trades in {args.cache}.")
+
+    if len(trades["side"]) == 0:
+        print("No evaluable trades. Exiting.")
+        return
+
+    win_multipliers = parse_range(args.win_range)
+    lose_multipliers = parse_range(args.lose_range)
+    print(f"Evaluating {len(win_multipliers) * len(lose_multipliers)} multiplier pairs...")
+
+    results = list(sweep(trades, win_multipliers, lose_multipliers))
+    write_csv(args.output, results, win_multipliers, lose_multipliers)
+    print(f"Wrote {len(results)} groups to {args.output}.")
+
+    _, _, wins, loses, n = results[0]
+    w_idx = np.argmin(np.abs(win_multipliers - CURRENT_WIN_ATR_MULTIPLIER))
+    l_idx = np.argmin(np.abs(lose_multipliers - CURRENT_LOSE_ATR_MULTIPLIER))
+    print(f"\nCurrent pair ({win_multipliers[w_idx]}, {lose_multipliers[l_idx]}): "
+          f"WIN {wins[w_idx, l_idx] / n:.1%}, LOSE {loses[w_idx, l_idx] / n:.1%}, "
+          f"HOLD {(n - wins[w_idx, l_idx] - loses[w_idx, l_idx]) / n:.1%} of {n} trades")
+
+    print("\n--- ATR Multiplier Sweep Complete ---")
+
+if __name__ == "__main__":
+    main()
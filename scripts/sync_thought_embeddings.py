@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script embeds the reasoning of newly labeled (WIN/LOSE) trades and
+appends it to the `thought_embeddings` table. It replaces the row-at-a-time
+`sync_thought_embeddings.cjs` / `sync_embeddings.mjs` jobs.
+
+New thoughts are found with a high-water mark instead of an
+`id NOT IN (SELECT id FROM thought_embeddings)` anti-join: every synced row
+stores the `evaluated_at` of its trade as `source_evaluated_at`, and the next
+run only reads trades evaluated since the largest stored value. The first
+run (or `--full`) walks the whole backlog and checks only the candidate ids
+against the target table.
+
+A re-evaluated trade (`reevaluate_all_trades.py`) keeps its id but gets a
+new `evaluated_at`, so it reappears after the watermark. If its stored label
+no longer matches, one MERGE per page updates `trade_result`, `return_pct`
+and `source_evaluated_at`, or deletes the row when the trade is no longer a
+WIN or LOSE. The embedding itself is not recomputed.
+
+Candidates are read page by page, embedded through the local embedding cache
+in requests of up to 96 texts, and written with load jobs of up to
+`--load-batch` rows (one load job for a typical run) instead of one INSERT
+per row.
+
+Each embed request also returns Cohere's `int8` and `ubinary` encodings,
+which are stored as BYTES columns (`embedding_int8`: 1 byte per dimension,
+`embedding_ubinary`: 1 bit per dimension) next to the FLOAT64 array. With
+`--no-float-column` the array is left empty, cutting the stored embedding
+from 8 KB to about 1 KB per row; `similarity_index.py` reads either form.
+
+Prerequisites:
+- Google Cloud SDK authenticated (`gcloud auth application-default login`)
+- COHERE_API_KEY set as an environment variable.
+- Required Python packages installed:
+  - pip install cohere google-cloud-bigquery numpy
+"""
+
+import argparse
+import asyncio
+import base64
+from datetime import datetime, timezone
+from google.cloud import bigquery
+from embedding_cache import EmbeddingCache, embed_texts_by_type_async
+from instrumentation import count, instrument_client, instrumented, span
+
+# --- Configuration ---
+GCP_PROJECT_ID = "screen-share-459802"
+TRADES_TABLE_ID = f"{GCP_PROJECT_ID}.magi_core.trades"
+THOUGHTS_TABLE_ID = f"{GCP_PROJECT_ID}.magi_core.thoughts"
+EMBEDDINGS_TABLE_ID = f"{GCP_PROJECT_ID}.magi_analytics.thought_embeddings"
+EMBED_MODEL = "embed-multilingual-v3.0"
+EMBED_INPUT_TYPE = "search_document"
+EMBEDDING_TYPES = ("float", "int8", "ubinary")
+
+
+def ensure_sync_columns(client: bigquery.Client, table_id: str):
+    """Adds the watermark and compact embedding columns to the embeddings table if missing."""
+    client.query(f"""
+        ALTER TABLE `{table_id}`
+        ADD COLUMN IF NOT EXISTS source_evaluated_at TIMESTAMP,
+        ADD COLUMN IF NOT EXISTS embedding_int8 BYTES,
+        ADD COLUMN IF NOT EXISTS embedding_ubinary BYTES
+    """).result()
+
+
+def to_bytes_field(vector) -> str:
+    """Encodes an int8/uint8 vector for a BYTES column in a JSON load job."""
+    return base64.b64encode(vector.tobytes()).decode("ascii")
+
+
+def get_watermark(client: bigquery.Client, table_id: str) -> datetime | None:
+    """Returns the largest `source_evaluated_at` already synced."""
+    rows = list(client.query(f"SELECT MAX(source_evaluated_at) AS wm FROM `{table_id}`").result())
+    return rows[0].wm if rows else None
+
+
+def iter_candidate_pages(client: bigquery.Client, watermark: datetime | None, page_size: int):
+    """
+    Yields pages of evaluated thoughts since the watermark (all if None).
+    HOLD rows are included so that a trade re-evaluated away from WIN/LOSE
+    can be removed from the embeddings table.
+    """
+    # `>=` because one evaluation UPDATE stamps many rows with the same time and
+    # a run may have stopped part-way through them; synced ids are filtered out.
+    watermark_filter = "AND t.evaluated_at >= @watermark" if watermark else ""
+    query = f"""
+        SELECT
+          CONCAT(t.session_id, '-', t.symbol) AS id,
+          t.session_id,
+          t.symbol,
+          th.reasoning,
+          th.llm_provider,
+          th.confidence,
+          th.action,
+          t.result AS trade_result,
+          t.return_pct,
+          t.evaluated_at
+        FROM `{TRADES_TABLE_ID}` t
+        JOIN `{THOUGHTS_TABLE_ID}` th
+          ON t.session_id = th.session_id AND t.symbol = th.symbol
+        WHERE t.result IS NOT NULL
+          AND th.reasoning IS NOT NULL
+          AND LENGTH(th.reasoning) > 20
+          {watermark_filter}
+        ORDER BY t.evaluated_at
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("watermark", "TIMESTAMP", watermark)] if watermark else []
+    )
+    rows = client.query(query, job_config=job_config).result(page_size=page_size)
+    print(f"Found {rows.total_rows} candidate thoughts since {watermark or 'the beginning'}.")
+    for page in rows.pages:
+        yield list(page)
+
+
+def existing_labels(client: bigquery.Client, table_id: str, ids: list[str]) -> dict[str, tuple]:
+    """Returns `(trade_result, return_pct, source_evaluated_at)` for those of `ids` already in the table."""
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("ids", "STRING", ids)]
+    )
+    rows = client.query(
+        f"SELECT id, trade_result, return_pct, source_evaluated_at FROM `{table_id}` WHERE id IN UNNEST(@ids)",
+        job_config=job_config,
+    ).result()
+    return {row.id: (row.trade_result, row.return_pct, row.source_evaluated_at) for row in rows}
+
+
+def is_stale(row, stored: tuple) -> bool:
+    """True when a synced row's label no longer matches its trade, e.g. after a re-evaluation."""
+    trade_result, return_pct, source_evaluated_at = stored
+    if (trade_result, return_pct) != (row.trade_result, row.return_pct):
+        return True
+    return row.evaluated_at is not None and (source_evaluated_at is None or row.evaluated_at > source_evaluated_at)
+
+
+def relabel_rows(client: bigquery.Client, table_id: str, rows: list) -> int:
+    """
+    Refreshes the label of re-evaluated rows with one MERGE, deleting rows
+    whose trade is no longer a WIN or LOSE. The embeddings are kept, since
+    the reasoning they encode has not changed.
+    """
+    params = [
+        bigquery.StructQueryParameter(
+            None,
+            bigquery.ScalarQueryParameter("id", "STRING", row.id),
+            bigquery.ScalarQueryParameter("trade_result", "STRING", row.trade_result),
+            bigquery.ScalarQueryParameter("return_pct", "FLOAT64", row.return_pct),
+            bigquery.ScalarQueryParameter("evaluated_at", "TIMESTAMP", row.evaluated_at),
+        )
+        for row in rows
+    ]
+    job_config = bigquery.QueryJobConfig(query_parameters=[bigquery.ArrayQueryParameter("rows", "STRUCT", params)])
+    query_job = client.query(f"""
+        MERGE `{table_id}` T
+        USING (SELECT r.id, r.trade_result, r.return_pct, r.evaluated_at FROM UNNEST(@rows) AS r) S
+        ON T.id = S.id
+        WHEN MATCHED AND S.trade_result IN ('WIN', 'LOSE') THEN
+          UPDATE SET trade_result = S.trade_result, return_pct = S.return_pct, source_evaluated_at = S.evaluated_at
+        WHEN MATCHED THEN
+          DELETE
+    """, job_config=job_config)
+    query_job.result()
+    if query_job.errors:
+        raise RuntimeError(f"Error relabeling {len(rows)} rows of {table_id}: {query_job.errors}")
+    return query_job.num_dml_affected_rows or 0
+
+
+def load_rows(client: bigquery.Client, table_id: str, rows: list[dict]):
+    """Appends rows to the embeddings table with a single load job."""
+    job_config = bigquery.LoadJobConfig(write_disposition=bigquery.WriteDisposition.WRITE_APPEND)
+    load_job = client.load_table_from_json(rows, table_id, job_config=job_config)
+    load_job.result()
+    if load_job.errors:
+        print(f"Errors loading {len(rows)} rows: {load_job.errors}")
+    else:
+        print(f"Loaded {load_job.output_rows} rows into {table_id}.")
+
+
+async def sync(client: bigquery.Client, args: argparse.Namespace) -> int:
+    """Embeds and loads every new labeled thought; returns the number of rows written."""
+    target_columns = {field.name for field in client.get_table(args.table).schema}
+    watermark = None if args.full else get_watermark(client, args.table)
+    cache = EmbeddingCache()
+    created_at = datetime.now(timezone.utc).isoformat()
+
+    pending, written, relabeled, seen = [], 0, 0, set()
+    for page in iter_candidate_pages(client, watermark, args.page_size):
+        page = [row for row in page if row.id not in seen]
+        seen.update(row.id for row in page)
+        if not page:
+            continue
+        # Ids can already be present at the watermark boundary, on a backlog run
+        # or after a re-evaluation; the lookup only touches this page's ids.
+        present = existing_labels(client, args.table, [row.id for row in page])
+        stale = [row for row in page if row.id in present and is_stale(row, present[row.id])]
+        if stale:
+            relabeled += relabel_rows(client, args.table, stale)
+        page = [row for row in page if row.id not in present and row.trade_result in ("WIN", "LOSE")]
+        if not page:
+            continue
+
+        vectors = await embed_texts_by_type_async(
+            [row.reasoning for row in page], cache, model=EMBED_MODEL, input_type=EMBED_INPUT_TYPE,
+            embedding_types=EMBEDDING_TYPES, concurrency=args.concurrency,
+        )
+        for row, vector, int8, ubinary in zip(page, vectors["float"], vectors["int8"], vectors["ubinary"]):
+            record = {
+                "id": row.id,
+                "session_id": row.session_id,
+                "symbol": row.symbol,
+                "reasoning": row.reasoning,
+                "llm_provider": row.llm_provider,
+                "confidence": row.confidence,
+                "action": row.action,
+                "trade_result": row.trade_result,
+                "return_pct": row.return_pct,
+                "embedding": [] if args.no_float_column else vector.astype(float).tolist(),
+                "embedding_int8": to_bytes_field(int8),
+                "embedding_ubinary": to_bytes_field(ubinary),
+                "created_at": created_at,
+                "source_evaluated_at": row.evaluated_at.isoformat() if row.evaluated_at else None,
+            }
+            pending.append({k: v for k, v in record.items() if k in target_columns})
+
+        if len(pending) >= args.load_batch:
+            load_rows(client, args.table, pending)
+            written += len(pending)
+            pending = []
+
+    if pending:
+        load_rows(client, args.table, pending)
+        written += len(pending)
+    cache.close()
+    if relabeled:
+        print(f"Relabeled or removed {relabeled} re-evaluated rows.")
+    return written
+
+
+def parse_args() -> argparse.Namespace:
+    """Parses command-line options."""
+    parser = argparse.ArgumentParser(description="Embed newly labeled thoughts into thought_embeddings.")
+    parser.add_argument("--table", default=EMBEDDINGS_TABLE_ID, help="Target embeddings table.")
+    parser.add_argument("--full", action="store_true", help="Ignore the watermark and scan the whole backlog.")
+    parser.add_argument("--page-size", type=int, default=2000, help="Candidate rows per result page.")
+    parser.add_argument("--load-batch", type=int, default=5000, help="Maximum rows per load job.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent Cohere requests.")
+    parser.add_argument("--no-float-column", action="store_true",
+                        help="Store only the int8/ubinary BYTES columns, leaving the FLOAT64 array empty.")
+    return parser.parse_args()
+
+
+@instrumented
+def main():
+    """Main function to orchestrate the embedding sync."""
+    args = parse_args()
+    print("=== Sync Thought Embeddings ===")
+
+    try:
+        bq_client = instrument_client(bigquery.Client(project=GCP_PROJECT_ID))
+        print("Successfully connected to BigQuery.")
+    except Exception as e:
+        print(f"Failed to connect to BigQuery. Ensure you are authenticated. Error: {e}")
+        return
+
+    ensure_sync_columns(bq_client, args.table)
+    with span("sync_embeddings"):
+        written = asyncio.run(sync(bq_client, args))
+    count("rows_total", written, stage="thought_embeddings", kind="written")
+    print("All synced!" if written == 0 else f"\nComplete! Synced {written} thoughts.")
+
+if __name__ == "__main__":
+    main()
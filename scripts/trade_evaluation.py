@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The shared WIN/LOSE/HOLD evaluation rule used by `evaluate_trades.py` and
+`reevaluate_all_trades.py`.
+
+Besides `result` and `return_pct`, every evaluation records which rule
+produced it:
+
+- `eval_rule_version`: `EVAL_RULE_VERSION` at the time of evaluation.
+- `eval_fingerprint`: a FARM_FINGERPRINT of the rule version, the
+  multipliers and the inputs (side, exit_price, filled_avg_price,
+  atr_at_execution).
+- `evaluated_at`: when the row was last (re)evaluated. Downstream jobs use
+  it as a high-water mark to pick up newly labeled trades.
+
+A re-evaluation can then skip every row whose stored fingerprint equals the
+one it would write, so only trades whose inputs or rule changed are
+rewritten. Bump `EVAL_RULE_VERSION` whenever the CASE expression changes.
+
+Prerequisites:
+- Required Python packages installed:
+  - pip install google-cloud-bigquery
+"""
+
+from google.cloud import bigquery
+
+EVAL_RULE_VERSION = "atr-v2"
+
+# Bookkeeping columns written by every evaluation, with their BigQuery types.
+EVALUATION_COLUMNS = {
+    "eval_rule_version": "STRING",
+    "eval_fingerprint": "INT64",
+    "evaluated_at": "TIMESTAMP",
+}
+
+RESULT_SQL = """CASE
+        /* Volatility-adjusted WIN condition */
+        WHEN side = 'buy' AND (exit_price - filled_avg_price) >= (atr_at_execution * @win_multiplier) THEN 'WIN'
+        WHEN side = 'sell' AND (filled_avg_price - exit_price) >= (atr_at_execution * @win_multiplier) THEN 'WIN'
+
+        /* Volatility-adjusted LOSE condition */
+        WHEN side = 'buy' AND (exit_price - filled_avg_price) <= -(atr_at_execution * @lose_multiplier) THEN 'LOSE'
+        WHEN side = 'sell' AND (filled_avg_price - exit_price) <= -(atr_at_execution * @lose_multiplier) THEN 'LOSE'
+
+        ELSE 'HOLD'
+      END"""
+
+RETURN_PCT_SQL = "ROUND((exit_price - filled_avg_price) / filled_avg_price * 100, 2)"
+
+FINGERPRINT_SQL = """FARM_FINGERPRINT(TO_JSON_STRING(STRUCT(
+        @rule_version AS rule_version, @win_multiplier AS win_multiplier, @lose_multiplier AS lose_multiplier,
+        side, exit_price, filled_avg_price, atr_at_execution)))"""
+
+EVALUABLE_SQL = """exit_price IS NOT NULL
+      AND filled_avg_price IS NOT NULL
+      AND filled_avg_price > 0
+      AND atr_at_execution IS NOT NULL
+      AND atr_at_execution > 0"""
+
+SET_EVALUATION_SQL = f"""result = {RESULT_SQL},
+      return_pct = {RETURN_PCT_SQL},
+      eval_rule_version = @rule_version,
+      eval_fingerprint = {FINGERPRINT_SQL},
+      evaluated_at = CURRENT_TIMESTAMP()"""
+
+
+def evaluation_parameters(win_multiplier: float, lose_multiplier: float) -> list:
+    """Query parameters referenced by the SQL fragments above."""
+    return [
+        bigquery.ScalarQueryParameter("win_multiplier", "FLOAT64", win_multiplier),
+        bigquery.ScalarQueryParameter("lose_multiplier", "FLOAT64", lose_multiplier),
+        bigquery.ScalarQueryParameter("rule_version", "STRING", EVAL_RULE_VERSION),
+    ]
+
+
+def ensure_evaluation_columns(client: bigquery.Client, table_id: str):
+    """Adds the evaluation bookkeeping columns if the table does not have them yet."""
+    additions = ",\n        ".join(f"ADD COLUMN IF NOT EXISTS {name} {type_}"
+                                   for name, type_ in EVALUATION_COLUMNS.items())
+    query = f"""
+        ALTER TABLE `{table_id}`
+        {additions}
+    """
+    client.query(query).result()
+
+
+def missing_evaluation_columns(client: bigquery.Client, table_id: str) -> list[str]:
+    """The evaluation bookkeeping columns the table lacks, without altering it."""
+    present = {field.name for field in client.get_table(table_id).schema}
+    return [name for name in EVALUATION_COLUMNS if name not in present]
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script stores the market state each trade was decided in as one row of
+`magi_analytics.trade_features`:
+
+- The `get_price_history` indicators as the agent was shown them:
+  `sma5`, `sma20`, `rsi14`, `atr14`, `change_1d`, `change_5d`,
+  `change_20d`, `avg_volume`, `volume_ratio` and the SMA5/SMA20 trend.
+- The `detectVolumeSpike` signal: `spike_direction` and `spike_strength`,
+  both NULL without a spike.
+- The `detectMomentum` signal: `momentum_direction`, `momentum_strength`,
+  the additive `momentum_score` and `momentum_signals`, a bitmask with bit
+  i set when `MOMENTUM_SIGNALS[i]` fired.
+
+Features are point-in-time. They are computed from the 20 daily bars that
+closed before the trade's UTC date, so no price after the decision leaks in.
+Values are rounded with `toFixed` exactly like the agent's strings, and the
+detectors apply the JS thresholds to those rounded values.
+
+Every trade of a symbol is computed from one bar range read from the local
+`bar_store.BarStore`, with one vectorized pass over the symbol's history.
+By default only trades without features for the current `FEATURE_VERSION`
+are processed and appended; `--full` recomputes every trade and replaces the
+table. Both paths write with a single load job, never with DML.
+
+Prerequisites:
+- Google Cloud SDK authenticated (`gcloud auth application-default login`)
+- Alpaca API credentials set as environment variables.
+- Required Python packages installed:
+  - pip install alpaca-trade-api google-cloud-bigquery numpy
+"""
+
+import argparse
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+import alpaca_trade_api as tradeapi
+from google.cloud import bigquery
+import numpy as np
+from alpaca_client import DEFAULT_MAX_CONCURRENCY
+from bar_store import DEFAULT_STORE_DIR, BarStore
+from indicators import compute_indicators, js_to_fixed
+from instrumentation import count, instrument_client, instrumented, span
+from label_horizons import prefetch_bars
+
+# --- Configuration ---
+GCP_PROJECT_ID = "screen-share-459802"
+TRADES_TABLE_ID = f"{GCP_PROJECT_ID}.magi_core.trades"
+FEATURES_TABLE_ID = f"{GCP_PROJECT_ID}.magi_analytics.trade_features"
+ALPACA_API_BASE_URL = "https://paper-api.alpaca.markets"
+FEATURE_VERSION = "js-v1"
+# Calendar days of bars read before a trade; covers 20 trading days plus holidays.
+FEATURE_LOOKBACK_DAYS = 45
+
+# `detectVolumeSpike` / `detectMomentum` thresholds.
+SPIKE_RATIO = 3.0
+SPIKE_STRONG_RATIO = 4.0
+SPIKE_EXTREME_RATIO = 5.0
+MOMENTUM_SIGNALS = ("dailyMove", "weeklyTrend", "overboughtRsi", "oversoldRsi", "smaDivergence")
+MOMENTUM_WEIGHTS = np.array([2, 1, 1, 1, 1])
+
+FEATURE_SCHEMA = [
+    bigquery.SchemaField("session_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("symbol", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("trade_timestamp", "TIMESTAMP"),
+    bigquery.SchemaField("asof_date", "DATE"),
+    bigquery.SchemaField("sma5", "FLOAT64"),
+    bigquery.SchemaField("sma20", "FLOAT64"),
+    bigquery.SchemaField("rsi14", "INT64"),
+    bigquery.SchemaField("atr14", "FLOAT64"),
+    bigquery.SchemaField("change_1d", "FLOAT64"),
+    bigquery.SchemaField("change_5d", "FLOAT64"),
+    bigquery.SchemaField("change_20d", "FLOAT64"),
+    bigquery.SchemaField("avg_volume", "INT64"),
+    bigquery.SchemaField("volume_ratio", "FLOAT64"),
+    bigquery.SchemaField("trend", "STRING"),
+    bigquery.SchemaField("spike_direction", "STRING"),
+    bigquery.SchemaField("spike_strength", "STRING"),
+    bigquery.SchemaField("momentum_direction", "STRING"),
+    bigquery.SchemaField("momentum_strength", "STRING"),
+    bigquery.SchemaField("momentum_score", "INT64"),
+    bigquery.SchemaField("momentum_signals", "INT64"),
+    bigquery.SchemaField("feature_version", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("computed_at", "TIMESTAMP", mode="REQUIRED"),
+]
+CLUSTER_FIELDS = ["symbol", "session_id"]
+
+
+def detect_volume_spike(volume_ratio: np.ndarray, change_1d: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    `detectVolumeSpike` applied to the agent's rounded `volume_ratio` and
+    `change_1d`.
+
+    Returns:
+        Object arrays of the spike direction and strength, None without a spike.
+    """
+    spike = volume_ratio >= SPIKE_RATIO
+    # parseFloat of a missing change is NaN, which is neither > 0 nor < 0.
+    direction = np.select([change_1d > 0, change_1d < 0], ["BULLISH", "BEARISH"], "NEUTRAL").astype(object)
+    strength = np.select(
+        [volume_ratio >= SPIKE_EXTREME_RATIO, volume_ratio >= SPIKE_STRONG_RATIO], ["EXTREME", "STRONG"], "MODERATE"
+    ).astype(object)
+    direction[~spike] = None
+    strength[~spike] = None
+    return direction, strength
+
+
+def detect_momentum(change_1d: np.ndarray, change_5d: np.ndarray, rsi14: np.ndarray,
+                    sma5: np.ndarray, sma20: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    `detectMomentum` applied to the agent's inputs: rounded changes, the
+    integer RSI and the unrounded SMAs.
+
+    Returns:
+        `signals` (bitmask over MOMENTUM_SIGNALS), `score`, and object
+        arrays `direction` and `strength` (None where nothing fired).
+    """
+    # `parseFloat(x) || default` maps NaN and 0 to the default.
+    daily = np.where(np.isnan(change_1d), 0.0, change_1d)
+    weekly = np.where(np.isnan(change_5d), 0.0, change_5d)
+    rsi = np.where(np.isnan(rsi14) | (rsi14 == 0), 50.0, rsi14)
+
+    has_smas = ~np.isnan(sma5) & ~np.isnan(sma20) & (sma5 != 0) & (sma20 != 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cross = js_to_fixed(np.where(has_smas, (sma5 - sma20) / sma20 * 100, np.nan), 2)
+
+    fired = np.stack([
+        np.abs(daily) >= 2.0,
+        np.abs(weekly) >= 5.0,
+        rsi >= 70,
+        rsi <= 30,
+        has_smas & (np.abs(cross) >= 2),
+    ], axis=-1)
+    signals = fired @ (1 << np.arange(len(MOMENTUM_SIGNALS)))
+    score = fired @ MOMENTUM_WEIGHTS
+    any_signal = signals > 0
+
+    direction = np.where(daily >= 0, "BULLISH", "BEARISH").astype(object)
+    strength = np.select([score >= 4, score >= 3], ["EXTREME", "STRONG"], "MODERATE").astype(object)
+    direction[~any_signal] = None
+    strength[~any_signal] = None
+    return {"signals": signals, "score": score, "direction": direction, "strength": strength}
+
+
+def compute_features(bars: np.ndarray, trade_dates: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Features of one symbol as of each trade date.
+
+    Args:
+        bars: The symbol's daily bars (see `bar_store.BAR_DTYPE`), sorted
+            and non-empty.
+        trade_dates: `datetime64[D]` UTC dates of the trades.
+
+    Returns:
+        Per-trade arrays keyed like the table columns, plus `asof_idx`
+        (-1 where no bar precedes the trade).
+    """
+    high, low, close, volume = (np.asarray(bars[f], dtype=float) for f in ("high", "low", "close", "volume"))
+    ind = compute_indicators(high, low, close, volume)
+
+    asof_idx = np.searchsorted(bars["date"], trade_dates, side="left") - 1
+    valid = asof_idx >= 0
+    safe = np.where(valid, asof_idx, 0)
+
+    def at(values: np.ndarray) -> np.ndarray:
+        return np.where(valid, values[safe], np.nan)
+
+    raw_sma5, raw_sma20 = at(ind["sma5"]), at(ind["sma20"])
+    features = {
+        "asof_idx": np.where(valid, asof_idx, -1),
+        "sma5": js_to_fixed(raw_sma5, 2),
+        "sma20": js_to_fixed(raw_sma20, 2),
+        "rsi14": at(ind["rsi14"]),
+        "atr14": js_to_fixed(at(ind["atr14"]), 4),
+        "change_1d": js_to_fixed(at(ind["change_1d"]), 2),
+        "change_5d": js_to_fixed(at(ind["change_5d"]), 2),
+        "change_20d": js_to_fixed(at(ind["change_20d"]), 2),
+        "avg_volume": at(ind["avg_volume"]),
+        "volume_ratio": js_to_fixed(at(ind["volume_ratio"]), 2),
+    }
+    bullish = at(ind["bullish"])
+    features["trend"] = np.select([bullish == 1, bullish == 0], ["BULLISH", "BEARISH"], "").astype(object)
+    features["trend"][np.isnan(bullish)] = None
+
+    features["spike_direction"], features["spike_strength"] = detect_volume_spike(
+        features["volume_ratio"], features["change_1d"]
+    )
+    momentum = detect_momentum(features["change_1d"], features["change_5d"], features["rsi14"], raw_sma5, raw_sma20)
+    features["momentum_signals"] = momentum["signals"]
+    features["momentum_score"] = momentum["score"]
+    features["momentum_direction"] = momentum["direction"]
+    features["momentum_strength"] = momentum["strength"]
+    return features
+
+
+def _float(value) -> float | None:
+    return None if np.isnan(value) or np.isinf(value) else float(value)
+
+
+def _int(value) -> int | None:
+    return None if np.isnan(value) or np.isinf(value) else int(value)
+
+
+def feature_rows(symbol: str, bars: np.ndarray, trades: list, features: dict[str, np.ndarray],
+                 computed_at: str) -> list[dict]:
+    """Turns `compute_features` output into table rows, one per trade."""
+    rows = []
+    for i, trade in enumerate(trades):
+        idx = features["asof_idx"][i]
+        rows.append({
+            "session_id": trade.session_id,
+            "symbol": symbol,
+            "trade_timestamp": trade.timestamp.isoformat(),
+            "asof_date": str(bars["date"][idx]) if idx >= 0 else None,
+            **{k: _float(features[k][i]) for k in (
+                "sma5", "sma20", "atr14", "change_1d", "change_5d", "change_20d", "volume_ratio")},
+            "rsi14": _int(features["rsi14"][i]),
+            "avg_volume": _int(features["avg_volume"][i]),
+            **{k: features[k][i] for k in (
+                "trend", "spike_direction", "spike_strength", "momentum_direction", "momentum_strength")},
+            "momentum_score": int(features["momentum_score"][i]),
+            "momentum_signals": int(features["momentum_signals"][i]),
+            "feature_version": FEATURE_VERSION,
+            "computed_at": computed_at,
+        })
+    return rows
+
+
+def iter_trades_needing_features(client: bigquery.Client, full: bool, page_size: int = 50000,
+                                 table_id: str = FEATURES_TABLE_ID):
+    """Yields trades without features for the current version (every trade if `full`)."""
+    params = [bigquery.ScalarQueryParameter("version", "STRING", FEATURE_VERSION)]
+    if full:
+        query = f"""
+            SELECT session_id, symbol, timestamp FROM `{TRADES_TABLE_ID}`
+            WHERE symbol IS NOT NULL AND timestamp IS NOT NULL
+        """
+    else:
+        query = f"""
+            SELECT t.session_id, t.symbol, t.timestamp
+            FROM `{TRADES_TABLE_ID}` t
+            LEFT JOIN (
+              SELECT session_id, symbol FROM `{table_id}` WHERE feature_version = @version
+            ) f ON f.session_id = t.session_id AND f.symbol = t.symbol
+            WHERE f.session_id IS NULL AND t.symbol IS NOT NULL AND t.timestamp IS NOT NULL
+        """
+    rows = client.query(query, job_config=bigquery.QueryJobConfig(query_parameters=params)).result(
+        page_size=page_size
+    )
+    print(f"Found {rows.total_rows} trades needing features.")
+    for page in rows.pages:
+        yield from page
+
+
+def ensure_features_table(client: bigquery.Client, table_id: str = FEATURES_TABLE_ID):
+    """Creates the feature table if missing, so the incremental anti-join can run."""
+    table = bigquery.Table(table_id, schema=FEATURE_SCHEMA)
+    table.clustering_fields = CLUSTER_FIELDS
+    client.create_table(table, exists_ok=True)
+
+
+def symbol_bar_range(trades: list) -> tuple[date, date]:
+    """Calendar range of bars covering the feature window of every trade."""
+    dates = [trade.timestamp.astimezone(timezone.utc).date() for trade in trades]
+    return min(dates) - timedelta(days=FEATURE_LOOKBACK_DAYS), max(dates)
+
+
+def compute_all(store: BarStore, trades_by_symbol: dict[str, list], concurrency: int = 0) -> list[dict]:
+    """Computes feature rows for every trade, one bar range per symbol."""
+    ranges = {symbol: symbol_bar_range(trades) for symbol, trades in trades_by_symbol.items()}
+    if concurrency > 0:
+        try:
+            fetched = asyncio.run(prefetch_bars(store, ranges, concurrency))
+            print(f"Prefetched {fetched} bar ranges with up to {concurrency} concurrent requests.")
+        except Exception as e:
+            print(f"Concurrent prefetch failed, falling back to sequential fetches: {e}")
+
+    computed_at = datetime.now(timezone.utc).isoformat()
+    rows = []
+    for symbol, trades in trades_by_symbol.items():
+        try:
+            bars = store.get_bars(symbol, *ranges[symbol])
+        except Exception as e:
+            print(f"  - Could not read bars for {symbol}: {e}")
+            continue
+        if len(bars) == 0:
+            print(f"  - No bars for {symbol}; skipping {len(trades)} trades.")
+            continue
+        trade_dates = np.array([t.timestamp.astimezone(timezone.utc).date() for t in trades], dtype="datetime64[D]")
+        rows.extend(feature_rows(symbol, bars, trades, compute_features(bars, trade_dates), computed_at))
+    print(f"Bar store made {store.api_calls} Alpaca requests for {len(trades_by_symbol)} symbols.")
+    return rows
+
+
+def write_features(client: bigquery.Client, rows: list[dict], full: bool, table_id: str = FEATURES_TABLE_ID):
+    """Writes rows with one load job, replacing the table on a full run."""
+    job_config = bigquery.LoadJobConfig(
+        schema=FEATURE_SCHEMA,
+        clustering_fields=CLUSTER_FIELDS,
+        write_disposition=(bigquery.WriteDisposition.WRITE_TRUNCATE if full
+                           else bigquery.WriteDisposition.WRITE_APPEND),
+    )
+    load_job = client.load_table_from_json(rows, table_id, job_config=job_config)
+    load_job.result()
+    if load_job.errors:
+        print(f"Errors loading features: {load_job.errors}")
+    else:
+        print(f"Stored {load_job.output_rows} feature rows in {table_id}.")
+
+
+def parse_args() -> argparse.Namespace:
+    """Parses command-line options."""
+    parser = argparse.ArgumentParser(description="Store point-in-time market features for every trade.")
+    parser.add_argument("--full", action="store_true", help="Recompute every trade and replace the table.")
+    parser.add_argument(
+        "--bar-store",
+        default=DEFAULT_STORE_DIR,
+        help="Directory of the local daily-bar store (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_MAX_CONCURRENCY,
+        help="Concurrent Alpaca requests when prefetching bars; 0 disables prefetching.",
+    )
+    parser.add_argument("--page-size", type=int, default=50000, help="BigQuery rows per result page.")
+    return parser.parse_args()
+
+
+@instrumented
+def main():
+    """Main function to orchestrate the feature backfill."""
+    args = parse_args()
+    print("=== Trade Feature Snapshot ===")
+
+    try:
+        alpaca_api = tradeapi.REST(base_url=ALPACA_API_BASE_URL)
+        bq_client = instrument_client(bigquery.Client(project=GCP_PROJECT_ID))
+        print("Successfully connected to Alpaca and BigQuery.")
+    except Exception as e:
+        print(f"Failed to initialize clients. Error: {e}")
+        return
+
+    ensure_features_table(bq_client)
+    trades_by_symbol: dict[str, list] = {}
+    for trade in iter_trades_needing_features(bq_client, args.full, args.page_size):
+        trades_by_symbol.setdefault(trade.symbol, []).append(trade)
+    if not trades_by_symbol:
+        print("All trades already have features. Exiting.")
+        return
+
+    with span("compute_features", symbols=len(trades_by_symbol)):
+        rows = compute_all(BarStore(alpaca_api, args.bar_store), trades_by_symbol, args.concurrency)
+    count("rows_total", len(rows), stage="trade_features", kind="computed")
+    if rows:
+        with span("write_features", rows=len(rows)):
+            write_features(bq_client, rows, args.full)
+    print(f"\nComplete! Computed features for {len(rows)} trades.")
+
+if __name__ == "__main__":
+    main()
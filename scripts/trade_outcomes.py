@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This script maintains `magi_analytics.trade_outcomes_daily`. The table holds
+evaluated-trade statistics per llm_provider x side x symbol x UTC trade
+date:
+
+- `trades`, `wins`, `loses`, `holds`: evaluated trades and their results.
+- `return_pct_sum`, `win_return_pct_sum`, `lose_return_pct_sum`: sums of
+  the evaluated `return_pct`.
+- `win_pnl_sum`, `lose_pnl_sum`: sums of (exit_price - filled_avg_price) * qty
+  over WIN and LOSE trades, the profit/loss of `getRealtimeFeedback`.
+- `win_confidence_sum` / `win_confidence_count` and the LOSE equivalents:
+  the confidence the unit logged for the traded symbol in the trade's
+  session, averaged over its thoughts.
+- `last_evaluated_at`: the newest `evaluated_at` folded into the row.
+
+`evaluate_trades.py` is the only place where new results appear, so after
+its UPDATE it calls `apply_new_outcomes`. One MERGE adds the counts of every
+trade evaluated after the table's high-water mark (the largest
+`last_evaluated_at`). Counts and high-water mark move in the same statement.
+Only an empty table is rebuilt: legacy trades evaluated before `evaluated_at`
+existed leave the high-water mark NULL, and the next run then adds every
+trade that has an `evaluated_at`.
+A run that fails between the UPDATE and the MERGE is caught up by the next
+one, and rerunning it adds nothing twice.
+
+Re-evaluation changes existing results rather than adding new ones, so
+`reevaluate_all_trades.py` calls `rebuild_outcomes` instead. That, like the
+first run on an empty table, recomputes the table from every evaluated trade
+in a single MERGE that overwrites matching rows, inserts new ones and deletes
+stale ones, so the agent never reads a half-rebuilt table.
+
+`getIsabelStats` and `getRealtimeFeedback` in `magi-core.js` and
+`isabel_artifact.py` read these few hundred rows instead of grouping over
+`trades` on every start. `magi-core.js` falls back to the live `trades`
+queries while the table is missing or empty, and `isabel_artifact.py`
+builds it before computing the artifact.
+
+Prerequisites:
+- Google Cloud SDK authenticated (`gcloud auth application-default login`)
+- Required Python packages installed:
+  - pip install google-cloud-bigquery
+"""
+
+import argparse
+from datetime import datetime, timezone
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery
+from instrumentation import instrument_client, instrumented, span
+
+# --- Configuration ---
+GCP_PROJECT_ID = "screen-share-459802"
+TRADES_TABLE_ID = f"{GCP_PROJECT_ID}.magi_core.trades"
+THOUGHTS_TABLE_ID = f"{GCP_PROJECT_ID}.magi_core.thoughts"
+OUTCOMES_TABLE_ID = f"{GCP_PROJECT_ID}.magi_analytics.trade_outcomes_daily"
+# Watermark of a table holding only trades evaluated before `evaluated_at` existed.
+LEGACY_WATERMARK = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+KEY_COLUMNS = ["llm_provider", "side", "symbol", "trade_date"]
+SUM_COLUMNS = [
+    "trades", "wins", "loses", "holds",
+    "return_pct_sum", "win_return_pct_sum", "lose_return_pct_sum",
+    "win_pnl_sum", "lose_pnl_sum",
+    "win_confidence_sum", "win_confidence_count", "lose_confidence_sum", "lose_confidence_count",
+]
+
+
+def ensure_outcomes_table(client: bigquery.Client, table_id: str = OUTCOMES_TABLE_ID):
+    """Creates the aggregate table if missing."""
+    client.query(f"""
+        CREATE TABLE IF NOT EXISTS `{table_id}` (
+          llm_provider STRING,
+          side STRING,
+          symbol STRING,
+          trade_date DATE,
+          trades INT64 NOT NULL,
+          wins INT64 NOT NULL,
+          loses INT64 NOT NULL,
+          holds INT64 NOT NULL,
+          return_pct_sum FLOAT64 NOT NULL,
+          win_return_pct_sum FLOAT64 NOT NULL,
+          lose_return_pct_sum FLOAT64 NOT NULL,
+          win_pnl_sum FLOAT64 NOT NULL,
+          lose_pnl_sum FLOAT64 NOT NULL,
+          win_confidence_sum FLOAT64 NOT NULL,
+          win_confidence_count INT64 NOT NULL,
+          lose_confidence_sum FLOAT64 NOT NULL,
+          lose_confidence_count INT64 NOT NULL,
+          last_evaluated_at TIMESTAMP,
+          updated_at TIMESTAMP NOT NULL
+        )
+    """).result()
+
+
+def outcomes_table_exists(client: bigquery.Client, table_id: str = OUTCOMES_TABLE_ID) -> bool:
+    """Whether the aggregate table exists, without creating it."""
+    try:
+        client.get_table(table_id)
+    except NotFound:
+        return False
+    return True
+
+
+def get_watermark(client: bigquery.Client, table_id: str = OUTCOMES_TABLE_ID) -> tuple[int, datetime | None]:
+    """
+    The table's row count and the newest `evaluated_at` already folded into
+    it. The latter is None when the table is empty, or when it holds only
+    legacy trades evaluated before `evaluated_at` existed.
+    """
+    rows = list(client.query(f"SELECT COUNT(*) AS n, MAX(last_evaluated_at) AS wm FROM `{table_id}`").result())
+    return (rows[0].n, rows[0].wm) if rows else (0, None)
+
+
+def _confidence_sql(client: bigquery.Client, thoughts_table_id: str) -> str:
+    """Per (session_id, symbol) average confidence, or an empty relation without a thoughts table."""
+    try:
+        client.get_table(thoughts_table_id)
+    except NotFound:
+        print(f"  - {thoughts_table_id} not found; confidence sums stay 0.")
+        return "SELECT CAST(NULL AS STRING) AS session_id, CAST(NULL AS STRING) AS symbol, " \
+               "CAST(NULL AS FLOAT64) AS confidence LIMIT 0"
+    return f"""
+        SELECT session_id, symbol, AVG(confidence) AS confidence
+        FROM `{thoughts_table_id}`
+        WHERE confidence IS NOT NULL AND session_id IN (SELECT session_id FROM delta)
+        GROUP BY session_id, symbol"""
+
+
+def merge_outcomes(client: bigquery.Client, watermark=None, trades_table_id: str = TRADES_TABLE_ID,
+                   thoughts_table_id: str = THOUGHTS_TABLE_ID, table_id: str = OUTCOMES_TABLE_ID,
+                   replace: bool = False) -> int:
+    """
+    Adds every trade evaluated after `watermark` (every evaluated trade when
+    None) to the aggregate rows with one MERGE.
+
+    With `replace`, the aggregates of every evaluated trade overwrite the
+    rows instead, and rows no trade maps to any more are deleted, so the
+    whole table is recomputed in that one statement.
+
+    Returns:
+        The number of aggregate rows inserted, updated or deleted.
+    """
+    if replace and watermark is not None:
+        raise ValueError("replace recomputes every row and takes no watermark")
+    key_match = " AND ".join(f"T.{c} IS NOT DISTINCT FROM S.{c}" for c in KEY_COLUMNS)
+    if replace:
+        set_sums = ",\n            ".join(f"{c} = S.{c}" for c in SUM_COLUMNS)
+        set_watermark = "S.last_evaluated_at"
+        delete_stale = "\n        WHEN NOT MATCHED BY SOURCE THEN\n          DELETE"
+    else:
+        set_sums = ",\n            ".join(f"{c} = T.{c} + S.{c}" for c in SUM_COLUMNS)
+        set_watermark = """CASE
+              WHEN T.last_evaluated_at IS NULL OR S.last_evaluated_at > T.last_evaluated_at THEN S.last_evaluated_at
+              ELSE T.last_evaluated_at END"""
+        delete_stale = ""
+    columns = KEY_COLUMNS + SUM_COLUMNS + ["last_evaluated_at", "updated_at"]
+    values = [f"S.{c}" for c in KEY_COLUMNS + SUM_COLUMNS] + ["S.last_evaluated_at", "CURRENT_TIMESTAMP()"]
+    query = f"""
+        MERGE `{table_id}` T
+        USING (
+          WITH delta AS (
+            SELECT session_id, llm_provider, side, symbol, DATE(timestamp) AS trade_date,
+              result, return_pct, (exit_price - filled_avg_price) * qty AS pnl, evaluated_at
+            FROM `{trades_table_id}`
+            WHERE result IS NOT NULL AND (@watermark IS NULL OR evaluated_at > @watermark)
+          ),
+          confidence AS ({_confidence_sql(client, thoughts_table_id)}
+          )
+          SELECT d.llm_provider, d.side, d.symbol, d.trade_date,
+            COUNT(*) AS trades,
+            COUNTIF(d.result = 'WIN') AS wins,
+            COUNTIF(d.result = 'LOSE') AS loses,
+            COUNTIF(d.result = 'HOLD') AS holds,
+            COALESCE(SUM(d.return_pct), 0) AS return_pct_sum,
+            COALESCE(SUM(CASE WHEN d.result = 'WIN' THEN d.return_pct END), 0) AS win_return_pct_sum,
+            COALESCE(SUM(CASE WHEN d.result = 'LOSE' THEN d.return_pct END), 0) AS lose_return_pct_sum,
+            COALESCE(SUM(CASE WHEN d.result = 'WIN' THEN d.pnl END), 0) AS win_pnl_sum,
+            COALESCE(SUM(CASE WHEN d.result = 'LOSE' THEN d.pnl END), 0) AS lose_pnl_sum,
+            COALESCE(SUM(CASE WHEN d.result = 'WIN' THEN c.confidence END), 0) AS win_confidence_sum,
+            COUNTIF(d.result = 'WIN' AND c.confidence IS NOT NULL) AS win_confidence_count,
+            COALESCE(SUM(CASE WHEN d.result = 'LOSE' THEN c.confidence END), 0) AS lose_confidence_sum,
+            COUNTIF(d.result = 'LOSE' AND c.confidence IS NOT NULL) AS lose_confidence_count,
+            MAX(d.evaluated_at) AS last_evaluated_at
+          FROM delta d
+          LEFT JOIN confidence c ON c.session_id = d.session_id AND c.symbol = d.symbol
+          GROUP BY d.llm_provider, d.side, d.symbol, d.trade_date
+        ) S
+        ON {key_match}
+        WHEN MATCHED THEN
+          UPDATE SET
+            {set_sums},
+            last_evaluated_at = {set_watermark},
+            updated_at = CURRENT_TIMESTAMP()
+        WHEN NOT MATCHED THEN
+          INSERT ({", ".join(columns)})
+          VALUES ({", ".join(values)}){delete_stale}
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("watermark", "TIMESTAMP", watermark)]
+    )
+    job = client.query(query, job_config=job_config)
+    job.result()
+    return job.num_dml_affected_rows or 0
+
+
+def rebuild_outcomes(client: bigquery.Client, trades_table_id: str = TRADES_TABLE_ID,
+                     thoughts_table_id: str = THOUGHTS_TABLE_ID, table_id: str = OUTCOMES_TABLE_ID) -> int:
+    """
+    Recomputes the table from every evaluated trade in one MERGE, so readers
+    see either the old or the new aggregates, never an empty or partial table.
+    """
+    with span("outcomes.rebuild"):
+        rows = merge_outcomes(client, None, trades_table_id, thoughts_table_id, table_id, replace=True)
+    print(f"Rebuilt {table_id}: {rows} aggregate rows.")
+    return rows
+
+
+def apply_new_outcomes(client: bigquery.Client, trades_table_id: str = TRADES_TABLE_ID,
+                       thoughts_table_id: str = THOUGHTS_TABLE_ID, table_id: str = OUTCOMES_TABLE_ID) -> int:
+    """Folds the trades evaluated since the last call into the table; rebuilds an empty table."""
+    rows, watermark = get_watermark(client, table_id)
+    if not rows:
+        return rebuild_outcomes(client, trades_table_id, thoughts_table_id, table_id)
+    # Rows without a high-water mark only hold legacy trades with a NULL
+    # evaluated_at; every trade with one is new.
+    watermark = watermark or LEGACY_WATERMARK
+    with span("outcomes.apply"):
+        rows = merge_outcomes(client, watermark, trades_table_id, thoughts_table_id, table_id)
+    print(f"Applied newly evaluated trades after {watermark.isoformat()} to {rows} aggregate rows.")
+    return rows
+
+
+def parse_args() -> argparse.Namespace:
+    """Parses command-line options."""
+    parser = argparse.ArgumentParser(description="Maintain the per-day trade outcome aggregates.")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute the table from every evaluated trade.")
+    return parser.parse_args()
+
+
+@instrumented
+def main():
+    """Main function to update the outcome aggregates."""
+    args = parse_args()
+    try:
+        bq_client = instrument_client(bigquery.Client(project=GCP_PROJECT_ID))
+        print("Successfully connected to BigQuery.")
+    except Exception as e:
+        print(f"Failed to connect to BigQuery. Ensure you are authenticated. Error: {e}")
+        return
+
+    ensure_outcomes_table(bq_client)
+    if args.rebuild:
+        rebuild_outcomes(bq_client)
+    else:
+        apply_new_outcomes(bq_client)
+
+if __name__ == "__main__":
+    main()
@@ -18,7 +18,24 @@
 This script synchronizes closed Alpaca orders with a BigQuery table.
 It fetches recently closed 'sell' orders from Alpaca, and updates the 
 corresponding 'exit_price' in the BigQuery 'trades' table using the actual 
-filled average price from the order.
+filled average price from the order. All exit prices of a run are applied
+with a single MERGE (see `bq_writeback.py`) rather than one UPDATE per order.
+
+By default only the first page of orders from the last 7 days is read. With
+`--sync` the script instead pages through the complete closed-order history
+in ascending `submitted_at` order, bounded by `after`/`until` cursors, and
+processes each page as it arrives:
+
+- A watermark file records how far the history has been processed, so the
+  next run starts there and only reads new orders.
+- An order still open during a run may close later with a submitted_at
+  behind the watermark. The watermark file therefore also lists the ids of
+  the open orders, and the next run fetches only those of them that have
+  closed since. A long-lived open order (e.g. GTC) thus costs one id in the
+  file, not a re-read of every closed order after it.
+- Staged exit prices are flushed in batches. Each flush checks all of its
+  trades with one set-based lookup, and trades that already have an
+  exit_price (or do not exist) are skipped without any DML.
 
 This ensures the analytical data in BigQuery is accurate, reflecting the
 true execution prices rather than estimated market prices.
@@ -32,11 +49,15 @@ Prerequisites:
   - pip install alpaca-trade-api google-cloud-bigquery
 """
 
+import argparse
+import json
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import alpaca_trade_api as tradeapi
 from alpaca_trade_api.entity import Order
 from google.cloud import bigquery
+from bq_writeback import OUTCOME_UPDATED, ColumnWriteBack, log_outcomes
+from instrumentation import api_call, count, instrument_client, instrumented, span
 
 # --- Configuration ---
 GCP_PROJECT_ID = "screen-share-459802"
@@ -48,6 +69,12 @@ TABLE_ID = f"{GCP_PROJECT_ID}.{BIGQUERY_DATASET}.{BIGQUERY_TABLE}"
 # APCA_API_KEY_ID and APCA_API_SECRET_KEY
 ALPACA_API_BASE_URL = "https://paper-api.alpaca.markets" # Use paper trading endpoint
 
+DEFAULT_WATERMARK_PATH = os.path.join(os.path.expanduser("~"), ".cache", "magi", "update_exit_prices.watermark.json")
+# Where a first --sync run starts when no watermark exists yet.
+SYNC_EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+# Maximum page size accepted by the Alpaca orders endpoint.
+MAX_ORDERS_PAGE = 500
+
 def get_recently_closed_orders(api: tradeapi.REST, limit: int = 100) -> list[Order]:
     """
     Fetches the most recent closed orders from Alpaca.
@@ -63,56 +90,175 @@ def get_recently_closed_orders(api: tradeapi.REST, limit: int = 100) -> list[Ord
         # Fetch orders from the last 7 days, descending order
         after_date = (datetime.now() - timedelta(days=7)).isoformat()
         
-        closed_orders = api.list_orders(
-            status='closed',
-            limit=limit,
-            after=after_date,
-            direction='desc' # Most recent first
-        )
+        with api_call("alpaca", "orders"):
+            closed_orders = api.list_orders(
+                status='closed',
+                limit=limit,
+                after=after_date,
+                direction='desc' # Most recent first
+            )
         print(f"Fetched {len(closed_orders)} recently closed orders from Alpaca.")
         return closed_orders
     except Exception as e:
         print(f"Could not fetch closed orders from Alpaca: {e}")
         return []
 
-def update_trade_exit_price(client: bigquery.Client, session_id: str, symbol: str, price: float):
+def _read_watermark_file(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def load_watermark(path: str) -> datetime | None:
+    """Reads the submitted_at up to which closed orders have been processed."""
+    submitted_at = _read_watermark_file(path).get("submitted_at")
+    return datetime.fromisoformat(submitted_at) if submitted_at else None
+
+def load_open_order_ids(path: str) -> set[str]:
+    """Reads the ids of the orders that were still open when the watermark was saved."""
+    return set(_read_watermark_file(path).get("open_order_ids", []))
+
+def save_watermark(path: str, submitted_at: datetime, open_order_ids=()):
+    """Atomically records the new watermark and the open orders to re-check."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"submitted_at": submitted_at.isoformat(), "open_order_ids": sorted(open_order_ids)}, f)
+    os.replace(tmp_path, path)
+
+def _submitted_at(order: Order) -> datetime:
+    """The order's submission time as an aware datetime (the SDK returns a pandas Timestamp)."""
+    return order.submitted_at.to_pydatetime(warn=False)
+
+def iter_order_pages(api: tradeapi.REST, after: datetime, until: datetime,
+                     page_size: int = MAX_ORDERS_PAGE, status: str = 'closed'):
     """
-    Updates the exit_price for a specific trade in BigQuery,
-    but only if the exit_price is currently NULL.
+    Yields pages of orders with `status` submitted in (after, until], oldest
+    first, until the range is exhausted.
 
-    Args:
-        client: A BigQuery client instance.
-        session_id: The session_id of the trade to update (maps to client_order_id).
-        symbol: The symbol of the trade (for logging).
-        price: The new exit_price to set (the actual filled average price).
+    `after` is exclusive, so each next page starts 1 microsecond before the
+    last order seen, and orders at that boundary which were already yielded
+    are dropped.
+    """
+    boundary_ids: set[str] = set()
+    while True:
+        with api_call("alpaca", "orders"):
+            page = api.list_orders(
+                status=status,
+                limit=page_size,
+                after=after.isoformat(),
+                until=until.isoformat(),
+                direction='asc',
+            )
+        fresh = [order for order in page if order.id not in boundary_ids]
+        if fresh:
+            yield fresh
+        if len(page) < page_size:
+            return
+
+        last = _submitted_at(page[-1])
+        if last - timedelta(microseconds=1) <= after:
+            print(f"Warning: more than {page_size} orders submitted at {last}; skipping the rest of them.")
+            last += timedelta(microseconds=1)
+        boundary_ids = {order.id for order in page if _submitted_at(order) == last}
+        after = last - timedelta(microseconds=1)
+
+def open_order_ids(api: tradeapi.REST, until: datetime, page_size: int = MAX_ORDERS_PAGE) -> set[str]:
+    """Ids of every order submitted up to `until` that is still open."""
+    return {
+        order.id
+        for page in iter_order_pages(api, datetime(1970, 1, 1, tzinfo=timezone.utc), until, page_size, status='open')
+        for order in page
+    }
+
+def fetch_orders(api: tradeapi.REST, order_ids) -> list[Order]:
+    """Fetches orders by id, one request each."""
+    orders = []
+    for order_id in sorted(order_ids):
+        with api_call("alpaca", "order"):
+            orders.append(api.get_order(order_id))
+    return orders
+
+def stage_exit_price(writeback: ColumnWriteBack, order: Order):
+    """Stages the fill price of a filled sell order under its trade's session_id."""
+    if order.side == 'sell' and order.filled_avg_price is not None and order.client_order_id:
+        writeback.add(order.client_order_id, float(order.filled_avg_price))
+
+def sync_closed_orders(api: tradeapi.REST, writeback: ColumnWriteBack, watermark_path: str,
+                       page_size: int = MAX_ORDERS_PAGE, batch_size: int = 5000,
+                       since: datetime | None = None) -> tuple[int, int]:
     """
-    query = f"""
-        UPDATE `{TABLE_ID}`
-        SET exit_price = @price
-        WHERE session_id = @session_id AND exit_price IS NULL
+    Streams every closed order newer than the watermark into `writeback`,
+    flushing and advancing the watermark after every `batch_size` staged
+    exit prices. Orders that were open on the previous run and have closed
+    since are fetched by id and staged first.
+
+    Returns:
+        The number of orders read and the number of trades updated.
     """
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("price", "FLOAT64", price),
-            bigquery.ScalarQueryParameter("session_id", "STRING", session_id),
-        ]
+    # Read `until` before listing open orders: anything submitted up to it
+    # is then either closed (and paged below) or recorded as open.
+    until = datetime.now(timezone.utc)
+    after = since or load_watermark(watermark_path) or SYNC_EPOCH
+    open_ids = open_order_ids(api, until)
+    closed_since = load_open_order_ids(watermark_path) - open_ids
+    print(f"Syncing closed orders submitted after {after.isoformat()}; "
+          f"{len(open_ids)} orders open, {len(closed_since)} previously open orders to re-check.")
+
+    read, updated = 0, 0
+    processed_until = after
+
+    def flush():
+        nonlocal updated
+        outcomes = writeback.flush()
+        updated += sum(1 for outcome in outcomes.values() if outcome == OUTCOME_UPDATED)
+        # Back off by 1 microsecond: orders sharing the last timestamp may be on the next page.
+        save_watermark(watermark_path, max(after, processed_until - timedelta(microseconds=1)), open_ids)
+
+    for order in fetch_orders(api, closed_since):
+        read += 1
+        stage_exit_price(writeback, order)
+
+    for page in iter_order_pages(api, after, until, page_size):
+        read += len(page)
+        count("rows_total", len(page), stage="exit_prices", kind="orders_read")
+        for order in page:
+            # Ascending order: a later fill for the same trade replaces an earlier one.
+            stage_exit_price(writeback, order)
+        processed_until = _submitted_at(page[-1])
+        if len(writeback) >= batch_size:
+            flush()
+            print(f"Processed {read} orders up to {processed_until.isoformat()}; {updated} trades updated.")
+    flush()
+    return read, updated
+
+def parse_args() -> argparse.Namespace:
+    """Parses command-line options."""
+    parser = argparse.ArgumentParser(description="Copy filled sell prices of closed Alpaca orders into trades.exit_price.")
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Page through every closed order since the watermark instead of the last 7 days.",
+    )
+    parser.add_argument(
+        "--watermark",
+        default=DEFAULT_WATERMARK_PATH,
+        help="Watermark file for --sync (default: %(default)s).",
     )
-    
-    print(f"Attempting to update trade {session_id} ({symbol}) with exit_price: {price}")
-    query_job = client.query(query, job_config=job_config)
-    
-    # Wait for the job to complete
-    query_job.result()
-    
-    if query_job.errors:
-        print(f"Error updating trade {session_id}: {query_job.errors}")
-    elif query_job.num_dml_affected_rows > 0:
-        print(f"Successfully updated trade {session_id}.")
-    else:
-        print(f"No update needed for trade {session_id} (already has an exit_price or does not exist).")
+    parser.add_argument(
+        "--since",
+        type=lambda s: datetime.fromisoformat(s).replace(tzinfo=timezone.utc),
+        help="Start --sync at this UTC date instead of the watermark.",
+    )
+    parser.add_argument("--page-size", type=int, default=MAX_ORDERS_PAGE, help="Orders per Alpaca page (max 500).")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Exit prices staged per MERGE in --sync.")
+    return parser.parse_args()
 
+@instrumented
 def main():
     """Main function to orchestrate the synchronization process."""
+    args = parse_args()
     # --- Initialize Clients ---
     try:
         alpaca_api = tradeapi.REST(
@@ -124,9 +270,19 @@ def main():
         print(f"Failed to connect to Alpaca API. Ensure API keys are set correctly. Error: {e}")
         return
 
-    bq_client = bigquery.Client(project=GCP_PROJECT_ID)
+    bq_client = instrument_client(bigquery.Client(project=GCP_PROJECT_ID))
     print("Successfully connected to BigQuery.")
 
+    if args.sync:
+        writeback = ColumnWriteBack(bq_client, TABLE_ID, "exit_price", only_if_null=True)
+        with span("sync_closed_orders"):
+            read, updated = sync_closed_orders(
+                alpaca_api, writeback, args.watermark, min(args.page_size, MAX_ORDERS_PAGE), args.batch_size,
+                args.since
+            )
+        print(f"\nSync complete. Read {read} closed orders and updated {updated} trades.")
+        return
+
     # --- Fetch and Process Closed Orders ---
     closed_orders = get_recently_closed_orders(alpaca_api, limit=500)
 
@@ -134,7 +290,7 @@ def main():
         print("No recently closed orders found to process. Exiting.")
         return
 
-    update_count = 0
+    writeback = ColumnWriteBack(bq_client, TABLE_ID, "exit_price", only_if_null=True)
     for order in closed_orders:
         # We only care about sales that close a position
         if order.side == 'sell' and order.filled_avg_price is not None:
@@ -143,14 +299,22 @@ def main():
             if not session_id:
                 print(f"Skipping order {order.id} because it has no client_order_id.")
                 continue
+            if session_id in writeback:
+                # Orders are newest first; keep the most recent fill.
+                continue
 
             symbol = order.symbol
             filled_price = float(order.filled_avg_price)
             
-            update_trade_exit_price(bq_client, session_id, symbol, filled_price)
-            update_count += 1
+            print(f"Staging trade {session_id} ({symbol}) with exit_price: {filled_price}")
+            writeback.add(session_id, filled_price)
+
+    attempted = len(writeback)
+    outcomes = writeback.flush()
+    log_outcomes(outcomes, "exit_price")
+    updated = sum(1 for outcome in outcomes.values() if outcome == OUTCOME_UPDATED)
 
-    print(f"\nProcessing complete. Attempted to update {update_count} trades based on closed Alpaca orders.")
+    print(f"\nProcessing complete. Updated {updated} of {attempted} trades based on closed Alpaca orders.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,90 @@
+// Golden values for tests/test_indicators.py, computed by the agent's own
+// code: `calculateATR` is evaluated from magi-core.js, and the SMA / RSI /
+// volume lines are copied from `get_price_history`.
+//
+//   node tests/golden/indicators.cjs > tests/golden/indicators.json
+const fs = require('fs');
+const path = require('path');
+const src = fs.readFileSync(path.join(__dirname, '..', '..', 'magi-core.js'), 'utf8');
+const atrSrc = src.match(/function calculateATR\(bars, period\) \{[\s\S]*?\n\}\n/)[0];
+const calculateATR = eval('(' + atrSrc + ')');
+
+// [high, low, close, volume] per day: a random walk, and a steady uptrend
+// without any losing day (RSI 100).
+const data = {
+  A: [
+  [100.23, 97.96, 98.94, 175954],
+  [101.01, 98.07, 100.87, 632084],
+  [101.0, 98.53, 99.16, 352353],
+  [99.8, 95.46, 96.7, 229815],
+  [100.33, 95.83, 99.38, 164867],
+  [100.44, 97.92, 99.84, 148845],
+  [100.38, 99.21, 100.18, 666950],
+  [100.64, 96.67, 97.89, 289505],
+  [98.75, 95.23, 95.51, 202163],
+  [95.89, 95.42, 95.8, 315963],
+  [96.6, 94.61, 95.78, 588218],
+  [96.97, 95.33, 96.29, 288499],
+  [97.85, 95.43, 97.48, 650708],
+  [98.0, 96.78, 97.45, 738539],
+  [100.51, 96.82, 100.33, 893919],
+  [101.73, 98.75, 99.38, 800675],
+  [100.22, 95.67, 96.85, 428988],
+  [97.38, 95.14, 95.89, 578365],
+  [96.03, 92.9, 93.3, 830901],
+  [94.37, 92.25, 94.28, 778563],
+  [95.77, 93.61, 94.75, 851438],
+  [95.75, 94.03, 94.06, 584122],
+  [94.98, 92.45, 93.19, 328807],
+  [94.99, 92.82, 94.8, 509940],
+  [98.04, 94.55, 97.3, 521154],
+  [98.93, 96.07, 97.6, 676947],
+  [98.22, 95.73, 96.27, 498921],
+  [99.25, 96.01, 99.02, 343224],
+  [99.99, 97.77, 99.97, 291200],
+  [99.98, 97.92, 98.55, 487190]
+  ],
+  B: Array.from({ length: 30 }, (_, i) => [
+    Math.round((50.25 + i * 0.5) * 100) / 100, Math.round((49.75 + i * 0.5) * 100) / 100,
+    Math.round((50 + i * 0.5) * 100) / 100, 200000 + i * 1000,
+  ]),
+};
+const out = { bars: data };
+for (const [sym, rows] of Object.entries(data)) {
+  const bars = rows.map(([h, l, c, v]) => ({ h, l, c, v }));
+  const res = { atr21: [], atr20: [], sma5: [], sma20: [], rsi14: [], avg_volume: [], volume_ratio: [] };
+  for (let t = 0; t < bars.length; t++) {
+    for (const [key, w] of [['atr21', 21], ['atr20', 20]]) {
+      const a = calculateATR(bars.slice(Math.max(0, t - w + 1), t + 1), 14);
+      res[key].push(a);
+    }
+    // get_price_history: the last 20 bars ending on day t
+    const win = bars.slice(Math.max(0, t - 19), t + 1);
+    const closes = win.map(b => b.c);
+    const volumes = win.map(b => b.v);
+    const sma5 = closes.length >= 5 ? closes.slice(-5).reduce((a, b) => a + b, 0) / 5 : null;
+    const sma20 = closes.length >= 20 ? closes.slice(-20).reduce((a, b) => a + b, 0) / 20 : null;
+    let rsi14 = null;
+    if (closes.length >= 15) {
+      let gains = 0, losses = 0;
+      for (let i = closes.length - 14; i < closes.length; i++) {
+        const diff = closes[i] - closes[i - 1];
+        if (diff > 0) gains += diff;
+        else losses -= diff;
+      }
+      const avgGain = gains / 14;
+      const avgLoss = losses / 14;
+      rsi14 = avgLoss === 0 ? 100 : Math.round(100 - (100 / (1 + avgGain / avgLoss)));
+    }
+    const avgVolume = Math.round(volumes.reduce((a, b) => a + b, 0) / volumes.length);
+    const volumeRatio = (volumes[volumes.length - 1] / avgVolume).toFixed(2);
+    res.sma5.push(sma5); res.sma20.push(sma20); res.rsi14.push(rsi14);
+    res.avg_volume.push(avgVolume); res.volume_ratio.push(volumeRatio);
+  }
+  out[sym] = res;
+}
+const fixedCases = [[1.005, 2], [2.675, 2], [1.45, 1], [8.345, 2], [-1.005, 2], [0.5, 0], [-0.5, 0], [1.5, 0], [2.5, 0], [-2.5, 0], [0.125, 2], [123.456789, 4], [1e-7, 4], [-0.0001, 2], [99.995, 2], [4503599627370497, 0]];
+out.to_fixed = fixedCases.map(([x, d]) => [x, d, x.toFixed(d)]);
+const roundCases = [0.5, -0.5, 1.5, -1.5, 2.5, -2.5, 0.49999999999999994, -0.49999999999999994, 4503599627370497, -4503599627370497, 2.4999999999999996, 1e16 + 2, -0.0];
+out.round = roundCases.map(x => [x, Math.round(x)]);
+console.log(JSON.stringify(out));
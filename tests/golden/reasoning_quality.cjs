@@ -0,0 +1,64 @@
+// Golden values for tests/test_reasoning_quality.py: `analyzeReasoningQuality`
+// evaluated from magi-core.js on strings where JS and Python regex, case
+// and length semantics could differ.
+//
+//   node tests/golden/reasoning_quality.cjs > tests/golden/reasoning_quality.json
+const fs = require('fs');
+const path = require('path');
+const src = fs.readFileSync(path.join(__dirname, '..', '..', 'magi-core.js'), 'utf8');
+const fnSrc = src.match(/function analyzeReasoningQuality\([\s\S]*?\n\}\n/)[0];
+const analyzeReasoningQuality = eval('(' + fnSrc + ')');
+
+const cases = [
+  // No pattern uses \b: substrings match inside words ("ema" in "emaciated").
+  ['emaciated versions of the trendline', null],
+  ['no indicators here at all', 'short'],
+  // Case folding happens before matching.
+  ['RSI OVERSOLD, MOMENTUM and RISK of a STOP-LOSS', 'Hypothesis in CAPITALS here'],
+  ['Moving Average cross, TARGET $150', null],
+  ['İNDICATOR RSİ with dotted capital I', null],
+  ['Kelvin sign and ΑΣ final sigma TREND', null],
+  ['ＲＳＩ fullwidth letters', null],
+  // JS \d is ASCII only.
+  ['up ５０% in fullwidth digits', null],
+  ['٣٠% arabic-indic digits', null],
+  ['up 12.5% on 3x volume, $42', null],
+  ['2倍の出来高', null],
+  // JS \s: these are whitespace...
+  ['1\u00A0day', null], ['1\u3000week', null], ['1\u2028month', null], ['1\uFEFFday', null],
+  ['1\u2003day', null], ['1\u200Aweek', null], ['1\u202Fmonth', null], ['1\u000Bday', null],
+  // ...and these are not, although \x85 and \x1c are for Python's \s.
+  ['1\u0085day', null], ['1\u200Bday', null], ['1\u180Eday', null], ['1\u001Cday', null],
+  ['1  day', null], ['1day', null],
+  // JS . excludes only \n, \r, \u2028 and \u2029.
+  ['short\nterm', null], ['short\rterm', null], ['short\u2028term', null], ['long\u2029term', null],
+  ['short\u0085term', null], ['short-term', null], ['long\u2009term', null], ['against\ttrend', null],
+  ['against\ntrend', null], ['stop\nloss', null], ['stop\u0085loss', null], ['stop loss', null],
+  ['3 hours', null], ['1 hour', null],
+  // Japanese keywords.
+  ['移動平均が上昇し、リスクは小さい', null],
+  ['底値で逆張り、天井は遠い', null],
+  ['週足で継続、損切に注意、懸念なし', null],
+  // Hopeful and contrarian words.
+  ['I hope it might bounce, maybe', null], ['contrarian play, due for a move', null],
+  // Length is counted in UTF-16 code units: astral characters count twice.
+  ['\u{1F4C8}'.repeat(50), '\u{1F4C9}'.repeat(10)],
+  ['\u{1F680}'.repeat(49) + 'a', '\u{1F4C9}'.repeat(9) + 'a'],
+  ['上昇'.repeat(50), '上昇'.repeat(10)],
+  ['上昇'.repeat(49) + 'a', '上昇'.repeat(9) + 'a'],
+  ['\u{1F468}\u200D\u{1F469}\u200D\u{1F467}'.repeat(12) + 'abcd', null],
+  ['x'.repeat(99), 'x'.repeat(19)],
+  ['x'.repeat(100), 'x'.repeat(20)],
+  // Missing and empty values.
+  [null, null], ['', ''], [null, 'a hypothesis long enough'],
+];
+
+const out = cases.map(([reasoning, hypothesis]) => {
+  const { score, total } = analyzeReasoningQuality(reasoning, hypothesis, 0.5);
+  return {
+    reasoning, hypothesis, score, total,
+    reasoningLength: reasoning == null ? null : reasoning.length,
+    hypothesisLength: hypothesis == null ? null : hypothesis.length,
+  };
+});
+console.log(JSON.stringify(out, null, 1));
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+`indicators.py` against values computed by `magi-core.js` itself
+(`golden/indicators.cjs`). Day `t` of each series is what the agent computes
+when its bar request ends on day `t`.
+"""
+
+import numpy as np
+import pytest
+
+from indicators import js_atr, js_round, js_rsi, js_to_fixed, sma, volume_stats
+
+SYMBOLS = ("A", "B")
+
+
+@pytest.fixture(scope="module")
+def data(golden):
+    return golden("indicators")
+
+
+@pytest.fixture(scope="module")
+def bars(data):
+    """(symbols x days) matrices of high, low, close and volume."""
+    stacked = np.array([data["bars"][s] for s in SYMBOLS], dtype=float)
+    return {name: stacked[..., i] for i, name in enumerate(("high", "low", "close", "volume"))}
+
+
+def expected(data, key):
+    """The golden series of every symbol, with JS null as NaN."""
+    return np.array([[np.nan if v is None else float(v) for v in data[s][key]] for s in SYMBOLS])
+
+
+@pytest.mark.parametrize("window", [20, 21])
+def test_js_atr(data, bars, window):
+    got = js_atr(bars["high"], bars["low"], bars["close"], 14, window)
+    # The recurrence is evaluated as a dot product, so only the summation order differs.
+    np.testing.assert_allclose(got, expected(data, f"atr{window}"), rtol=1e-12, atol=0)
+
+
+def test_js_atr_short_history(data, bars):
+    """Fewer than 15 bars give no ATR; then the window grows until it is full."""
+    got = js_atr(bars["high"], bars["low"], bars["close"])
+    assert np.isnan(got[:, :14]).all()
+    assert not np.isnan(got[:, 14:]).any()
+
+
+def test_sma_matches_reduce_exactly(data, bars):
+    np.testing.assert_array_equal(sma(bars["close"], 5), expected(data, "sma5"))
+    np.testing.assert_array_equal(sma(bars["close"], 20), expected(data, "sma20"))
+
+
+def test_js_rsi(data, bars):
+    got = js_rsi(bars["close"])
+    np.testing.assert_array_equal(got, expected(data, "rsi14"))
+    # The uptrend never has a loss.
+    assert (got[1, 14:] == 100).all()
+
+
+def test_volume_stats(data, bars):
+    avg_volume, ratio = volume_stats(bars["volume"])
+    np.testing.assert_array_equal(avg_volume, expected(data, "avg_volume"))
+    np.testing.assert_array_equal(js_to_fixed(ratio, 2), expected(data, "volume_ratio"))
+
+
+def test_js_to_fixed(data):
+    values = np.array([value for value, _, _ in data["to_fixed"]])
+    for value, digits, text in data["to_fixed"]:
+        assert js_to_fixed(np.array([value]), digits)[0] == float(text), (value, digits, text)
+    assert js_to_fixed(values, 2).shape == values.shape
+    assert np.isnan(js_to_fixed(np.array([np.nan]), 2)[0])
+
+
+def test_js_round(data):
+    values = np.array([value for value, _ in data["round"]])
+    np.testing.assert_array_equal(js_round(values), [result for _, result in data["round"]])
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+`reasoning_quality.py` against `analyzeReasoningQuality` run under node
+(`golden/reasoning_quality.cjs`), and the process-pool path of `score_many`
+against the in-process one.
+"""
+
+import pytest
+
+import reasoning_quality
+from reasoning_quality import (
+    POOL_THRESHOLD,
+    analyze_reasoning_quality,
+    bitmask_to_factors,
+    factors_to_bitmask,
+    js_length,
+    quality_bitmask,
+    score_many,
+)
+
+
+@pytest.fixture(scope="module")
+def cases(golden):
+    return golden("reasoning_quality")
+
+
+def test_factors_match_js(cases):
+    for case in cases:
+        result = analyze_reasoning_quality(case["reasoning"], case["hypothesis"])
+        assert result["score"] == case["score"], repr(case["reasoning"])
+        assert result["total"] == case["total"], repr(case["reasoning"])
+        assert result["maxScore"] == 10
+
+
+def test_js_length_counts_utf16_code_units(cases):
+    for case in cases:
+        for key in ("reasoning", "hypothesis"):
+            if case[key] is not None:
+                assert js_length(case[key]) == case[f"{key}Length"], repr(case[key])
+    # The corpus must contain strings where `len` would be wrong.
+    assert any(c["reasoning"] and len(c["reasoning"]) != c["reasoningLength"] for c in cases)
+
+
+def test_bitmask_round_trip(cases):
+    for case in cases:
+        mask = quality_bitmask(case["reasoning"], case["hypothesis"])
+        assert bitmask_to_factors(mask) == case["score"]
+        assert factors_to_bitmask(case["score"]) == mask
+        assert bin(mask).count("1") == case["total"]
+
+
+def test_score_many_serial_matches_golden(cases):
+    pairs = [(c["reasoning"], c["hypothesis"]) for c in cases]
+    assert score_many(pairs, processes=1) == [factors_to_bitmask(c["score"]) for c in cases]
+
+
+def test_score_many_pool_matches_serial(cases, monkeypatch):
+    pairs = [(c["reasoning"], c["hypothesis"]) for c in cases]
+    # Above the threshold, with uneven chunks, so order across workers matters.
+    batch = (pairs * (POOL_THRESHOLD // len(pairs) + 2))[:POOL_THRESHOLD + 7]
+    expected = [factors_to_bitmask(c["score"]) for c in cases]
+    expected = (expected * (POOL_THRESHOLD // len(expected) + 2))[:len(batch)]
+
+    pools = []
+    real_pool = reasoning_quality.Pool
+
+    def spy_pool(*args, **kwargs):
+        pools.append(args)
+        return real_pool(*args, **kwargs)
+
+    monkeypatch.setattr(reasoning_quality, "Pool", spy_pool)
+    pooled = score_many(batch, processes=2, chunk_size=997)
+    assert pools, "score_many did not use the process pool"
+    assert pooled == score_many(batch, processes=1) == expected